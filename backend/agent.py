@@ -1,50 +1,194 @@
 import os
+import re
 import json
+import time
 import random
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 from typing import List, Dict, Any, Optional
-from groq import Groq
-from openai import AzureOpenAI
 from catalog import ProductCatalog
+from sessions import Session
+from tool_output import ToolResult, compact_products_json
+from llm_cache import create_response_cache
+from intents import parse_message, ContextIndex
+from orders import OutOfStock, place_order
+from singleflight import SingleFlight
+from gateway import Overloaded, Provider, ProviderGateway
+from telemetry import record, span
+
+# Bounded pool for blocking catalog/SQLite work so it never runs on the event loop
+TOOL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("TOOL_EXECUTOR_WORKERS", 16)),
+    thread_name_prefix="tool",
+)
+
+# Tools that read or mutate the cart run one after another, in the order the
+# model issued them; everything else may run concurrently.
+CART_TOOLS = {"add_to_cart", "checkout", "get_cart"}
+
+# Products per browse_products page handed to the model
+BROWSE_PAGE_SIZE = int(os.getenv("BROWSE_PAGE_SIZE", 10))
+
+def _tool_name(tool_call) -> str:
+    if isinstance(tool_call, dict):
+        return tool_call["function"]["name"]
+    return tool_call.function.name
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context (request trace) into the worker thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(TOOL_EXECUTOR, functools.partial(context.run, func, *args, **kwargs))
+
+class HistoryManager:
+    """Keeps the prompt sent to the LLM inside a token budget.
+
+    The caller's history is never modified; compact() returns the list to send:
+    1. Tool payloads (and product-list replies) from earlier turns are rewritten
+       into short id/name/price summaries. The current turn is left intact.
+    2. If the prompt is still over budget, the oldest whole turns are dropped
+       and replaced by a one-line note of what the shopper asked for.
+    """
+
+    SUMMARY_FIELDS = ("id", "name", "price")
+    MAX_TEXT_PAYLOAD = 300  # chars kept from a non-JSON tool payload
+
+    def __init__(self, token_budget: Optional[int] = None, chars_per_token: float = 4.0):
+        self.token_budget = token_budget or int(os.getenv("HISTORY_TOKEN_BUDGET", 3000))
+        self.chars_per_token = chars_per_token
+        self.requests = 0
+        self.tokens_saved = 0
+
+    def estimate_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        # Rough chars/token heuristic plus a small per-message overhead
+        chars = 0
+        for m in messages:
+            chars += len(str(m.get("content") or ""))
+            for tc in m.get("tool_calls") or []:
+                chars += len(tc["function"]["arguments"] if isinstance(tc, dict) else tc.function.arguments)
+        return int(chars / self.chars_per_token) + 4 * len(messages)
+
+    def summarize_payload(self, content: str) -> str:
+        try:
+            data = json.loads(content)
+        except (TypeError, ValueError):
+            return content if len(content) <= self.MAX_TEXT_PAYLOAD else content[:self.MAX_TEXT_PAYLOAD] + "..."
+
+        if isinstance(data, list) and all(isinstance(p, dict) and "id" in p for p in data):
+            summary = [{k: p[k] for k in self.SUMMARY_FIELDS if k in p} for p in data]
+            return json.dumps(summary, separators=(",", ":"))
+        return content
+
+    def _is_product_list(self, m: Dict[str, Any]) -> bool:
+        content = str(m.get("content") or "").strip()
+        return m["role"] == "assistant" and content.startswith("[") and content.endswith("]")
+
+    def compact(self, messages: List[Dict[str, Any]]) -> tuple:
+        """Returns (messages_to_send, stats)."""
+        before = self.estimate_tokens(messages)
+
+        # Everything before the latest user message belongs to earlier turns
+        last_user = max((i for i, m in enumerate(messages) if m["role"] == "user"), default=len(messages))
+        head = [m for m in messages[:1] if m["role"] == "system"]
+        older = messages[len(head):last_user]
+        current = messages[last_user:]
+
+        compacted = []
+        for m in older:
+            if m["role"] == "tool" or self._is_product_list(m):
+                m = {**m, "content": self.summarize_payload(str(m.get("content") or ""))}
+            compacted.append(m)
+
+        # Still too big: drop whole turns (user message + replies/tools) oldest first,
+        # so a tool message never loses the assistant message that called it
+        dropped_requests = []
+        while compacted and self.estimate_tokens(head + compacted + current) > self.token_budget:
+            dropped = [compacted.pop(0)]
+            while compacted and compacted[0]["role"] != "user":
+                dropped.append(compacted.pop(0))
+            dropped_requests += [str(m.get("content") or "")[:60] for m in dropped if m["role"] == "user"]
+
+        if dropped_requests:
+            head = head + [{
+                "role": "system",
+                "content": "Earlier in this conversation the shopper asked about: " + "; ".join(dropped_requests)
+            }]
+
+        result = head + compacted + current
+        after = self.estimate_tokens(result)
+
+        self.requests += 1
+        self.tokens_saved += max(before - after, 0)
+        return result, {"tokens_before": before, "tokens_after": after, "tokens_saved": before - after}
 
 class ShopperAgent:
+    # One instance per process: the LLM clients and the catalog are shared,
+    # per-shopper state (the cart) lives in a Session passed to the tools.
     def __init__(self):
         self.catalog = ProductCatalog()
-        self.cart = []
-        
-        # Default to Groq
-        self.provider = "groq" 
-        self.client = None
-        self.model = "llama-3.1-8b-instant"
-        
-        self._setup_client()
-
-    def _setup_client(self):
-        # Check environment variables for Azure preference
-        # In a real app, this might be dynamic per request or user config
-        azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-        azure_key = os.getenv("AZURE_OPENAI_API_KEY")
+        self.history = HistoryManager()
+        self.response_cache = create_response_cache()
+        # Cache misses for the same prompt at the same moment share one call
+        # (chat/achat; streamed answers are per-client and aren't coalesced)
+        self.llm_flights = SingleFlight("llm")
         
-        if os.getenv("USE_AZURE_OPENAI") == "true" and azure_endpoint and azure_key:
-            self.provider = "azure"
-            self.client = AzureOpenAI(
-                azure_endpoint=azure_endpoint,
-                api_key=azure_key,
-                api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
-            )
-            self.model = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o")
-            print(f"Agent initialized with Azure OpenAI: {self.model}")
+        # Providers are picked from the environment now; their SDKs are imported
+        # and the clients built on first use (or by warm_up_client), so
+        # importing this module never pays for groq/openai. Every call goes
+        # through the gateway (limits, retries, fallback down the chain)
+        self.gateway = ProviderGateway(self._select_providers())
+        self.provider, self.model = self.gateway.primary.name, self.gateway.primary.model
+
+    def _select_providers(self) -> List[Provider]:
+        """The fallback chain: LLM_PROVIDERS (e.g. "groq,azure,mock"), or
+        Azure (if USE_AZURE_OPENAI=true) then Groq. Unconfigured providers
+        are skipped; mock is used when nothing else is left."""
+        models = {"azure": os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o"), "groq": "llama-3.1-8b-instant", "mock": "llama-3.1-8b-instant"}
+        configured = {
+            "azure": bool(os.getenv("AZURE_OPENAI_ENDPOINT") and os.getenv("AZURE_OPENAI_API_KEY")),
+            "groq": bool(os.getenv("GROQ_API_KEY")),
+            "mock": True,
+        }
+        if os.getenv("LLM_PROVIDERS"):
+            names = [n.strip().lower() for n in os.getenv("LLM_PROVIDERS").split(",") if n.strip()]
+            for name in names:
+                if not configured.get(name):
+                    print(f"Warning: LLM provider '{name}' is unknown or not configured, skipping it.")
         else:
-            self.provider = "groq"
+            names = (["azure"] if os.getenv("USE_AZURE_OPENAI") == "true" else []) + ["groq"]
+        chain = [n for n in dict.fromkeys(names) if configured.get(n)]
+        if not chain:
+            print("Warning: GROQ_API_KEY not set. Switching to MOCK mode.")
+            chain = ["mock"]
+        return [Provider(name, models[name], functools.partial(self._build_clients, name, models[name])) for name in chain]
+
+    @staticmethod
+    def _build_clients(provider: str, model: str) -> tuple:
+        """(sync, async) clients for a provider. SDK retries are off: the gateway retries."""
+        if provider == "azure":
+            from openai import AzureOpenAI, AsyncAzureOpenAI
+            azure_kwargs = dict(
+                azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-12-01-preview"),
+                max_retries=0,
+            )
+            print(f"Agent initialized with Azure OpenAI: {model}")
+            return AzureOpenAI(**azure_kwargs), AsyncAzureOpenAI(**azure_kwargs)
+        if provider == "groq":
+            from groq import Groq, AsyncGroq
             api_key = os.getenv("GROQ_API_KEY")
-            if not api_key:
-                print("Warning: GROQ_API_KEY not set. Switching to MOCK mode.")
-                self.provider = "mock"
-                self.client =  MockClient()
-            else:
-                self.client = Groq(api_key=api_key)
-                print(f"Agent initialized with Groq: {self.model}")
-
+            print(f"Agent initialized with Groq: {model}")
+            return Groq(api_key=api_key, max_retries=0), AsyncGroq(api_key=api_key, max_retries=0)
+        client = MockClient()
+        return client, AsyncMockClient(client)
 
+    def warm_up_client(self):
+        """Import the provider SDKs and build every provider's clients, once."""
+        self.gateway.warm_up()
 
     def get_system_prompt(self) -> str:
         return """You are a sophisticated, friendly, and expert Personal Shopper AI.
@@ -56,6 +200,7 @@ When searching, be creative with tags.
 
 You can also:
 - Create "Lookbooks" (collections of items) using retrieval.
+- Page through larger result sets, filter by price range and see what colors, categories and price bands are available using `browse_products`.
 - Add items to the cart using `add_to_cart`.
 - Checkout using `checkout`.
 
@@ -79,7 +224,32 @@ Keep responses concise but helpful. ask clarifying questions if the user request
                         "properties": {
                             "query": {"type": "string", "description": "Free text search query (e.g., 'red dress', 'steamer')"},
                             "category": {"type": "string", "description": "Category filter (e.g., 'Clothing', 'Accessories')"},
-                            "tags": {"type": "array", "items": {"type": "string"}, "description": "List of tags to filter by"}
+                            "tags": {"type": "array", "items": {"type": "string"}, "description": "List of tags to filter by"},
+                            "in_stock": {"type": "boolean", "description": "Only return products that are currently in stock"}
+                        },
+                        "required": []
+                    }
+                }
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "browse_products",
+                    "description": "Browse the catalog page by page with price-range filters. The first page also reports "
+                                   "how many matches there are per category, color, demographic and price band. "
+                                   "Pass the returned next_cursor to get the following page.",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "query": {"type": "string", "description": "Free text search query (e.g., 'red dress')"},
+                            "category": {"type": "string", "description": "Category filter (e.g., 'Clothing', 'Accessories')"},
+                            "color": {"type": "string", "description": "Color filter (e.g., 'navy')"},
+                            "demographic": {"type": "string", "enum": ["women", "men", "girl", "boy"]},
+                            "min_price": {"type": "number", "description": "Lowest price to include"},
+                            "max_price": {"type": "number", "description": "Highest price to include"},
+                            "in_stock": {"type": "boolean", "description": "Only return products that are currently in stock"},
+                            "sort": {"type": "string", "enum": ["relevance", "price_asc", "price_desc"]},
+                            "cursor": {"type": "string", "description": "next_cursor from the previous page of the same search"}
                         },
                         "required": []
                     }
@@ -125,33 +295,202 @@ Keep responses concise but helpful. ask clarifying questions if the user request
             }
         ]
 
-    def chat(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    def _prepare(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
         # Append system prompt if not present
         if not messages or messages[0]["role"] != "system":
             messages.insert(0, {"role": "system", "content": self.get_system_prompt()})
 
+        prompt, stats = self.history.compact(messages)
+        if stats["tokens_saved"] > 0:
+            print(f"History compacted: {stats['tokens_before']} -> {stats['tokens_after']} tokens (saved {stats['tokens_saved']})")
+
+        return dict(
+            model=self.model,
+            messages=prompt,
+            tools=self.tools_schema(),
+            tool_choice="auto",
+            max_tokens=1024
+        )
+
+    def _to_message(self, response) -> Dict[str, Any]:
+        assistant_msg = response.choices[0].message
+        # Plain dicts (the wire format): cacheable, and valid to send back as history
+        tool_calls = [
+            {"id": tc.id, "type": "function", "function": {"name": tc.function.name, "arguments": tc.function.arguments}}
+            for tc in assistant_msg.tool_calls or []
+        ]
+        return {
+            "content": assistant_msg.content,
+            "tool_calls": tool_calls or None,
+            "role": "assistant"
+        }
+
+    def _error_message(self, e: Exception) -> Dict[str, Any]:
+        return {
+            "content": f"I apologize, but I encountered an error: {str(e)}",
+            "role": "assistant"
+        }
+
+    def chat(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        request = self._prepare(messages)
+        cached = self.response_cache.get(request)
+        if cached:
+            return cached
+
+        def complete():
+            provider, response = self.gateway.complete(request)
+            return self._remember(request, provider, self._to_message(response))
+
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                tools=self.tools_schema(),
-                tool_choice="auto",
-                max_tokens=1024
-            )
+            # Identical prompts in flight together share one provider call
+            with span("llm_call"):
+                message = self.llm_flights.do(self.response_cache.flight_key(request), complete)
+        except Overloaded:
+            # Shed: the endpoint answers 429/503 rather than an apology
+            raise
+        except Exception as e:
+            return self._error_message(e)
+        return dict(message)
+
+    def _remember(self, request: Dict[str, Any], provider: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        # A fallback's answer is served but not cached: the primary should
+        # answer this prompt again once it's back
+        if provider == self.provider:
+            self.response_cache.put(request, message)
+        return message
+
+    async def achat(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Non-blocking variant of chat() for the FastAPI event loop."""
+        request = self._prepare(messages)
+        cached = await self.response_cache.aget(request)
+        if cached:
+            return cached
+
+        async def complete():
+            provider, response = await self.gateway.acomplete(request)
+            return self._remember(request, provider, self._to_message(response))
 
-            assistant_msg = response.choices[0].message
-            return {
-                "content": assistant_msg.content,
-                "tool_calls": assistant_msg.tool_calls,
-                "role": "assistant"
-            }
+        try:
+            with span("llm_call"):
+                message = await self.llm_flights.ado(self.response_cache.flight_key(request), complete)
+        except Overloaded:
+            raise
         except Exception as e:
-            return {
-                "content": f"I apologize, but I encountered an error: {str(e)}",
-                "role": "assistant"
-            }
+            return self._error_message(e)
+        return dict(message)
+
+    async def astream(self, messages: List[Dict[str, str]]):
+        """Stream one completion as events.
+
+        Yields {"type": "token", "content": ...} for every content delta and
+        finishes with {"type": "message", "message": ...}, the assembled
+        assistant message (tool_calls as plain dicts so they can go straight
+        back into the history).
+        """
+        request = self._prepare(messages)
+        cached = await self.response_cache.aget(request)
+        if cached:
+            # Replay a cached answer as a single delta
+            if cached.get("content"):
+                yield {"type": "token", "content": cached["content"]}
+            yield {"type": "message", "message": cached}
+            return
+
+        content_parts = []
+        calls: Dict[int, Dict[str, Any]] = {}
+        # Timed by hand: a context manager can't stay open across this generator's yields
+        started = time.perf_counter()
+
+        try:
+            # Holds the provider's concurrency slot until the stream is drained
+            async with self.gateway.astream(request) as (provider, stream):
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+
+                    if delta.content:
+                        content_parts.append(delta.content)
+                        yield {"type": "token", "content": delta.content}
+
+                    # Tool calls arrive in fragments keyed by index
+                    for fragment in delta.tool_calls or []:
+                        call = calls.setdefault(fragment.index, {
+                            "id": None, "type": "function", "function": {"name": "", "arguments": ""}
+                        })
+                        if fragment.id:
+                            call["id"] = fragment.id
+                        if fragment.function:
+                            call["function"]["name"] += fragment.function.name or ""
+                            call["function"]["arguments"] += fragment.function.arguments or ""
+        except Overloaded:
+            record("llm_call", time.perf_counter() - started)
+            raise
+        except Exception as e:
+            record("llm_call", time.perf_counter() - started)
+            message = self._error_message(e)
+            yield {"type": "token", "content": message["content"]}
+            yield {"type": "message", "message": message}
+            return
+
+        record("llm_call", time.perf_counter() - started)
+        message = {
+            "role": "assistant",
+            "content": "".join(content_parts) or None,
+            "tool_calls": [calls[i] for i in sorted(calls)] or None,
+        }
+        self._remember(request, provider, message)
+        yield {"type": "message", "message": message}
+
+    async def aexecute_tool(self, tool_call, session: Session) -> ToolResult:
+        # Catalog lookups hit SQLite, so run them on the bounded tool executor
+        return await run_blocking(self.execute_tool, tool_call, session)
+
+    async def aiter_tool_results(self, tool_calls: List[Any], session: Session):
+        """Run one assistant turn's tool calls, yielding (index, result) as each finishes.
+
+        Independent tools each get their own task on the bounded executor;
+        cart tools share a single ordered lane so add_to_cart/checkout/get_cart
+        see each other's effects in order.
+        """
+        cart_lane = [i for i, tc in enumerate(tool_calls) if _tool_name(tc) in CART_TOOLS]
+        lanes = [[i] for i, tc in enumerate(tool_calls) if _tool_name(tc) not in CART_TOOLS]
+        if cart_lane:
+            lanes.append(cart_lane)
+
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def run_lane(lane: List[int]):
+            for i in lane:
+                try:
+                    queue.put_nowait((i, await self.aexecute_tool(tool_calls[i], session), None))
+                except Exception as e:
+                    queue.put_nowait((i, None, e))
+                    return
+
+        tasks = [asyncio.create_task(run_lane(lane)) for lane in lanes]
+        try:
+            for _ in range(len(tool_calls)):
+                i, result, error = await queue.get()
+                if error:
+                    raise error
+                yield i, result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def aexecute_tools(self, tool_calls: List[Any], session: Session) -> List[ToolResult]:
+        """Results in the original tool_call order, so the history stays deterministic."""
+        results: List[Optional[ToolResult]] = [None] * len(tool_calls)
+        async for i, result in self.aiter_tool_results(tool_calls, session):
+            results[i] = result
+        return results
+
+    def execute_tool(self, tool_call, session: Session) -> ToolResult:
+        if isinstance(tool_call, dict):
+            # Tool calls travel through the agent as plain dicts
+            tool_call = SimpleNamespace(id=tool_call["id"], function=SimpleNamespace(**tool_call["function"]))
 
-    def execute_tool(self, tool_call) -> str:
         name = tool_call.function.name
         try:
             args = json.loads(tool_call.function.arguments)
@@ -159,49 +498,93 @@ Keep responses concise but helpful. ask clarifying questions if the user request
             args = {}
             
         print(f"Executing tool: {name} with args: {args}")
+        with span(f"tool:{name}"):
+            return self._run_tool(name, args, session)
 
+    def _run_tool(self, name: str, args: Dict[str, Any], session: Session) -> ToolResult:
         if name == "search_products":
             results = self.catalog.search_products(
                 query=args.get("query", ""),
                 category=args.get("category", ""),
-                tags=args.get("tags", [])
+                tags=args.get("tags", []),
+                in_stock=bool(args.get("in_stock", False))
             )
-            return json.dumps(results)
-            
+            # Compact rows for the LLM, full product cards for the UI
+            with span("serialize"):
+                content = compact_products_json(results)
+            return ToolResult(content, products=results)
+
+        elif name == "browse_products":
+            try:
+                page = self.catalog.search_page(
+                    query=args.get("query", ""),
+                    category=args.get("category", ""),
+                    color=args.get("color", ""),
+                    demographic=args.get("demographic", ""),
+                    min_price=args.get("min_price"),
+                    max_price=args.get("max_price"),
+                    in_stock=bool(args.get("in_stock", False)),
+                    sort=args.get("sort") or "relevance",
+                    cursor=args.get("cursor"),
+                    limit=BROWSE_PAGE_SIZE,
+                )
+            except ValueError as e:
+                return ToolResult(json.dumps({"status": "error", "message": str(e)}))
+            products = page["products"]
+            summary = {"next_cursor": page["next_cursor"]}
+            if page["facets"]:
+                # value -> count is all the model needs to suggest a refinement
+                facets = page["facets"]
+                summary["total"] = facets["total"]
+                summary["facets"] = {name: {f["value"]: f["count"] for f in facets[name]} for name in ("category", "color", "demographic", "price")}
+            with span("serialize"):
+                content = '{"items":' + compact_products_json(products) + "," + json.dumps(summary, separators=(",", ":"))[1:]
+            return ToolResult(content, products=products)
+
         elif name == "add_to_cart":
             p_id = args.get("product_id")
             product = self.catalog.get_product_by_id(p_id)
             if product:
-                self.cart.append(product)
-                return json.dumps({"status": "success", "message": f"Added {product['name']} to cart.", "cart_size": len(self.cart)})
+                session.add_item(product)
+                return ToolResult(json.dumps({"status": "success", "message": f"Added {product['name']} to cart.", "cart_size": session.cart.count, "subtotal": session.cart.subtotal}))
             else:
-                return json.dumps({"status": "error", "message": "Product not found."})
+                return ToolResult(json.dumps({"status": "error", "message": "Product not found."}))
                 
         elif name == "checkout":
-            if not self.cart:
-                 return json.dumps({"status": "error", "message": "Cart is empty."})
-            
-            # Mock checkout
-            order_id = f"ORD-{random.randint(1000, 9999)}"
-            total = sum(p["price"] for p in self.cart)
-            items = [p["name"] for p in self.cart]
-            self.cart = [] # Clear cart
-            return json.dumps({
-                "status": "success", 
-                "order_id": order_id, 
-                "total": total, 
-                "message": f"Order {order_id} placed successfully for {', '.join(items)}."
-            })
+            # Claimed (emptied) up front: a double submit finds an empty cart
+            lines, cart_key = session.claim_cart()
+            if not lines:
+                 return ToolResult(json.dumps({"status": "error", "message": "Cart is empty."}))
+
+            # Stock is reserved and the order recorded in one transaction (orders.py)
+            try:
+                order = place_order(session.id, lines, cart_key=cart_key)
+            except OutOfStock as e:
+                # Nothing was reserved; the cart comes back so the shopper can adjust it
+                session.restore_cart(lines)
+                return ToolResult(json.dumps({"status": "error", "message": str(e), "unavailable": e.items}))
+            except Exception:
+                session.restore_cart(lines)
+                raise
+            items = [item["name"] if item["qty"] == 1 else f"{item['name']} x{item['qty']}" for item in order["items"]]
+            return ToolResult(json.dumps({
+                "status": "success",
+                "order_id": order["order_id"],
+                "total": order["total"],
+                "message": f"Order {order['order_id']} placed successfully for {', '.join(items)}."
+            }))
 
         elif name == "get_cart":
-             return json.dumps(self.cart)
+             cart = session.to_dict()["cart"]
+             summary = {**cart, "message": f"You have {cart['count']} item(s) in your cart, subtotal ${cart['subtotal']:.2f}."}
+             return ToolResult(
+                 json.dumps(summary, separators=(",", ":")),
+                 products=self.catalog.get_products_by_ids([line["id"] for line in cart["items"]])
+             )
 
-        return json.dumps({"error": "Unknown tool"})
+        return ToolResult(json.dumps({"error": "Unknown tool"}))
 
 class MockClient:
-    def __init__(self):
-        self.catalog = ProductCatalog()
-
     class chat:
         def __init__(self, parent):
             self.parent = parent
@@ -210,11 +593,16 @@ class MockClient:
             def __init__(self, parent):
                 self.parent = parent.parent
 
-            def create(self, messages, **kwargs):
+            def create(self, messages, stream=False, **kwargs):
+                response = self._respond(messages)
+                if stream:
+                    return iter_chunks(response)
+                return response
+
+            def _respond(self, messages):
                 # Analyze history to decide what to do
                 last_msg_obj = messages[-1]
                 last_role = last_msg_obj["role"]
-                last_content = str(last_msg_obj.get("content", "")).lower()
 
                 # If last message was a tool output (role=tool), we should return a final response
                 if last_role == "tool":
@@ -222,158 +610,71 @@ class MockClient:
                     # checking if it has items
                     try:
                         data = json.loads(last_msg_obj["content"])
-                        if isinstance(data, list) and len(data) > 0:
-                            # Return the JSON list of products as the content
-                            return MockResponse(content=last_msg_obj["content"])
-                        elif isinstance(data, dict) and "message" in data:
-                            # Return the success message
-                            return MockResponse(content=data["message"])
-                        else:
-                            return MockResponse(content="I couldn't find any specific items matching that, but I can help with other requests!")
-                    except:
+                    except (TypeError, ValueError):
                         return MockResponse(content="I found some items for you.")
+                    # Index listed products now so follow-ups ("add the silver one") don't re-parse
+                    self.parent.context.remember(last_msg_obj["content"].strip(), data)
+                    if isinstance(data, list) and len(data) > 0:
+                        # Return the JSON list of products as the content
+                        return MockResponse(content=last_msg_obj["content"])
+                    elif isinstance(data, dict) and "message" in data:
+                        # Return the success message
+                        return MockResponse(content=data["message"])
+                    else:
+                        return MockResponse(content="I couldn't find any specific items matching that, but I can help with other requests!")
 
                 # Multi-Agent Simulation Logic
-                
-                # Agent 1: Intent Classifier
-                # Determines if the user wants to Buy/Find (Search), Checkout, or just Chat.
-                intent = "CHAT"
-                
-                # Check for checkout
-                if "checkout" in last_content or ("buy" in last_content and "cart" in last_content):
-                    intent = "CHECKOUT"
-                # Check for Add to Cart
-                elif "add" in last_content and ("cart" in last_content or "bag" in last_content):
-                    intent = "ADD_TO_CART"
-                # Check for View Cart
-                elif "cart" in last_content or "bag" in last_content or "basket" in last_content:
-                     intent = "VIEW_CART"
-                # Check for search intent
-                elif any(x in last_content for x in ["find", "need", "looking", "want", "show", "search", "recommend", "suggest", "buy", "shop", "where"]):
-                    intent = "SEARCH"
-                # Check for direct product mentions (implicit search)
-                elif any(x in last_content for x in ["dress", "suit", "shoes", "jacket", "shirt", "pant", "bag", "skirt", "heels", "boots", "sneakers", "sunglasses", "glasses", "eyewear", "tuxedo", " gown"]):
-                    intent = "SEARCH"
-
-                if intent == "CHECKOUT":
+                # Agent 1: Intent Classifier, and Agent 2: The Stylist (entity extraction),
+                # in one pass of the precompiled matcher (intents.py)
+                parsed = parse_message(str(last_msg_obj.get("content", "")))
+
+                if parsed.intent == "CHECKOUT":
                     return MockResponse(content=None, tool_calls=[MockToolCall("checkout", '{}')])
-                
-                if intent == "ADD_TO_CART":
-                    # Try to extract ID (simple regex for gen_X)
-                    import re
-                    match = re.search(r'gen_\d+', last_content)
-                    if match:
-                        p_id = match.group(0)
+
+                if parsed.intent == "ADD_TO_CART":
+                    # Explicit id ("Add gen_123 to cart"), else the recently shown
+                    # product sharing the most words with the message ("the silver one")
+                    p_id = parsed.product_id or self.parent.context.resolve(messages[:-1], parsed.words)
+                    if p_id:
                         return MockResponse(content=None, tool_calls=[MockToolCall("add_to_cart", json.dumps({"product_id": p_id}))])
-                    
-                    # Context Awareness Logic:
-                    # If no specific ID, scanned history for recently shown products
-                    # and try to match keywords from user content (e.g. "silver", "tuxedo")
-                    
-                    # 1. Gather recently shown products
-                    context_products = []
-                    # iterate reversed, skipping current user msg
-                    for m in reversed(messages[:-1]): 
-                        if m.get("role") == "assistant" or m.get("role") == "tool":
-                            content = str(m.get("content", ""))
-                            # Check if it looks like JSON list
-                            if content.strip().startswith("[") and content.strip().endswith("]"):
-                                try:
-                                    data = json.loads(content)
-                                    if isinstance(data, list):
-                                        context_products.extend(data)
-                                        # Only look at the most recent set of results for now to avoid ambiguity
-                                        break 
-                                except:
-                                    continue
-
-                    # 2. Match user keywords to products
-                    user_words = set(last_content.lower().split())
-                    best_match = None
-                    max_overlap = 0
-                    
-                    for p in context_products:
-                        # Create a set of keywords for the product
-                        # tags is already a list from catalog.py
-                        tags_list = p["tags"] if isinstance(p["tags"], list) else json.loads(p["tags"])
-                        p_keywords = set(p["name"].lower().split()) | set(tags_list)
-                        # Calculate overlap
-                        overlap = len(user_words.intersection(p_keywords))
-                        if overlap > max_overlap:
-                            max_overlap = overlap
-                            best_match = p
-                    
-                    if best_match and max_overlap > 0:
-                         return MockResponse(content=None, tool_calls=[MockToolCall("add_to_cart", json.dumps({"product_id": best_match["id"]}))])
-                    
-                    else:
-                        return MockResponse(content="Please specify which item you'd like to add (e.g., 'Add gen_123 to cart'), or describe it more uniquely.")
+                    return MockResponse(content="Please specify which item you'd like to add (e.g., 'Add gen_123 to cart'), or describe it more uniquely.")
 
-                if intent == "VIEW_CART":
+                if parsed.intent == "VIEW_CART":
                     return MockResponse(content=None, tool_calls=[MockToolCall("get_cart", '{}')])
 
-                if intent == "SEARCH":
-                    # Agent 2: The Stylist (Query Builder)
-                    # Extracts structured information from the unstructured text
-                    
-                    # 2a. Demographic Extraction
-                    tags = []
-                    if any(x in last_content for x in ["boy", "boys", "kid", "kids"]): tags.append("boy")
-                    elif any(x in last_content for x in ["girl", "girls"]): tags.append("girl")
-                    elif any(x in last_content for x in ["men", "man", "male", "husband", "father"]): tags.append("men")
-                    elif any(x in last_content for x in ["women", "woman", "female", "wife", "mother", "lady"]): tags.append("women")
-                    
-                    # 2b. Category Extraction
-                    categories = {
-                        "dress": "Clothing", "gown": "Clothing", "skirt": "Clothing",
-                        "shirt": "Clothing", "top": "Clothing", "blouse": "Clothing", "hoodie": "Clothing",
-                        "pant": "Clothing", "jeans": "Clothing", "trouser": "Clothing", "chino": "Clothing",
-                        "jacket": "Clothing", "coat": "Clothing", "blazer": "Clothing", "suit": "Clothing", "tuxedo": "Clothing",
-                        "shoes": "Shoes", "boot": "Shoes", "heel": "Shoes", "sneaker": "Shoes", "loafer": "Shoes", "flat": "Shoes",
-                        "bag": "Accessories", "tote": "Accessories", "clutch": "Accessories", "backpack": "Accessories",
-                        "jewelry": "Accessories", "earring": "Accessories", "necklace": "Accessories", "bracelet": "Accessories",
-                        "scarf": "Accessories", "glass": "Accessories"
-                    }
-                    
-                    # 2c. Attribute/Style Extraction
-                    styles = [
-                        "wedding", "formal", "casual", "summer", "winter", "beach", "party", "office", "work", 
-                        "floral", "strip", "check", "red", "blue", "green", "black", "white", "gold", "silver", "pink",
-                        "beige", "navy", "vintage", "modern", "bohemian", "chic", "streetwear", "elegant"
-                    ]
-                    
-                    found_styles = [s for s in styles if s in last_content]
-                    
-                    # Construct Query
-                    # We combine detected style keywords and the core object from user text
-                    # Identify the core object by stripping known filler words 
-                    
-                    # Simple heuristic: Use the found styles + detected category keywords as the query
-                    # This ensures "Summer Wedding" becomes "summer wedding" query
-                    
-                    query_parts = found_styles.copy()
-                    
-                    # Add explicit category keywords found in text to query logic
-                    for keyword in categories.keys():
-                        if keyword in last_content:
-                            query_parts.append(keyword)
-                            
-                    query = " ".join(query_parts)
-                    if not query:
-                        query = last_content # Fallback to full text if parsing fails
-                        
+                if parsed.intent == "SEARCH":
+                    # Styles + product keywords make the query ("Summer Wedding" -> "summer wedding")
+                    query = " ".join(parsed.query_terms) or str(last_msg_obj.get("content", "")).lower()
                     return MockResponse(
                         content=None,
-                        tool_calls=[MockToolCall("search_products", json.dumps({"query": query, "tags": tags}))]
+                        tool_calls=[MockToolCall("search_products", json.dumps({"query": query, "tags": parsed.tags}))]
                     )
 
                 return MockResponse(content="I am your Personal Stylist. I can help you find specific items like 'Summer Floral Dress for Women' or 'Boys Navy Suit'. What are you looking for?")
 
     def __init__(self):
-        self.catalog = ProductCatalog()
+        self.context = ContextIndex(max_size=int(os.getenv("MOCK_CONTEXT_CACHE_SIZE", 10000)))
         self.chat = self.chat(self)
         self.chat.completions = self.chat.completions(self.chat)
 
+class AsyncMockClient:
+    """Awaitable facade over MockClient, matching the AsyncGroq/AsyncAzureOpenAI shape."""
+
+    def __init__(self, client: Optional[MockClient] = None):
+        self._client = client or MockClient()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, messages, stream=False, **kwargs):
+        # Pure in-memory string matching, cheap enough to run on the loop
+        response = self._client.chat.completions.create(messages, **kwargs)
+        if stream:
+            return self._aiter_chunks(response)
+        return response
+
+    async def _aiter_chunks(self, response):
+        for chunk in iter_chunks(response):
+            yield chunk
+
 class MockResponse:
     def __init__(self, content, tool_calls=None):
         self.choices = [MockChoice(content, tool_calls)]
@@ -398,3 +699,21 @@ class MockFunction:
         self.name = name
         self.arguments = arguments
 
+
+class MockChunk:
+    def __init__(self, content=None, tool_calls=None):
+        self.choices = [MockChunkChoice(content, tool_calls)]
+
+class MockChunkChoice:
+    def __init__(self, content, tool_calls):
+        self.delta = MockMessage(content, tool_calls)
+
+def iter_chunks(response: MockResponse):
+    """Replay a MockResponse the way a provider streams it: word deltas, then tool calls."""
+    message = response.choices[0].message
+    if message.content:
+        for word in re.findall(r"\S+\s*|\s+", message.content):
+            yield MockChunk(content=word)
+    for index, tool_call in enumerate(message.tool_calls or []):
+        tool_call.index = index
+        yield MockChunk(tool_calls=[tool_call])
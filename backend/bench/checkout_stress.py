@@ -0,0 +1,158 @@
+"""Concurrency stress test for checkout: many parallel shoppers, few units.
+
+    cd backend
+    python -m bench.checkout_stress                                # 16 processes
+    python -m bench.checkout_stress --mode thread --workers 32 --stock 5
+
+Every worker places random carts over a small set of "hot" products whose
+stock is far below demand, through orders.place_order. Afterwards the run
+checks that nothing was oversold: for every hot product, stock never goes
+negative, and initial - final stock equals the quantity recorded in
+order_items, which in turn equals what the workers were told they bought.
+Exits non-zero if any of that fails.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List
+
+from bench.common import DATA_DIR, SEED, build_catalog, print_table, save_results, summarize, use_database
+
+
+def prepare(args) -> str:
+    """Fresh copy of the bench catalog with the hot products' stock reset."""
+    source = build_catalog(args.rows)
+    path = os.path.join(DATA_DIR, "checkout-stress.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    shutil.copyfile(source, path)
+
+    conn = sqlite3.connect(path)
+    conn.executemany("UPDATE products SET stock = ? WHERE id = ?", [(args.stock, pid) for pid in hot_ids(args)])
+    conn.execute("DELETE FROM order_items")
+    conn.execute("DELETE FROM orders")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def hot_ids(args) -> List[str]:
+    return [f"gen_{i}" for i in range(1, args.products + 1)]
+
+
+def worker(worker_id: int, path: str, args) -> Dict[str, Any]:
+    use_database(path)
+    from cart import LineItem
+    import orders
+
+    rng = random.Random(SEED + worker_id)
+    ids = hot_ids(args)
+    samples: List[float] = []
+    outcomes = {"placed": 0, "out_of_stock": 0, "error": 0}
+    bought: Dict[str, int] = {}
+    retries_before = orders.CHECKOUT_RETRIES.value()
+
+    # Wall clock, comparable across processes (spawn time stays out of the throughput)
+    started_at = time.time()
+    for _ in range(args.checkouts):
+        lines = [LineItem(pid, pid, 10.0, rng.randint(1, args.max_qty)) for pid in rng.sample(ids, rng.randint(1, args.max_lines))]
+        started = time.perf_counter()
+        try:
+            order = orders.place_order(f"stress-{worker_id}", lines)
+        except orders.OutOfStock:
+            outcomes["out_of_stock"] += 1
+        except sqlite3.Error as e:
+            outcomes["error"] += 1
+            print(f"worker {worker_id}: {e!r}", file=sys.stderr)
+        else:
+            outcomes["placed"] += 1
+            for item in order["items"]:
+                bought[item["id"]] = bought.get(item["id"], 0) + item["qty"]
+        samples.append((time.perf_counter() - started) * 1000)
+
+    return {"samples": samples, "outcomes": outcomes, "bought": bought, "started_at": started_at, "ended_at": time.time(),
+            "retries": int(orders.CHECKOUT_RETRIES.value() - retries_before)}
+
+
+def verify(path: str, args, bought: Dict[str, int], placed: int) -> List[str]:
+    conn = sqlite3.connect(path)
+    problems = []
+    stock = dict(conn.execute(
+        "SELECT id, stock FROM products WHERE id IN ({})".format(",".join("?" * args.products)), hot_ids(args)
+    ).fetchall())
+    recorded = dict(conn.execute("SELECT product_id, SUM(qty) FROM order_items GROUP BY product_id").fetchall())
+    orders = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    conn.close()
+
+    for pid in hot_ids(args):
+        sold = args.stock - stock[pid]
+        if stock[pid] < 0:
+            problems.append(f"{pid}: negative stock {stock[pid]}")
+        if sold != recorded.get(pid, 0):
+            problems.append(f"{pid}: stock dropped by {sold} but order_items has {recorded.get(pid, 0)}")
+        if recorded.get(pid, 0) != bought.get(pid, 0):
+            problems.append(f"{pid}: order_items has {recorded.get(pid, 0)}, workers were sold {bought.get(pid, 0)}")
+    if orders != placed:
+        problems.append(f"orders table has {orders} rows, workers placed {placed}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["process", "thread"], default="process",
+                        help="processes contend on SQLite's file lock, threads also on the connection pool")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--checkouts", type=int, default=50, help="per worker")
+    parser.add_argument("--rows", type=int, default=10_000, help="bench catalog size")
+    parser.add_argument("--products", type=int, default=20, help="hot products carts are drawn from")
+    parser.add_argument("--stock", type=int, default=25, help="starting stock of each hot product")
+    parser.add_argument("--max-lines", type=int, default=3)
+    parser.add_argument("--max-qty", type=int, default=3)
+    parser.add_argument("--out", help="results file (default bench/results/checkout-<timestamp>.json)")
+    args = parser.parse_args()
+
+    path = prepare(args)
+    if args.mode == "process":
+        # spawn: children must not inherit the parent's SQLite connections
+        executor = ProcessPoolExecutor(max_workers=args.workers, mp_context=get_context("spawn"))
+    else:
+        use_database(path)
+        executor = ThreadPoolExecutor(max_workers=args.workers)
+
+    with executor:
+        runs = list(executor.map(worker, range(args.workers), [path] * args.workers, [args] * args.workers))
+    elapsed = max(r["ended_at"] for r in runs) - min(r["started_at"] for r in runs)
+
+    outcomes = {k: sum(r["outcomes"][k] for r in runs) for k in ("placed", "out_of_stock", "error")}
+    bought: Dict[str, int] = {}
+    for r in runs:
+        for pid, qty in r["bought"].items():
+            bought[pid] = bought.get(pid, 0) + qty
+    retries = sum(r["retries"] for r in runs)
+    problems = verify(path, args, bought, outcomes["placed"])
+
+    result = {"name": "place_order", **outcomes, "busy_retries": retries,
+              **summarize([s for r in runs for s in r["samples"]], elapsed)}
+    print(f"\n{args.workers} {args.mode} workers x {args.checkouts} checkouts, "
+          f"{args.products} products x {args.stock} units, {elapsed:.2f}s")
+    print_table([result], ["name", "placed", "out_of_stock", "error", "busy_retries"])
+    print(f"Units sold: {sum(bought.values())} of {args.products * args.stock}")
+    for problem in problems:
+        print("INVARIANT VIOLATED:", problem)
+    if not problems:
+        print("No oversells: stock, order_items and worker receipts agree.")
+
+    params = {k: v for k, v in vars(args).items() if k != "out"}
+    save_results("checkout", {**params, "elapsed_s": round(elapsed, 2), "problems": problems}, [result], args.out)
+    sys.exit(1 if problems or outcomes["error"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import platform
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# Benchmarks always drive the offline mock provider (load_dotenv won't override these)
+os.environ["GROQ_API_KEY"] = ""
+os.environ["USE_AZURE_OPENAI"] = "false"
+
+import database  # noqa: E402
+import importer  # noqa: E402
+import seed  # noqa: E402
+
+SEED = 42
+DEFAULT_SIZES = [250, 10_000, 100_000, 1_000_000]
+
+
+def catalog_path(rows: int) -> str:
+    return os.path.join(DATA_DIR, f"catalog-{rows}.db")
+
+
+def _row_count(path: str) -> int:
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return -1
+
+
+def build_catalog(rows: int, seed_value: int = SEED) -> str:
+    """Seeded synthetic catalog of `rows` products, cached under bench/data/."""
+    path = catalog_path(rows)
+    if os.path.exists(path) and _row_count(path) == rows:
+        # Cached files may predate a schema migration
+        use_database(path)
+        database.init_db()
+        return path
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    use_database(path)
+    database.init_db()
+    stats = importer.bulk_load(seed.iter_product_rows(rows, seed=seed_value))
+    print(f"Built {os.path.relpath(path)}: {rows} rows, {stats.summary()}")
+    return path
+
+
+def use_database(path: str):
+    """Point the backend at another database file.
+
+    The search, vector and recommendation indexes are process-wide and keyed
+    on the catalog version, which two files can share, so drop them too.
+    """
+    import search_index
+    import vector_index
+    import recommendations
+
+    database.DB_NAME = path
+    search_index._index = None
+    vector_index._index = None
+    recommendations._index = None
+
+
+def summarize(samples_ms: List[float], elapsed_s: Optional[float] = None) -> Dict[str, Any]:
+    if not samples_ms:
+        return {"count": 0}
+    samples = np.asarray(samples_ms)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    elapsed_s = elapsed_s if elapsed_s is not None else samples.sum() / 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(samples.mean()), 4),
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "max_ms": round(float(samples.max()), 4),
+        "throughput_per_s": round(len(samples) / elapsed_s, 2) if elapsed_s else None,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(suite: str, params: Dict[str, Any], results: List[Dict[str, Any]], out: Optional[str] = None) -> str:
+    if out is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"{suite}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(out, "w") as f:
+        json.dump({
+            "suite": suite,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "params": params,
+            "results": results,
+        }, f, indent=2)
+    print(f"Results saved to {os.path.relpath(out)}")
+    return out
+
+
+def print_table(results: List[Dict[str, Any]], key_fields: List[str]):
+    header = key_fields + ["count", "p50_ms", "p95_ms", "p99_ms", "throughput_per_s"]
+    rows = [[str(r.get(f, "")) for f in header] for r in results]
+    widths = [max(len(h), *(len(row[i]) for row in rows)) for i, h in enumerate(header)] if rows else [len(h) for h in header]
+    print("  ".join(h.ljust(w) for h, w in zip(header, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
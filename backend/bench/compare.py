@@ -0,0 +1,38 @@
+"""Compare two saved bench results: python -m bench.compare before.json after.json"""
+import sys
+import json
+from typing import Any, Dict, Tuple
+
+METRICS = ["p50_ms", "p95_ms", "p99_ms", "throughput_per_s"]
+
+
+def _key(result: Dict[str, Any]) -> Tuple:
+    return (result.get("rows", ""), result.get("engine", ""), result["name"])
+
+
+def _load(path: str) -> Dict[Tuple, Dict[str, Any]]:
+    with open(path) as f:
+        return {_key(r): r for r in json.load(f)["results"] if "count" in r}
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    before, after = _load(sys.argv[1]), _load(sys.argv[2])
+    print("  ".join(["rows", "engine", "name"] + METRICS))
+    for key in sorted(set(before) & set(after), key=str):
+        cells = []
+        for metric in METRICS:
+            old, new = before[key].get(metric), after[key].get(metric)
+            if not old or new is None:
+                cells.append("-")
+                continue
+            change = (new - old) / old * 100
+            cells.append(f"{new:g} ({change:+.1f}%)")
+        print("  ".join([str(k) for k in key] + cells))
+    for key in sorted(set(before) ^ set(after), key=str):
+        print("only in", sys.argv[1] if key in before else sys.argv[2], ":", key)
+
+
+if __name__ == "__main__":
+    main()
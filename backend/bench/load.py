@@ -0,0 +1,140 @@
+"""End-to-end load generator for /chat, /cart and /cart/items.
+
+    cd backend
+    python -m bench.load --users 20 --duration 30            # in-process app, mock LLM
+    python -m bench.load --url http://localhost:8000 --users 50
+
+Each virtual user has its own session and loops: search over /chat, add a
+returned product via /cart/items, poll /cart with If-None-Match, and now
+and then add "the <color> one" through chat or remove an item. In-process
+runs serve the app through httpx's ASGI transport against a seeded bench
+catalog; with --url, start the server with no GROQ_API_KEY so it uses the
+mock provider.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from typing import Any, Dict, List
+
+import httpx
+
+from bench.common import SEED, build_catalog, print_table, save_results, summarize, use_database
+
+SEARCH_MESSAGES = [
+    "I need a summer wedding dress for women",
+    "show me leather boots",
+    "looking for a navy suit for men",
+    "find gold heels",
+    "any silk scarf?",
+    "casual sneakers for boys",
+    "something for a chilly outdoor wedding",
+    "red dress",
+    "sunglasses for the beach",
+]
+COLORS = ["red", "blue", "black", "white", "gold", "silver", "navy", "beige", "pink", "green"]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    async def call(self, endpoint: str, request) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            return None
+        self.samples.setdefault(endpoint, []).append((time.perf_counter() - started) * 1000)
+        if response.status_code >= 400:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return response
+
+
+async def virtual_user(client: httpx.AsyncClient, recorder: Recorder, user: int, run_id: str, stop_at: float):
+    rng = random.Random(SEED + user)
+    headers = {"X-Session-ID": f"bench-{run_id}-{user}"}
+    etag = None
+    history: List[Dict[str, str]] = []
+    cart_ids: List[str] = []
+
+    while time.perf_counter() < stop_at:
+        message = rng.choice(SEARCH_MESSAGES)
+        response = await recorder.call("POST /chat", client.post("/chat", json={"message": message, "history": []}, headers=headers))
+        products = []
+        if response is not None and response.status_code == 200:
+            data = response.json()
+            products = data.get("products") or []
+            history = [{"role": "user", "content": message}, {"role": "assistant", "content": data.get("content") or ""}]
+
+        if products:
+            product_id = rng.choice(products)["id"]
+            response = await recorder.call("POST /cart/items", client.post("/cart/items", json={"product_id": product_id}, headers=headers))
+            if response is not None and response.status_code == 200:
+                cart_ids.append(product_id)
+
+        if rng.random() < 0.3 and history:
+            message = f"add the {rng.choice(COLORS)} one to my cart"
+            await recorder.call("POST /chat", client.post("/chat", json={"message": message, "history": history}, headers=headers))
+
+        conditional = {**headers, "If-None-Match": etag} if etag else headers
+        response = await recorder.call("GET /cart", client.get("/cart", headers=conditional))
+        if response is not None and response.status_code == 200:
+            etag = response.headers.get("ETag")
+
+        if cart_ids and rng.random() < 0.2:
+            product_id = cart_ids.pop(rng.randrange(len(cart_ids)))
+            await recorder.call("DELETE /cart/items", client.delete(f"/cart/items/{product_id}", headers=headers))
+
+
+async def run(args) -> Dict[str, Any]:
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        if args.no_llm_cache:
+            os.environ["LLM_CACHE_ENABLED"] = "false"
+        use_database(build_catalog(args.rows))
+        import main as app_module
+        transport = httpx.ASGITransport(app=app_module.app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout)
+
+    recorder = Recorder()
+    run_id = uuid.uuid4().hex[:8]
+    async with client:
+        started = time.perf_counter()
+        stop_at = started + args.duration
+        await asyncio.gather(*(virtual_user(client, recorder, u, run_id, stop_at) for u in range(args.users)))
+        elapsed = time.perf_counter() - started
+
+    results = []
+    for endpoint, samples in sorted(recorder.samples.items()):
+        results.append({"name": endpoint, "errors": recorder.errors.get(endpoint, 0), **summarize(samples, elapsed)})
+    all_samples = [s for samples in recorder.samples.values() for s in samples]
+    results.append({"name": "total", "errors": sum(recorder.errors.values()), **summarize(all_samples, elapsed)})
+    return {"elapsed_s": round(elapsed, 2), "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="target a running server instead of the in-process app")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--rows", type=int, default=10_000, help="bench catalog size (in-process only)")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--no-llm-cache", action="store_true", help="disable the LLM response cache (in-process only)")
+    parser.add_argument("--out", help="results file (default bench/results/load-<timestamp>.json)")
+    args = parser.parse_args()
+
+    outcome = asyncio.run(run(args))
+    print(f"\n{args.users} users for {outcome['elapsed_s']}s")
+    print_table(outcome["results"], ["name", "errors"])
+    params = {k: v for k, v in vars(args).items() if k != "out"}
+    save_results("load", {**params, "elapsed_s": outcome["elapsed_s"]}, outcome["results"], args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Micro-benchmarks for the catalog and tool layer.
+
+    cd backend
+    python -m bench.micro                      # 250, 10k, 100k, 1M rows
+    python -m bench.micro --sizes 250,10000 --engines fts,hybrid,sql
+
+Catalogs are generated with a fixed seed and cached in bench/data/, so
+runs against the same size see the same rows and queries.
+
+The query set is small and repeats, so everything runs with the catalog
+cache off and measures the engine; the "(cached)" rows show the same
+searches served by a warm cache.
+"""
+import argparse
+import json
+import random
+import time
+from typing import Any, Callable, Dict, List
+
+from bench.common import (
+    DEFAULT_SIZES, SEED, build_catalog, print_table, save_results, summarize, use_database,
+)
+
+AND_QUERIES = ["red dress", "leather boots", "silk scarf", "navy suit", "gold heels", "linen summer dress"]
+# First token matches nothing, so the AND query is empty and the OR fallback runs
+OR_QUERIES = ["qqq dress", "zzz boots", "xyzzy scarf", "qqq suit"]
+TAG_QUERIES = [("dress", ["women"]), ("suit", ["men"]), ("sneakers", ["boy"]), ("bag", ["formal"])]
+
+ENGINES_NEEDING_VECTORS = {"hybrid"}
+
+
+def measure(fn: Callable[[Any], Any], inputs: List[Any], iterations: int, warmup: int) -> Dict[str, Any]:
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+    samples = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        fn(inputs[i % len(inputs)])
+        samples.append((time.perf_counter() - t) * 1000)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def run_size(rows: int, args) -> List[Dict[str, Any]]:
+    use_database(build_catalog(rows))
+
+    from catalog import CatalogCache, ProductCatalog
+    from agent import ShopperAgent
+    from sessions import Session
+    from tool_output import compact_products_json
+    from recommendations import get_recommendation_index
+
+    rng = random.Random(SEED)
+    ids = [f"gen_{rng.randint(1, rows)}" for _ in range(max(args.iterations, 1))]
+    results = []
+
+    def record(name: str, engine: str = "", **stats):
+        results.append({"rows": rows, "engine": engine, "name": name, **stats})
+
+    def one_shot(name: str, fn: Callable[[], Any], engine: str = ""):
+        t = time.perf_counter()
+        fn()
+        record(name, engine, build_s=round(time.perf_counter() - t, 3))
+
+    def uncached(engine: str) -> ProductCatalog:
+        catalog = ProductCatalog(engine)
+        catalog.cache = CatalogCache(enabled=False)
+        return catalog
+
+    vectors_ok = rows <= args.max_vector_rows
+    for engine in args.engines:
+        if engine in ENGINES_NEEDING_VECTORS and not vectors_ok:
+            record("search:*", engine, skipped=f"rows > --max-vector-rows ({args.max_vector_rows})")
+            continue
+        catalog = uncached(engine)
+        # Lazily built indexes (inverted, vector) are timed on their own
+        one_shot("index_build", lambda: catalog.search_products("dress", limit=1), engine)
+        record("search:and", engine, **measure(lambda q: catalog.search_products(q), AND_QUERIES, args.iterations, args.warmup))
+        record("search:or_fallback", engine, **measure(lambda q: catalog.search_products(q), OR_QUERIES, args.iterations, args.warmup))
+        record("search:tag_filter", engine, **measure(lambda qt: catalog.search_products(qt[0], tags=qt[1]), TAG_QUERIES, args.iterations, args.warmup))
+
+        cached = ProductCatalog(engine)
+        record("search:and (cached)", engine, **measure(lambda q: cached.search_products(q), AND_QUERIES, args.iterations, args.warmup))
+
+    catalog = uncached("fts")
+    record("get_product_by_id", **measure(catalog.get_product_by_id, ids, args.iterations, args.warmup))
+
+    if rows <= args.max_recommendation_rows:
+        one_shot("recommendations_build", get_recommendation_index().ensure_fresh)
+        record("get_recommendations", **measure(catalog.get_recommendations, ids, args.iterations, args.warmup))
+    else:
+        record("get_recommendations", skipped=f"rows > --max-recommendation-rows ({args.max_recommendation_rows})")
+
+    agent = ShopperAgent()
+    agent.catalog = uncached("hybrid" if vectors_ok else "fts")
+    session = Session("bench")
+    calls = [
+        {"id": f"call_{i}", "type": "function", "function": {"name": "search_products", "arguments": json.dumps({"query": q})}}
+        for i, q in enumerate(AND_QUERIES)
+    ]
+    record("execute_tool:search_products", agent.catalog.search_engine,
+           **measure(lambda tc: agent.execute_tool(tc, session), calls, args.iterations, args.warmup))
+    pages = [agent.catalog.search_products(q) for q in AND_QUERIES]
+    record("serialize:compact_products_json", **measure(compact_products_json, pages, args.iterations, args.warmup))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES))
+    parser.add_argument("--engines", default="fts,hybrid", help="comma separated: fts, hybrid, sql, index")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--max-vector-rows", type=int, default=100_000,
+                        help="skip the hybrid engine above this size (the vector index is built row by row in Python)")
+    parser.add_argument("--max-recommendation-rows", type=int, default=100_000,
+                        help="skip recommendations above this size (the build is quadratic per category)")
+    parser.add_argument("--out", help="results file (default bench/results/micro-<timestamp>.json)")
+    args = parser.parse_args()
+    args.sizes = [int(s) for s in args.sizes.split(",")]
+    args.engines = [e for e in args.engines.split(",") if e]
+
+    results = []
+    for rows in args.sizes:
+        print(f"\n== {rows} rows ==")
+        size_results = run_size(rows, args)
+        print_table([r for r in size_results if "count" in r], ["engine", "name"])
+        results.extend(size_results)
+
+    save_results("micro", {k: v for k, v in vars(args).items() if k != "out"}, results, args.out)
+
+
+if __name__ == "__main__":
+    main()
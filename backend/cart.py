@@ -0,0 +1,110 @@
+from typing import Any, Dict, List, Optional
+
+
+class LineItem:
+    """One product in the cart: a price snapshot taken when it was first added."""
+
+    __slots__ = ("id", "name", "price", "qty")
+
+    def __init__(self, product_id: str, name: str, price: float, qty: int = 1):
+        self.id = product_id
+        self.name = name
+        self.price = price
+        self.qty = qty
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "name": self.name, "price": self.price, "qty": self.qty}
+
+
+class Cart:
+    """Shopping cart keyed by product id.
+
+    add/remove/lookup are O(1); the unit count and subtotal are kept up to
+    date on every mutation (subtotal in integer cents, so repeated adds and
+    removes don't drift), and the serialized form is cached until the next
+    change (to_dict() hands out copies of it).
+
+    Not thread-safe on its own; Session serializes access to its cart.
+    """
+
+    def __init__(self, lines: Optional[List[LineItem]] = None):
+        self._lines: Dict[str, LineItem] = {}  # insertion ordered
+        self.count = 0
+        self._subtotal_cents = 0
+        self._serialized: Optional[Dict[str, Any]] = None
+        for line in lines or []:
+            self._lines[line.id] = line
+            self._account(line.price, line.qty)
+
+    def _account(self, price: float, qty: int):
+        self.count += qty
+        self._subtotal_cents += round(price * 100) * qty
+        self._serialized = None
+
+    @property
+    def subtotal(self) -> float:
+        return self._subtotal_cents / 100
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __bool__(self) -> bool:
+        return self.count > 0
+
+    def __contains__(self, product_id: str) -> bool:
+        return product_id in self._lines
+
+    def get(self, product_id: str) -> Optional[LineItem]:
+        return self._lines.get(product_id)
+
+    def lines(self) -> List[LineItem]:
+        return list(self._lines.values())
+
+    def product_ids(self) -> List[str]:
+        return list(self._lines)
+
+    def add(self, product: Dict, qty: int = 1) -> LineItem:
+        line = self._lines.get(product["id"])
+        if line is None:
+            line = self._lines[product["id"]] = LineItem(product["id"], product["name"], product["price"], 0)
+        line.qty += qty
+        self._account(line.price, qty)
+        return line
+
+    def remove(self, product_id: str, qty: int = 1) -> Optional[LineItem]:
+        """Take `qty` units off a line (the whole line if it runs out). Returns the line, or None."""
+        line = self._lines.get(product_id)
+        if line is None:
+            return None
+        qty = min(qty, line.qty)
+        line.qty -= qty
+        if line.qty == 0:
+            del self._lines[product_id]
+        self._account(line.price, -qty)
+        return line
+
+    def clear(self):
+        self._lines.clear()
+        self.count = 0
+        self._subtotal_cents = 0
+        self._serialized = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        if self._serialized is None:
+            self._serialized = {
+                "items": [line.to_dict() for line in self._lines.values()],
+                "count": self.count,
+                "subtotal": self.subtotal,
+            }
+        cached = self._serialized
+        return {**cached, "items": [dict(item) for item in cached["items"]]}
+
+    @classmethod
+    def from_dict(cls, data: Any) -> "Cart":
+        if isinstance(data, list):
+            # Sessions saved before carts had line items: a list of full products
+            cart = cls()
+            for product in data:
+                cart.add(product)
+            return cart
+        return cls([LineItem(i["id"], i["name"], i["price"], i["qty"]) for i in data.get("items", [])])
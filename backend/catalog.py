@@ -1,108 +1,557 @@
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
+import base64
+import copy
 import json
-from database import get_db_connection
+import os
+import sqlite3
+import threading
+import zlib
+from cache import LRUCache
+from database import db_connection, fts5_available, recent_catalog_versions
+from search_index import get_search_index
+from recommendations import DEMOGRAPHICS, get_recommendation_index
+from vector_index import get_vector_index
+from singleflight import SingleFlight
+from telemetry import timed
+
+# bm25() column weights for products_fts(name, description, category, tags)
+BM25_WEIGHTS = (10.0, 2.0, 3.0, 5.0)
+# Hybrid search: each ranking contributes limit * HYBRID_DEPTH candidates
+HYBRID_DEPTH = 3
+RRF_K = 60
+
+# Category filters keep substring semantics but never scan products: the
+# distinct categories come straight off idx_products_category, one seek each
+CATEGORY_FILTER = """p.category IN (
+    WITH RECURSIVE c(name) AS (
+        SELECT MIN(category) FROM products
+        UNION ALL
+        SELECT (SELECT MIN(category) FROM products WHERE category > c.name) FROM c WHERE c.name IS NOT NULL
+    )
+    SELECT name FROM c WHERE name LIKE ?
+)"""
+
+# search_page(): colors and demographics are plain tags (see seed.py), the
+# facets count the ones in these vocabularies
+FACET_COLORS = ("red", "blue", "green", "black", "white", "beige", "navy", "gold", "silver", "pink",
+                "burgundy", "camel", "pastel", "floral")
+# Upper bounds of the price facet's bands; the last band is open-ended
+PRICE_BANDS = (50, 100, 200, 300)
+PAGE_SORTS = ("relevance", "price_asc", "price_desc")
+MAX_PAGE_SIZE = 50
+
+_MISSING = object()
+
+class CatalogCache:
+    """Result and by-id caches for ProductCatalog.
+
+    Keys carry the catalog versions (bumped by triggers on every products
+    write: seeding and imports bump the content version, checkouts and
+    restocks the stock version), so an entry computed before a write isn't
+    served after it; both caches are also cleared when either moves. The
+    versions come from database.recent_catalog_versions(), so a hit doesn't
+    touch SQLite: this process's writes show at once, other processes'
+    within CATALOG_VERSION_TTL. Unknown ids are cached too (as None).
+    """
+
+    def __init__(self, max_size: int = 1000, id_max_size: int = 10000, enabled: bool = True):
+        self.enabled = enabled
+        self.results = LRUCache(max_size=max_size)
+        self.products = LRUCache(max_size=id_max_size)
+        self._version = None
+        self._lock = threading.Lock()
+
+    def version(self) -> Tuple[int, int]:
+        version = recent_catalog_versions()
+        with self._lock:
+            if version != self._version:
+                self.results.clear()
+                self.products.clear()
+                self._version = version
+        return version
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "catalog_version": self._version,
+            "results": self.results.stats(),
+            "products": self.products.stats(),
+        }
+
+def create_catalog_cache() -> CatalogCache:
+    return CatalogCache(
+        max_size=int(os.getenv("CATALOG_CACHE_SIZE", 1000)),
+        id_max_size=int(os.getenv("CATALOG_ID_CACHE_SIZE", 10000)),
+        enabled=os.getenv("CATALOG_CACHE_ENABLED", "true") == "true",
+    )
+
+def _row_to_product(row) -> Dict:
+    p = dict(row)
+    p["tags"] = json.loads(p["tags"]) # Deserialize tags
+    return p
+
+def _copy_product(p: Dict) -> Dict:
+    # What callers get from cached products: tags is the one mutable field
+    p = dict(p)
+    if isinstance(p.get("tags"), list):
+        p["tags"] = list(p["tags"])
+    return p
+
+def _filter_sql(category: str, tags: List[str], in_stock: bool = False, min_price: Optional[float] = None,
+                max_price: Optional[float] = None, all_tags: Tuple[str, ...] = ()) -> Tuple[str, List]:
+    """AND-ed WHERE clauses for the category/tag/stock/price filters on products aliased as p."""
+    sql = ""
+    params: List = []
+    if in_stock:
+        # Matches idx_products_in_stock's WHERE, so the planner can use it
+        sql += " AND p.stock > 0"
+    if min_price is not None:
+        sql += " AND p.price >= ?"
+        params.append(min_price)
+    if max_price is not None:
+        sql += " AND p.price <= ?"
+        params.append(max_price)
+    if category:
+        sql += " AND " + CATEGORY_FILTER
+        params.append(f"%{category}%")
+    if tags:
+        # Any of the tags, case-insensitively, via product_tags' tag index
+        sql += " AND p.id IN (SELECT product_id FROM product_tags WHERE tag IN ({}))".format(
+            ",".join(["lower(?)"] * len(tags))
+        )
+        params.extend(tags)
+    for tag in all_tags:
+        # Every one of these (a color and a demographic, say)
+        sql += " AND p.id IN (SELECT product_id FROM product_tags WHERE tag = lower(?))"
+        params.append(tag)
+    return sql, params
+
+def _fts_term(token: str) -> str:
+    # Quote the token so punctuation can't break the MATCH syntax, then prefix-match it
+    return '"' + token.replace('"', '""') + '"*'
+
+class SearchFilters:
+    """Normalized filters of a search_page() call; key() is the same for equivalent searches."""
+
+    def __init__(self, query: str = "", category: str = "", tags: List[str] = [], color: str = "", demographic: str = "",
+                 min_price: Optional[float] = None, max_price: Optional[float] = None, in_stock: bool = False):
+        self.tokens = [t for t in query.lower().split() if any(c.isalnum() for c in t)]
+        self.category = category.strip()
+        self.tags = sorted({str(t).lower() for t in tags or []})
+        self.all_tags = tuple(t.strip().lower() for t in (color, demographic) if t and t.strip())
+        self.min_price = float(min_price) if min_price is not None else None
+        self.max_price = float(max_price) if max_price is not None else None
+        self.in_stock = bool(in_stock)
+
+    def key(self) -> Tuple:
+        return (tuple(self.tokens), self.category.lower(), tuple(self.tags), self.all_tags,
+                self.min_price, self.max_price, self.in_stock)
+
+    def source_sql(self, use_fts: bool) -> Tuple[str, List]:
+        """FROM ... WHERE ... selecting every matching product as p."""
+        params: List = []
+        if self.tokens and use_fts:
+            sql = "products_fts JOIN products p ON p.rowid = products_fts.rowid WHERE products_fts MATCH ?"
+            params.append(" AND ".join(_fts_term(t) for t in self.tokens))
+        else:
+            sql = "products p WHERE 1=1"
+            for token in self.tokens:
+                sql += " AND (lower(p.name) LIKE ? OR lower(p.description) LIKE ? OR lower(p.tags) LIKE ?)"
+                params.extend([f"%{token}%"] * 3)
+        filters, filter_params = _filter_sql(self.category, self.tags, self.in_stock, self.min_price, self.max_price, self.all_tags)
+        return sql + filters, params + filter_params
+
+def _encode_cursor(digest: str, key: List) -> str:
+    raw = json.dumps({"f": digest, "k": key}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str, digest: str) -> List:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        key = data["k"]
+        matches = data["f"] == digest
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid cursor.")
+    if not matches:
+        raise ValueError("Cursor belongs to a different search.")
+    return key
+
+def _price_band_label(band: int) -> Tuple[str, Optional[float], Optional[float]]:
+    low = PRICE_BANDS[band - 1] if band > 0 else 0
+    high = PRICE_BANDS[band] if band < len(PRICE_BANDS) else None
+    return (f"{low}-{high}" if high is not None else f"{low}+"), low, high
 
 class ProductCatalog:
-    def __init__(self):
-        pass
+    def __init__(self, search_engine: Optional[str] = None):
+        # "fts" ranks with FTS5 bm25(), "hybrid" fuses those matches with local
+        # vector similarity (opt-in: the vector index is built in one pass per
+        # catalog version), "sql" runs LIKE scans against SQLite, "index" uses
+        # the in-memory inverted index
+        self.search_engine = search_engine or os.getenv("SEARCH_ENGINE", "fts")
+        if self.search_engine == "fts" and not fts5_available():
+            self.search_engine = "sql"
+        self.cache = create_catalog_cache()
+        # Identical queries arriving together (a burst of shoppers) run once
+        self.flights = SingleFlight("catalog")
 
-    def search_products(self, query: str = "", category: str = "", tags: List[str] = []) -> List[Dict]:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        sql = "SELECT * FROM products WHERE 1=1"
-        params = []
-        
-        if category:
-            sql += " AND category LIKE ?"
-            params.append(f"%{category}%")
-            
-        if query:
-            # Tokenize query for better matching
-            tokens = query.lower().split()
-            for token in tokens:
-                sql += " AND (lower(name) LIKE ? OR lower(description) LIKE ? OR lower(tags) LIKE ?)"
-                params.extend([f"%{token}%", f"%{token}%", f"%{token}%"])
-            
-        # Execute basic query first
-        cursor.execute(sql, params)
-        rows = cursor.fetchall()
+    def _load(self, key: Tuple, compute):
+        """Cached result for `key`, else compute() run once for all concurrent callers.
+
+        The result is shared: callers copy before handing it out.
+        """
+        if self.cache.enabled:
+            results = self.cache.results.get(key)
+            if results is not None:
+                return results
+
+        def run():
+            results = compute()
+            # Stored before the flight lands, so late arrivals hit the cache
+            if self.cache.enabled:
+                self.cache.results.put(key, results)
+            return results
+
+        return self.flights.do(key, run)
+
+    def _remember(self, version, products: List[Dict]):
+        # Pre-fills the by-id cache (add_to_cart and /cart look these up next)
+        if self.cache.enabled:
+            for p in products:
+                self.cache.products.put((version, p["id"]), p)
+
+    def search_products(self, query: str = "", category: str = "", tags: List[str] = [], limit: int = 10,
+                        in_stock: bool = False) -> List[Dict]:
+        # Normalized so the same canonical query from different sessions shares
+        # an entry: case and spacing don't matter, and tags are an any-of set
+        version = self.cache.version() if self.cache.enabled else None
+        key = (
+            version, self.search_engine, " ".join(query.lower().split()), category.strip().lower(),
+            tuple(sorted({str(t).lower() for t in tags or []})), limit, bool(in_stock),
+        )
+
+        def compute():
+            results = self._search(query, category, tags, limit, in_stock)
+            self._remember(version, results)
+            return results
+
+        # Callers own the dicts they get back
+        return [_copy_product(p) for p in self._load(key, compute)]
+
+    @timed("db_query")
+    def _search(self, query: str, category: str, tags: List[str], limit: int, in_stock: bool = False) -> List[Dict]:
+        if self.search_engine == "hybrid":
+            return self._search_hybrid(query, category, tags, limit, in_stock)
+        if self.search_engine == "fts":
+            return self._search_fts(query, category, tags, limit, in_stock)
+        if self.search_engine == "index":
+            return self._search_index(query, category, tags, limit, in_stock)
+        return self._search_sql(query, category, tags, limit, in_stock)
+
+    def _search_keyword(self, query: str, category: str, tags: List[str], limit: int, in_stock: bool = False) -> List[Dict]:
+        if fts5_available():
+            return self._search_fts(query, category, tags, limit, in_stock)
+        return self._search_sql(query, category, tags, limit, in_stock)
+
+    def _search_hybrid(self, query: str, category: str, tags: List[str], limit: int, in_stock: bool = False) -> List[Dict]:
+        keyword = self._search_keyword(query, category, tags, limit * HYBRID_DEPTH, in_stock)
+        if not query.strip():
+            return keyword[:limit]
+        vector_ids = get_vector_index().search(query, category=category, tags=tags, limit=limit * HYBRID_DEPTH)
+
+        # Reciprocal rank fusion: rank positions only, so bm25 and cosine
+        # scores never have to be put on the same scale
+        fused: Dict[str, float] = {}
+        for ranking in ([p["id"] for p in keyword], vector_ids):
+            for rank, product_id in enumerate(ranking):
+                fused[product_id] = fused.get(product_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        ranked = sorted(fused, key=fused.get, reverse=True)
+        # The vector index doesn't track stock: keep every candidate until the cards say
+        best = ranked if in_stock else ranked[:limit]
+
+        known = {p["id"]: p for p in keyword}
+        missing = self.get_products_by_ids([i for i in best if i not in known])
+        known.update((p["id"], p) for p in missing)
+        results = [known[i] for i in best if i in known]
+        if in_stock:
+            results = [p for p in results if (p["stock"] or 0) > 0][:limit]
+        return results
+
+    def _search_fts(self, query: str, category: str, tags: List[str], limit: int, in_stock: bool = False) -> List[Dict]:
+        tokens = [t for t in query.lower().split() if any(c.isalnum() for c in t)]
+        if not tokens:
+            # Nothing to rank on, plain filters are enough
+            return self._search_sql(query, category, tags, limit, in_stock)
+
+        terms = [_fts_term(t) for t in tokens]
+        try:
+            with db_connection() as conn:
+                results = self._fts_query(conn, " AND ".join(terms), category, tags, limit, in_stock)
+
+                # Fallback Logic: ANY token or the category, best matches first.
+                # Category and tags are relaxed, availability isn't
+                if not results:
+                    if category:
+                        terms.append(f"category : {_fts_term(category.lower())}")
+                    results = self._fts_query(conn, " OR ".join(terms), "", [], limit, in_stock)
+        except sqlite3.OperationalError:
+            # products_fts missing (init_db not run on this file) or an unparseable MATCH
+            results = []
+
+        if not results:
+            # Tokens are prefix-matched; LIKE still catches substrings ("glass" -> "sunglasses")
+            return self._search_sql(query, category, tags, limit, in_stock)
+        return results
+
+    def _fts_query(self, conn, match: str, category: str, tags: List[str], limit: int, in_stock: bool = False) -> List[Dict]:
+        sql = """
+            SELECT p.* FROM products_fts
+            JOIN products p ON p.rowid = products_fts.rowid
+            WHERE products_fts MATCH ?
+        """
+        filters, params = _filter_sql(category, tags, in_stock)
+        sql += filters
+        params.insert(0, match)
+
+        sql += " ORDER BY bm25(products_fts, {}) LIMIT ?".format(", ".join(str(w) for w in BM25_WEIGHTS))
+        params.append(limit)
+
+        return [_row_to_product(row) for row in conn.execute(sql, params)]
+
+    def _search_index(self, query: str, category: str, tags: List[str], limit: int, in_stock: bool = False) -> List[Dict]:
+        # The inverted index doesn't track stock; over-fetch and filter the cards
+        ids = get_search_index().search(query=query, category=category, tags=tags, limit=limit * HYBRID_DEPTH if in_stock else limit)
+        # Keeps index (storage) order
+        products = self.get_products_by_ids(ids)
+        if in_stock:
+            products = [p for p in products if (p["stock"] or 0) > 0][:limit]
+        return products
+
+    def _search_sql(self, query: str, category: str, tags: List[str], limit: int, in_stock: bool = False) -> List[Dict]:
+        with db_connection() as conn:
+            cursor = conn.cursor()
         
-        results = []
-        for row in rows:
-            p = dict(row)
-            p["tags"] = json.loads(p["tags"]) # Deserialize tags
-            results.append(p)
-            
-        # Post-filter for tags (easier than complex SQL for JSON list intersection in basic sqlite)
-        if tags:
-             results = [
-                p for p in results 
-                if any(tag.lower() in [t.lower() for t in p["tags"]] for tag in tags)
-            ]
+            sql = "SELECT * FROM products p WHERE 1=1"
+            filters, params = _filter_sql(category, tags, in_stock)
+            sql += filters
+
+            if query:
+                # Tokenize query for better matching
+                tokens = query.lower().split()
+                for token in tokens:
+                    sql += " AND (lower(name) LIKE ? OR lower(description) LIKE ? OR lower(tags) LIKE ?)"
+                    params.extend([f"%{token}%", f"%{token}%", f"%{token}%"])
             
-        # Fallback Logic: If too few results, try broader search (ANY match instead of ALL)
-        if len(results) < 1 and query:
-             # Broader search
-             sql_broad = "SELECT * FROM products WHERE 1=1 AND ("
-             params_broad = []
-             if category:
-                 sql_broad += " category LIKE ? OR"
-                 params_broad.append(f"%{category}%")
+            # Execute basic query first
+            sql += " LIMIT ?"
+            params.append(limit)
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+            results = [_row_to_product(row) for row in rows]
+
+            # Fallback Logic: If too few results, try broader search (ANY match instead of ALL)
+            if len(results) < 1 and query:
+                 # Broader search
+                 sql_broad = "SELECT * FROM products p WHERE 1=1{} AND (".format(" AND p.stock > 0" if in_stock else "")
+                 params_broad = []
+                 if category:
+                     sql_broad += f" {CATEGORY_FILTER} OR"
+                     params_broad.append(f"%{category}%")
                  
-             tokens = query.lower().split()
-             for token in tokens:
-                 sql_broad += " lower(name) LIKE ? OR lower(description) LIKE ? OR lower(tags) LIKE ? OR"
-                 params_broad.extend([f"%{token}%", f"%{token}%", f"%{token}%"])
+                 tokens = query.lower().split()
+                 for token in tokens:
+                     sql_broad += " lower(name) LIKE ? OR lower(description) LIKE ? OR lower(tags) LIKE ? OR"
+                     params_broad.extend([f"%{token}%", f"%{token}%", f"%{token}%"])
              
-             # Remove last OR
-             if sql_broad.endswith("OR"):
-                 sql_broad = sql_broad[:-2]
+                 # Remove last OR
+                 if sql_broad.endswith("OR"):
+                     sql_broad = sql_broad[:-2]
              
-             sql_broad += ")"
+                 sql_broad += ") LIMIT ?"
+                 params_broad.append(limit)
              
-             # Avoid re-running empty query
-             if tokens or category:
-                 cursor.execute(sql_broad, params_broad)
-                 rows_broad = cursor.fetchall()
-                 for row in rows_broad:
-                     p = dict(row)
-                     p["tags"] = json.loads(p["tags"])
-                     # Avoid duplicates if we had some results
-                     if not any(r['id'] == p['id'] for r in results):
-                         results.append(p)
-
-        conn.close()
-        return results[:10] # Limit to top 10 matches to avoid overwhelming LLM
+                 # Avoid re-running empty query
+                 if tokens or category:
+                     cursor.execute(sql_broad, params_broad)
+                     rows_broad = cursor.fetchall()
+                     for row in rows_broad:
+                         p = _row_to_product(row)
+                         # Avoid duplicates if we had some results
+                         if not any(r['id'] == p['id'] for r in results):
+                             results.append(p)
+
+        return results[:limit] # Limit to top matches to avoid overwhelming LLM
+
+    def search_page(self, query: str = "", category: str = "", tags: List[str] = [], color: str = "", demographic: str = "",
+                    min_price: Optional[float] = None, max_price: Optional[float] = None, in_stock: bool = False,
+                    sort: str = "relevance", limit: int = 20, cursor: Optional[str] = None,
+                    facets: Optional[bool] = None) -> Dict:
+        """One page of matches, plus facet counts over all of them (first page by default).
+
+        Keyset pagination: `next_cursor` carries the sort key of the page's
+        last row and the next page seeks past it in SQL, so page 50 costs
+        what page 1 does. Every token must match (no OR fallback, which
+        would reshuffle pages). Raises ValueError for a bad sort or cursor.
+        """
+        if sort not in PAGE_SORTS:
+            raise ValueError(f"sort must be one of {', '.join(PAGE_SORTS)}.")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        filters = SearchFilters(query, category, tags, color, demographic, min_price, max_price, in_stock)
+        # Cursors only resume the search that issued them
+        digest = format(zlib.crc32(repr((filters.key(), sort)).encode()), "08x")
+        after = _decode_cursor(cursor, digest) if cursor else None
+        if facets is None:
+            facets = cursor is None
+
+        version = self.cache.version() if self.cache.enabled else None
+
+        def compute():
+            rows = self._page(filters, sort, limit, after)
+            self._remember(version, [p for _, p in rows])
+            return rows
+
+        rows = self._load((version, "page", filters.key(), sort, limit, cursor), compute)
+        counts = self._load((version, "facets", filters.key()), lambda: self._facets(filters)) if facets else None
+
+        # One extra row was fetched to tell whether there's a next page
+        page = rows[:limit]
+        next_cursor = _encode_cursor(digest, page[-1][0]) if len(rows) > limit else None
+        return {
+            "products": [_copy_product(p) for _, p in page],
+            "next_cursor": next_cursor,
+            "sort": sort,
+            "facets": copy.deepcopy(counts),
+        }
+
+    @timed("db_query")
+    def _page(self, filters: SearchFilters, sort: str, limit: int, after: Optional[List]) -> List[Tuple[List, Dict]]:
+        """Up to limit + 1 (sort key, product) pairs past `after`."""
+        use_fts = bool(filters.tokens) and fts5_available()
+        source, params = filters.source_sql(use_fts)
+
+        if sort == "relevance" and use_fts:
+            # bm25() is computed for every match either way; the keyset just
+            # skips the ones already served before the top-N sort
+            rank = "bm25(products_fts, {})".format(", ".join(str(w) for w in BM25_WEIGHTS))
+            sql = f"SELECT * FROM (SELECT p.*, p.rowid AS _rowid, {rank} AS _rank FROM {source})"
+            if after is not None:
+                sql += " WHERE (_rank, _rowid) > (?, ?)"
+            sql += " ORDER BY _rank, _rowid LIMIT ?"
+            key = lambda row: [row["_rank"], row["_rowid"]]
+        elif sort == "relevance":
+            # Nothing to rank on: storage order, a rowid seek per page
+            sql = f"SELECT p.*, p.rowid AS _rowid FROM {source}"
+            if after is not None:
+                sql += " AND p.rowid > ?"
+            sql += " ORDER BY p.rowid LIMIT ?"
+            key = lambda row: [row["_rowid"]]
+        else:
+            # (price, rowid) row values seek on idx_products_price
+            op, direction = (">", "") if sort == "price_asc" else ("<", " DESC")
+            sql = f"SELECT p.*, p.rowid AS _rowid FROM {source}"
+            if after is not None:
+                sql += f" AND (p.price, p.rowid) {op} (?, ?)"
+            sql += f" ORDER BY p.price{direction}, p.rowid{direction} LIMIT ?"
+            key = lambda row: [row["price"], row["_rowid"]]
+
+        params += list(after or []) + [limit + 1]
+        with db_connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        results = []
+        for row in rows:
+            p = _row_to_product(row)
+            p.pop("_rowid", None)
+            p.pop("_rank", None)
+            results.append((key(row), p))
+        return results
+
+    @timed("db_query")
+    def _facets(self, filters: SearchFilters) -> Dict:
+        """Counts by category, price band, color and demographic over every match."""
+        use_fts = bool(filters.tokens) and fts5_available()
+        source, params = filters.source_sql(use_fts)
+        band = "CASE {} ELSE {} END".format(
+            " ".join(f"WHEN p.price < {high} THEN {i}" for i, high in enumerate(PRICE_BANDS)), len(PRICE_BANDS)
+        )
+        vocabulary = FACET_COLORS + DEMOGRAPHICS
+        # One statement. Each branch re-runs the (indexed) match rather than
+        # reading a materialized CTE, which measured 2-3x slower on big
+        # result sets; tag counts come off product_tags' primary key
+        sql = f"""
+            SELECT 'category', p.category, COUNT(*) FROM {source} GROUP BY p.category
+            UNION ALL
+            SELECT 'price', {band}, COUNT(*) FROM {source} GROUP BY 2
+            UNION ALL
+            SELECT 'tag', t.tag, COUNT(*) FROM product_tags t JOIN (SELECT p.id FROM {source}) m ON t.product_id = m.id
+            WHERE t.tag IN ({",".join("?" * len(vocabulary))}) GROUP BY t.tag
+        """
+        with db_connection() as conn:
+            rows = conn.execute(sql, params * 3 + list(vocabulary)).fetchall()
+
+        facets: Dict = {"total": 0, "category": [], "color": [], "demographic": [], "price": []}
+        for facet, value, count in rows:
+            if facet == "category":
+                facets["total"] += count
+                facets["category"].append({"value": value, "count": count})
+            elif facet == "price":
+                label, low, high = _price_band_label(value)
+                facets["price"].append({"value": label, "min": low, "max": high, "count": count})
+            else:
+                facets["color" if value in FACET_COLORS else "demographic"].append({"value": value, "count": count})
+        for name in ("category", "color", "demographic"):
+            facets[name].sort(key=lambda f: (-f["count"], f["value"]))
+        facets["price"].sort(key=lambda f: f["min"])
+        return facets
 
     def get_product_by_id(self, product_id: str) -> Optional[Dict]:
-        conn = get_db_connection()
-        row = conn.execute("SELECT * FROM products WHERE id = ?", (product_id,)).fetchone()
-        conn.close()
-        
-        if row:
-            p = dict(row)
-            p["tags"] = json.loads(p["tags"])
-            return p
-        return None
-
-    def get_recommendations(self, product_id: str) -> List[Dict]:
-        target = self.get_product_by_id(product_id)
-        if not target:
+        products = self.get_products_by_ids([product_id])
+        return products[0] if products else None
+
+    def get_products_by_ids(self, product_ids: List[str]) -> List[Dict]:
+        """Products in the order of `product_ids`; unknown ids are skipped."""
+        if not product_ids:
             return []
-        
-        # Simple Logic: Same category, different item
-        conn = get_db_connection()
-        rows = conn.execute(
-            "SELECT * FROM products WHERE category = ? AND id != ? LIMIT 3", 
-            (target["category"], product_id)
-        ).fetchall()
-        conn.close()
-        
-        recs = []
-        for row in rows:
-            p = dict(row)
-            p["tags"] = json.loads(p["tags"])
-            recs.append(p)
-            
-        return recs
+        if not self.cache.enabled:
+            unique = list(dict.fromkeys(product_ids))
+            by_id = self.flights.do((None, "products", tuple(unique)), lambda: self._fetch_products(unique))
+            return [_copy_product(by_id[i]) for i in product_ids if i in by_id]
+
+        version = self.cache.version()
+        by_id = {}
+        for product_id in product_ids:
+            product = self.cache.products.get((version, product_id), _MISSING)
+            if product is not _MISSING:
+                by_id[product_id] = product
+        missing = [i for i in dict.fromkeys(product_ids) if i not in by_id]
+        if missing:
+            fetched = self.flights.do((version, "products", tuple(missing)), lambda: self._fetch_products(missing))
+            for product_id in missing:
+                by_id[product_id] = fetched.get(product_id)
+                self.cache.products.put((version, product_id), by_id[product_id])
+        return [_copy_product(by_id[i]) for i in product_ids if by_id[i] is not None]
+
+    @timed("db_query")
+    def _fetch_products(self, product_ids: List[str]) -> Dict[str, Dict]:
+        placeholders = ",".join("?" * len(product_ids))
+        with db_connection() as conn:
+            rows = conn.execute(f"SELECT * FROM products WHERE id IN ({placeholders})", product_ids).fetchall()
+        return {row["id"]: _row_to_product(row) for row in rows}
+
+    def get_recommendations(self, product_id: str, limit: int = 3) -> List[Dict]:
+        version = self.cache.version() if self.cache.enabled else None
+        results = self._load((version, "recommendations", product_id, limit), lambda: self._recommendations(product_id, limit))
+        return [_copy_product(p) for p in results]
+
+    @timed("db_query")
+    def _recommendations(self, product_id: str, limit: int) -> List[Dict]:
+        # Lists are precomputed (recommendations.py); serving is one indexed read
+        get_recommendation_index().ensure_fresh()
+        with db_connection() as conn:
+            rows = conn.execute(
+                "SELECT p.* FROM product_recommendations r JOIN products p ON p.id = r.recommended_id "
+                "WHERE r.product_id = ? ORDER BY r.score DESC LIMIT ?",
+                (product_id, limit)
+            ).fetchall()
+
+        return [_row_to_product(row) for row in rows]
@@ -1,16 +1,468 @@
 import sqlite3
 import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
 DB_NAME = "shopper.db"
 
+# Applied once to every new pooled connection
+STARTUP_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA mmap_size={int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024))}",
+    f"PRAGMA cache_size={int(os.getenv('DB_CACHE_SIZE', -64000))}",  # negative = KiB
+    "PRAGMA temp_store=MEMORY",
+]
+
 def get_db_connection():
     conn = sqlite3.connect(DB_NAME)
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_db():
-    if os.path.exists(DB_NAME):
+class ConnectionPool:
+    """Bounded pool of SQLite connections with per-thread reuse.
+
+    A thread gets back the connection it used last when that one is idle,
+    and nested `connection()` blocks on the same thread share one
+    connection. At most `max_size` connections are checked out at once;
+    further callers wait up to `timeout` seconds.
+    """
+
+    def __init__(self, db_name: str, max_size: int = 8, timeout: float = 10.0, health_check_interval: float = 30.0):
+        self.db_name = db_name
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle: List[Tuple[sqlite3.Connection, float]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.created = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections move between threadpool workers, one user at a time
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, timeout=self.timeout)
+        conn.row_factory = sqlite3.Row
+        for pragma in STARTUP_PRAGMAS:
+            conn.execute(pragma)
+        self.created += 1
+        return conn
+
+    def _healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _checkout(self) -> sqlite3.Connection:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No database connection available after {self.timeout}s")
+
+        preferred = getattr(self._local, "last", None)
+        entry = None
+        with self._lock:
+            for i, (conn, _) in enumerate(self._idle):
+                if conn is preferred:
+                    entry = self._idle.pop(i)
+                    break
+            if entry is None and self._idle:
+                entry = self._idle.pop()
+
+        conn = None
+        if entry:
+            conn, last_used = entry
+            if time.monotonic() - last_used > self.health_check_interval and not self._healthy(conn):
+                self._discard(conn)
+                conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+
+        self._local.last = conn
+        return conn
+
+    def _checkin(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        except sqlite3.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, "held", None)
+        if held is not None:
+            yield held
+            return
+
+        conn = self._checkout()
+        self._local.held = conn
+        try:
+            yield conn
+        finally:
+            self._local.held = None
+            self._checkin(conn)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.db_name != DB_NAME:
+            if _pool is not None:
+                _pool.close_all()
+            _pool = ConnectionPool(
+                DB_NAME,
+                max_size=int(os.getenv("DB_POOL_SIZE", 8)),
+                timeout=float(os.getenv("DB_POOL_TIMEOUT", 10)),
+            )
+        return _pool
+
+def db_connection():
+    """Context manager yielding a pooled connection: `with db_connection() as conn:`"""
+    return get_pool().connection()
+
+@lru_cache(maxsize=1)
+def fts5_available() -> bool:
+    # Some SQLite builds (older distros, custom Python builds) ship without FTS5
+    try:
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE VIRTUAL TABLE fts5_probe USING fts5(x)")
+        conn.close()
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def _create_search_index(conn):
+    # External-content FTS5 table over products, kept in sync by triggers.
+    # It mirrors rowids, so run rebuild_search_index() after a VACUUM.
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+    ).fetchone()
+
+    conn.executescript('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description, category, tags,
+            content='products', content_rowid='rowid'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts(rowid, name, description, category, tags)
+            VALUES (new.rowid, new.name, new.description, new.category, new.tags);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name, description, category, tags)
+            VALUES ('delete', old.rowid, old.name, old.description, old.category, old.tags);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name, description, category, tags)
+            VALUES ('delete', old.rowid, old.name, old.description, old.category, old.tags);
+            INSERT INTO products_fts(rowid, name, description, category, tags)
+            VALUES (new.rowid, new.name, new.description, new.category, new.tags);
+        END;
+    ''')
+
+    if not exists:
+        # Existing databases already have rows; index them once
+        rebuild_search_index(conn)
+
+def _create_catalog_version(conn):
+    # Monotonic counter bumped by every write to products; caches compare it
+    # to decide whether what they hold is stale. Lives in the database so all
+    # workers see the same value.
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO catalog_meta (key, value) VALUES ('version', 0);
+
+        CREATE TRIGGER IF NOT EXISTS products_version_ai AFTER INSERT ON products BEGIN
+            UPDATE catalog_meta SET value = value + 1 WHERE key = 'version';
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_version_ad AFTER DELETE ON products BEGIN
+            UPDATE catalog_meta SET value = value + 1 WHERE key = 'version';
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_version_au AFTER UPDATE ON products BEGIN
+            UPDATE catalog_meta SET value = value + 1 WHERE key = 'version';
+        END;
+    ''')
+
+def _create_recommendations(conn):
+    # Precomputed top-N similar products (see recommendations.py). Writes to
+    # the fields similarity depends on queue the product for an incremental
+    # refresh; stock updates don't.
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS product_recommendations (
+            product_id TEXT NOT NULL,
+            recommended_id TEXT NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (product_id, recommended_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_recommendations_recommended
+            ON product_recommendations (recommended_id);
+
+        CREATE TABLE IF NOT EXISTS recommendations_queue (
+            product_id TEXT PRIMARY KEY
+        ) WITHOUT ROWID;
+        INSERT OR IGNORE INTO catalog_meta (key, value) VALUES ('recommendations_built', 0);
+
+        CREATE TRIGGER IF NOT EXISTS products_recs_ai AFTER INSERT ON products BEGIN
+            INSERT OR IGNORE INTO recommendations_queue (product_id) VALUES (new.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_recs_ad AFTER DELETE ON products BEGIN
+            INSERT OR IGNORE INTO recommendations_queue (product_id) VALUES (old.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_recs_au AFTER UPDATE OF id, name, category, price, tags ON products BEGIN
+            INSERT OR IGNORE INTO recommendations_queue (product_id) VALUES (old.id);
+            INSERT OR IGNORE INTO recommendations_queue (product_id) VALUES (new.id);
+        END;
+    ''')
+
+def _migrate_product_tags(conn):
+    # One row per (product, lowercased tag), kept in sync by triggers, so tag
+    # filters are an indexed lookup instead of json_each() over every row
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS product_tags (
+            product_id TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (product_id, tag)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_product_tags_tag ON product_tags (tag, product_id)")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_tags_ai AFTER INSERT ON products BEGIN
+            INSERT OR IGNORE INTO product_tags (product_id, tag)
+            SELECT new.id, lower(value) FROM json_each(new.tags);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_tags_ad AFTER DELETE ON products BEGIN
+            DELETE FROM product_tags WHERE product_id = old.id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_tags_au AFTER UPDATE OF id, tags ON products BEGIN
+            DELETE FROM product_tags WHERE product_id = old.id;
+            INSERT OR IGNORE INTO product_tags (product_id, tag)
+            SELECT new.id, lower(value) FROM json_each(new.tags);
+        END
+    ''')
+    rebuild_product_tags(conn)
+
+def _migrate_filter_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products (category)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_price ON products (price)")
+
+def _migrate_orders(conn):
+    # Stock writes get their own counter: they must invalidate cached search
+    # results (stock is in them, and the in-stock filter reads it) but not
+    # the search/vector indexes, recommendations or LLM answers, which only
+    # depend on product content
+    conn.execute("INSERT OR IGNORE INTO catalog_meta (key, value) VALUES ('stock_version', 0)")
+    conn.execute("DROP TRIGGER IF EXISTS products_version_au")
+    conn.execute('''
+        CREATE TRIGGER products_version_au AFTER UPDATE OF id, name, category, price, description, tags, image ON products BEGIN
+            UPDATE catalog_meta SET value = value + 1 WHERE key = 'version';
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_stock_au AFTER UPDATE OF stock ON products BEGIN
+            UPDATE catalog_meta SET value = value + 1 WHERE key = 'stock_version';
+        END
+    ''')
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'products_fts_au'").fetchone():
+        # Don't re-index a product's text on every stock decrement
+        conn.execute("DROP TRIGGER products_fts_au")
+        conn.execute('''
+            CREATE TRIGGER products_fts_au AFTER UPDATE OF name, description, category, tags ON products BEGIN
+                INSERT INTO products_fts(products_fts, rowid, name, description, category, tags)
+                VALUES ('delete', old.rowid, old.name, old.description, old.category, old.tags);
+                INSERT INTO products_fts(rowid, name, description, category, tags)
+                VALUES (new.rowid, new.name, new.description, new.category, new.tags);
+            END
+        ''')
+
+    # In-stock filter; also serves category (+ price) filters on in-stock rows
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_in_stock ON products (category, price) WHERE stock > 0")
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            id TEXT PRIMARY KEY,
+            session_id TEXT,
+            total REAL NOT NULL,
+            item_count INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_session ON orders (session_id, created_at)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_id TEXT NOT NULL,
+            product_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            price REAL NOT NULL,
+            qty INTEGER NOT NULL,
+            PRIMARY KEY (order_id, product_id)
+        ) WITHOUT ROWID
+    ''')
+
+def _migrate_order_keys(conn):
+    # One order per cart state: a checkout of the same (session, cart_id-revision)
+    # from another worker fails the insert and gets the first order back
+    conn.execute("ALTER TABLE orders ADD COLUMN cart_key TEXT")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_cart_key ON orders (session_id, cart_key)")
+
+# Schema changes after the base tables, applied in order. The number of
+# migrations applied is kept in PRAGMA user_version; append, never reorder.
+# Migrations run inside the caller's transaction, so no executescript()
+# (it commits first).
+MIGRATIONS = [
+    _migrate_product_tags,
+    _migrate_filter_indexes,
+    _migrate_orders,
+    _migrate_order_keys,
+]
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """Bring the database up to len(MIGRATIONS), one transaction per migration."""
+    while True:
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        # Re-read under the write lock: another worker may have just migrated
+        version = schema_version(conn)
+        if version >= len(MIGRATIONS):
+            conn.rollback()
+            return
+        try:
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied schema migration {version + 1}: {MIGRATIONS[version].__name__[len('_migrate_'):]}")
+
+def catalog_version() -> int:
+    try:
+        with db_connection() as conn:
+            row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'version'").fetchone()
+    except sqlite3.OperationalError:
+        # init_db() hasn't run on this file
+        return 0
+    return row[0] if row else 0
+
+def catalog_versions() -> Tuple[int, int]:
+    """(content version, stock version), for caches that hold stock levels."""
+    try:
+        with db_connection() as conn:
+            rows = dict(conn.execute(
+                "SELECT key, value FROM catalog_meta WHERE key IN ('version', 'stock_version')"
+            ).fetchall())
+    except sqlite3.OperationalError:
+        return (0, 0)
+    return (rows.get("version", 0), rows.get("stock_version", 0))
+
+# Hot paths (cache lookups, index freshness checks) re-read the versions at
+# most this often. This process's own writes call invalidate_catalog_versions()
+# after committing; other processes' writes show up within the TTL.
+CATALOG_VERSION_TTL = float(os.getenv("CATALOG_VERSION_TTL", 1.0))
+_versions_lock = threading.Lock()
+_versions_cache: Optional[Tuple[float, str, Tuple[int, int]]] = None  # (read at, DB_NAME, versions)
+_versions_generation = 0
+
+def cached_catalog_versions() -> Optional[Tuple[int, int]]:
+    """The last versions read, if younger than CATALOG_VERSION_TTL; never touches SQLite."""
+    cached = _versions_cache
+    if cached is not None and cached[1] == DB_NAME and time.monotonic() - cached[0] < CATALOG_VERSION_TTL:
+        return cached[2]
+    return None
+
+def recent_catalog_versions() -> Tuple[int, int]:
+    """catalog_versions(), served from memory for up to CATALOG_VERSION_TTL."""
+    global _versions_cache
+    versions = cached_catalog_versions()
+    if versions is not None:
+        return versions
+    generation = _versions_generation
+    read_at = time.monotonic()
+    versions = catalog_versions()
+    with _versions_lock:
+        # An invalidation during the read means it may predate that write
+        if generation == _versions_generation:
+            _versions_cache = (read_at, DB_NAME, versions)
+    return versions
+
+def recent_catalog_version() -> int:
+    return recent_catalog_versions()[0]
+
+def invalidate_catalog_versions():
+    """Call after committing a products write, so this process sees it at once."""
+    global _versions_cache, _versions_generation
+    with _versions_lock:
+        _versions_generation += 1
+        _versions_cache = None
+
+def bump_catalog_version(conn):
+    conn.execute("UPDATE catalog_meta SET value = value + 1 WHERE key = 'version'")
+
+def rebuild_search_index(conn):
+    conn.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+def rebuild_product_tags(conn, after_rowid: Optional[int] = None):
+    """Re-derive product_tags from products.tags: all of it, or only for
+    products with a rowid above `after_rowid` (the rows an append loaded)."""
+    if after_rowid is None:
+        conn.execute("DELETE FROM product_tags")
+        conn.execute(
+            "INSERT OR IGNORE INTO product_tags (product_id, tag) "
+            "SELECT p.id, lower(j.value) FROM products p, json_each(p.tags) j"
+        )
         return
+    # Replaced ids are in that range too (INSERT OR REPLACE gives them a new
+    # rowid), so their old tags go as well
+    conn.execute(
+        "DELETE FROM product_tags WHERE product_id IN (SELECT id FROM products WHERE rowid > ?)", (after_rowid,)
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO product_tags (product_id, tag) "
+        "SELECT p.id, lower(j.value) FROM products p, json_each(p.tags) j WHERE p.rowid > ?",
+        (after_rowid,)
+    )
+
+def init_db():
+    is_new = not os.path.exists(DB_NAME)
 
     conn = get_db_connection()
     try:
@@ -26,8 +478,16 @@ def init_db():
                 image TEXT
             )
         ''')
+        _create_catalog_version(conn)
+        _create_recommendations(conn)
+        if fts5_available():
+            _create_search_index(conn)
+        else:
+            print("Warning: SQLite was built without FTS5. Falling back to LIKE search.")
+        migrate(conn)
         conn.commit()
-        print("Database initialized successfully.")
+        if is_new:
+            print("Database initialized successfully.")
     except Exception as e:
         print(f"Error initializing database: {e}")
     finally:
@@ -0,0 +1,429 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from telemetry import Counter, Gauge, record, register
+
+# Budget for one completion: queueing, retries and fallbacks included
+DEADLINE = float(os.getenv("LLM_DEADLINE_S", 30))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 0.5))
+RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", 8))
+
+LLM_CALLS = register(Counter("shopper_llm_calls_total", "Provider calls by provider and result (ok, error, timeout)."))
+LLM_RETRIES = register(Counter("shopper_llm_retries_total", "Provider calls retried after a retryable error."))
+LLM_FALLBACKS = register(Counter("shopper_llm_fallbacks_total", "Completions handed to the next provider in the chain."))
+LLM_SHED = register(Counter("shopper_llm_shed_total", "Requests turned away by admission control, by provider and reason."))
+LLM_QUEUE_DEPTH = register(Gauge("shopper_llm_queue_depth", "Requests waiting for a provider concurrency slot."))
+LLM_IN_FLIGHT = register(Gauge("shopper_llm_in_flight", "Provider calls currently running."))
+
+# Upstream statuses worth another attempt; anything else goes straight to the next provider
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class Overloaded(Exception):
+    """Every provider is saturated: the caller should answer 429/503 with Retry-After."""
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Unavailable(Exception):
+    # A provider can't take the call within the deadline; try the next one
+    def __init__(self, reason: str, retry_after: Optional[float] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """`rate` calls per second, bursts up to `burst`. rate <= 0 disables it."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """Take a token; returns how long to wait before using it, or None (nothing taken) if over max_wait."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if wait > max_wait:
+                return None
+            # May go negative: later callers queue up behind this reservation
+            self.tokens -= 1
+            return wait
+
+
+class ConcurrencyLimit:
+    """A semaphore threads and coroutines share, with a bounded wait queue.
+
+    A released slot is handed straight to the oldest waiter, so a newcomer
+    can't overtake the queue. Entering when the queue is full raises
+    _Unavailable("queue_full") instead of waiting.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self._waiters: deque = deque()  # threading.Event or asyncio.Future
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _enter(self, waiter) -> bool:
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                self._publish()
+                return True
+            if len(self._waiters) >= self.max_queue:
+                raise _Unavailable("queue_full")
+            self._waiters.append(waiter)
+            self._publish()
+            return False
+
+    def _withdraw(self, waiter) -> bool:
+        # True if the waiter left the queue, False if it was already handed a slot
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._publish()
+                return True
+            return False
+
+    def acquire(self, timeout: float):
+        event = threading.Event()
+        if self._enter(event):
+            return
+        if not event.wait(timeout) and self._withdraw(event):
+            raise _Unavailable("deadline")
+
+    async def aacquire(self, timeout: float):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self._enter(future):
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if not self._withdraw(future):
+                # Granted as we gave up: pass it on once the grant lands
+                future.add_done_callback(lambda _: self.release())
+            if isinstance(e, asyncio.TimeoutError):
+                raise _Unavailable("deadline")
+            raise
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                self._publish()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                else:
+                    waiter.get_loop().call_soon_threadsafe(_grant, waiter)
+                return
+            self.active -= 1
+            self._publish()
+
+    def _publish(self):
+        LLM_QUEUE_DEPTH.set(len(self._waiters), provider=self.name)
+        LLM_IN_FLIGHT.set(self.active, provider=self.name)
+
+
+def _grant(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+
+class Provider:
+    """One LLM backend: its clients (built lazily by `build`) and admission limits.
+
+    Limits come from LLM_<NAME>_MAX_CONCURRENCY, _MAX_QUEUE, _RPS, _BURST
+    and _TIMEOUT (seconds per attempt).
+    """
+
+    def __init__(self, name: str, model: str, build: Callable[[], Tuple[Any, Any]]):
+        self.name = name
+        self.model = model
+        self._build = build
+        self._clients: Optional[Tuple[Any, Any]] = None
+        self._lock = threading.Lock()
+
+        prefix = f"LLM_{name.upper()}_"
+        self.timeout = float(os.getenv(prefix + "TIMEOUT", 20))
+        self.limit = ConcurrencyLimit(
+            name,
+            limit=int(os.getenv(prefix + "MAX_CONCURRENCY", 16)),
+            max_queue=int(os.getenv(prefix + "MAX_QUEUE", 64)),
+        )
+        rate = float(os.getenv(prefix + "RPS", 0))
+        self.bucket = TokenBucket(rate, float(os.getenv(prefix + "BURST", rate)))
+        # Set from an upstream Retry-After: nobody calls before then
+        self.cooldown_until = 0.0
+
+    def clients(self) -> Tuple[Any, Any]:
+        """(sync, async) SDK clients, built once."""
+        if self._clients is None:
+            with self._lock:
+                if self._clients is None:
+                    self._clients = self._build()
+        return self._clients
+
+    def admission_wait(self, remaining: float) -> float:
+        """Seconds until this provider may be called: cooldown and rate limit. Raises _Unavailable."""
+        if remaining <= 0:
+            raise _Unavailable("deadline")
+        cooldown = self.cooldown_until - time.monotonic()
+        if cooldown > remaining:
+            raise _Unavailable("rate_limited", cooldown)
+        wait = self.bucket.reserve(remaining - max(cooldown, 0.0))
+        if wait is None:
+            raise _Unavailable("rate_limited", 1.0 / self.bucket.rate)
+        return max(cooldown, wait)
+
+
+def _status(e: BaseException) -> Optional[int]:
+    return getattr(e, "status_code", None)
+
+
+def _retryable(e: BaseException) -> bool:
+    if isinstance(e, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    # groq and openai share these names (no SDK import needed)
+    if type(e).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return True
+    return _status(e) in RETRYABLE_STATUS
+
+
+def _retry_after(e: BaseException) -> Optional[float]:
+    """Seconds from the error's Retry-After / retry-after-ms header, if any."""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+class ProviderGateway:
+    """Every LLM call goes through here: admission control, timeouts, retries, fallback.
+
+    Per provider: a token bucket and a concurrency limit with a bounded
+    queue. A call gets DEADLINE seconds overall. Each attempt's timeout is
+    capped by what's left, and every attempt, retries included, takes a
+    token from the rate limit. Retryable errors (timeouts, connection errors,
+    408/429/5xx) back off with jitter, or for Retry-After when upstream sets
+    it. When a provider is exhausted, saturated or cooling down, the next
+    one in the chain takes over. If all of them only shed load, Overloaded
+    is raised for the caller to turn into 429/503.
+    """
+
+    def __init__(self, providers: List[Provider]):
+        self.providers = providers
+
+    @property
+    def primary(self) -> Provider:
+        return self.providers[0]
+
+    def warm_up(self):
+        for provider in self.providers:
+            provider.clients()
+
+    def check_admission(self):
+        """Raise Overloaded right away when every provider's queue is already full."""
+        if all(p.limit.queued >= p.limit.max_queue for p in self.providers):
+            LLM_SHED.inc(provider="all", reason="queue_full")
+            raise Overloaded("All LLM providers are at capacity.", 503, retry_after=1.0)
+
+    def _prepare(self, provider: Provider, request: Dict[str, Any], remaining: float) -> Dict[str, Any]:
+        # The model is the provider's; the attempt timeout never outlives the deadline
+        return {**request, "model": provider.model, "timeout": min(provider.timeout, remaining)}
+
+    def _failed(self, provider: Provider, attempt: int, e: BaseException, deadline: float) -> Optional[float]:
+        """Delay before retrying `provider` after `e`, or None to move on to the next provider."""
+        LLM_CALLS.inc(provider=provider.name, result="timeout" if "Timeout" in type(e).__name__ else "error")
+        print(f"LLM call to {provider.name} failed (attempt {attempt + 1}): {e!r}")
+        if not _retryable(e):
+            return None
+        retry_after = _retry_after(e)
+        if retry_after is not None:
+            provider.cooldown_until = max(provider.cooldown_until, time.monotonic() + retry_after)
+        delay = retry_after if retry_after is not None else _backoff(attempt)
+        # Leave the rest of the budget to the next provider rather than sleep it away
+        if attempt >= MAX_RETRIES or time.monotonic() + delay >= deadline:
+            return None
+        # A retry is a call like any other: it takes a token from the rate
+        # limit (and waits out the cooldown), or the provider is given up on
+        try:
+            delay = max(delay, provider.admission_wait(deadline - time.monotonic()))
+        except _Unavailable as u:
+            LLM_SHED.inc(provider=provider.name, reason=u.reason)
+            return None
+        if time.monotonic() + delay >= deadline:
+            return None
+        LLM_RETRIES.inc(provider=provider.name)
+        return delay
+
+    def _give_up(self, shed: List[_Unavailable], error: Optional[BaseException]):
+        if error is not None:
+            raise error
+        rate_limited = [u for u in shed if u.reason == "rate_limited"]
+        if rate_limited and len(rate_limited) == len(shed):
+            raise Overloaded("LLM providers are rate limited.", 429, min(u.retry_after or 1.0 for u in rate_limited))
+        raise Overloaded("LLM providers are at capacity.", 503, retry_after=1.0)
+
+    def complete(self, request: Dict[str, Any]) -> Tuple[str, Any]:
+        """Blocking chat.completions.create; returns (provider name, response)."""
+        deadline = time.monotonic() + DEADLINE
+        shed: List[_Unavailable] = []
+        error = None
+        for i, provider in enumerate(self.providers):
+            if i:
+                LLM_FALLBACKS.inc(provider=provider.name)
+            try:
+                started = time.monotonic()
+                time.sleep(provider.admission_wait(deadline - started))
+                provider.limit.acquire(deadline - time.monotonic())
+                record("llm_queue", time.monotonic() - started)
+            except _Unavailable as u:
+                LLM_SHED.inc(provider=provider.name, reason=u.reason)
+                shed.append(u)
+                continue
+            try:
+                client = provider.clients()[0]
+                for attempt in range(MAX_RETRIES + 1):
+                    try:
+                        response = client.chat.completions.create(**self._prepare(provider, request, deadline - time.monotonic()))
+                    except Exception as e:
+                        error = e
+                        delay = self._failed(provider, attempt, e, deadline)
+                        if delay is None:
+                            break
+                        time.sleep(delay)
+                        continue
+                    LLM_CALLS.inc(provider=provider.name, result="ok")
+                    return provider.name, response
+            finally:
+                provider.limit.release()
+        self._give_up(shed, error)
+
+    async def _aadmit(self, provider: Provider, deadline: float):
+        started = time.monotonic()
+        await asyncio.sleep(provider.admission_wait(deadline - started))
+        await provider.limit.aacquire(deadline - time.monotonic())
+        record("llm_queue", time.monotonic() - started)
+
+    async def acomplete(self, request: Dict[str, Any]) -> Tuple[str, Any]:
+        """complete() for the event loop."""
+        deadline = time.monotonic() + DEADLINE
+        shed: List[_Unavailable] = []
+        error = None
+        for i, provider in enumerate(self.providers):
+            if i:
+                LLM_FALLBACKS.inc(provider=provider.name)
+            try:
+                await self._aadmit(provider, deadline)
+            except _Unavailable as u:
+                LLM_SHED.inc(provider=provider.name, reason=u.reason)
+                shed.append(u)
+                continue
+            try:
+                client = provider.clients()[1]
+                for attempt in range(MAX_RETRIES + 1):
+                    remaining = deadline - time.monotonic()
+                    try:
+                        # wait_for as well: not every client honours `timeout`
+                        response = await asyncio.wait_for(
+                            client.chat.completions.create(**self._prepare(provider, request, remaining)), remaining
+                        )
+                    except Exception as e:
+                        error = e
+                        delay = self._failed(provider, attempt, e, deadline)
+                        if delay is None:
+                            break
+                        await asyncio.sleep(delay)
+                        continue
+                    LLM_CALLS.inc(provider=provider.name, result="ok")
+                    return provider.name, response
+            finally:
+                provider.limit.release()
+        self._give_up(shed, error)
+
+    @asynccontextmanager
+    async def astream(self, request: Dict[str, Any]):
+        """Open a streamed completion: `async with gateway.astream(request) as (provider_name, stream)`.
+
+        Opening gets the same admission, retries and fallback as
+        acomplete(); once chunks flow nothing is retried (they may already
+        be on the wire). The concurrency slot is held until the block exits.
+        """
+        deadline = time.monotonic() + DEADLINE
+        shed: List[_Unavailable] = []
+        error = None
+        for i, provider in enumerate(self.providers):
+            if i:
+                LLM_FALLBACKS.inc(provider=provider.name)
+            try:
+                await self._aadmit(provider, deadline)
+            except _Unavailable as u:
+                LLM_SHED.inc(provider=provider.name, reason=u.reason)
+                shed.append(u)
+                continue
+            try:
+                client = provider.clients()[1]
+                stream = None
+                for attempt in range(MAX_RETRIES + 1):
+                    remaining = deadline - time.monotonic()
+                    try:
+                        stream = await asyncio.wait_for(
+                            client.chat.completions.create(stream=True, **self._prepare(provider, request, remaining)), remaining
+                        )
+                    except Exception as e:
+                        error = e
+                        delay = self._failed(provider, attempt, e, deadline)
+                        if delay is None:
+                            break
+                        await asyncio.sleep(delay)
+                        continue
+                    break
+                if stream is not None:
+                    LLM_CALLS.inc(provider=provider.name, result="ok")
+                    yield provider.name, stream
+                    return
+            finally:
+                provider.limit.release()
+        self._give_up(shed, error)
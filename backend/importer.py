@@ -0,0 +1,166 @@
+import os
+import re
+import csv
+import gzip
+import json
+import time
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, Tuple
+
+import database
+
+PRODUCT_COLUMNS = ("id", "name", "category", "price", "description", "tags", "stock", "image")
+BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 5000))
+
+INSERT_SQL = "INSERT OR REPLACE INTO products ({}) VALUES ({})".format(
+    ", ".join(PRODUCT_COLUMNS), ", ".join("?" * len(PRODUCT_COLUMNS))
+)
+
+
+class ImportStats:
+    def __init__(self, rows: int, load_seconds: float, index_seconds: float):
+        self.rows = rows
+        self.load_seconds = load_seconds
+        self.index_seconds = index_seconds
+
+    @property
+    def seconds(self) -> float:
+        return self.load_seconds + self.index_seconds
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return (f"{self.seconds:.2f}s, {self.rows_per_sec:,.0f} rows/sec "
+                f"(load {self.load_seconds:.2f}s, indexes {self.index_seconds:.2f}s)")
+
+
+def product_row(product: Dict[str, Any]) -> Tuple:
+    """Normalize one feed record to a PRODUCT_COLUMNS tuple.
+
+    Tags may be a list, a JSON array string, or "a|b" / "a,b" text (CSV).
+    """
+    tags = product.get("tags") or []
+    if isinstance(tags, str):
+        tags = tags.strip()
+        tags = json.loads(tags) if tags.startswith("[") else [t.strip() for t in re.split(r"[|,]", tags) if t.strip()]
+    return (
+        str(product["id"]),
+        product["name"],
+        product["category"],
+        float(product["price"]),
+        product.get("description") or "",
+        json.dumps(tags),
+        int(product.get("stock") or 0),
+        product.get("image") or "",
+    )
+
+
+def _open(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def read_products(path: str) -> Iterator[Tuple]:
+    """Stream product rows from a .csv or .jsonl/.ndjson feed (optionally gzipped), one record at a time."""
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        records = lambda f: enumerate(csv.DictReader(f), start=2)  # line 1 is the header
+    elif name.endswith((".jsonl", ".ndjson")):
+        records = lambda f: ((n, line) for n, line in enumerate(f, start=1) if line.strip())
+    else:
+        raise ValueError(f"Unsupported product feed {path!r}: expected .csv or .jsonl")
+
+    with _open(path) as f:
+        for line_number, record in records(f):
+            try:
+                row = product_row(json.loads(record) if isinstance(record, str) else record)
+            except (KeyError, ValueError, TypeError) as e:
+                # Fails the import; bulk_load rolls the whole transaction back
+                raise ValueError(f"{path}:{line_number}: bad product record ({e!r})") from e
+            yield row
+
+
+def bulk_load(rows: Iterable[Tuple], replace: bool = False, batch_size: int = BATCH_SIZE) -> ImportStats:
+    """Load product tuples in one transaction.
+
+    Per-row triggers (FTS and tag sync, catalog version, recommendation
+    queue) and secondary indexes on products are dropped for the load and
+    recreated afterwards from their stored DDL. product_tags is rebuilt
+    once, for the loaded rows only unless `replace`. The FTS index is
+    rebuilt in full either way (its delete entries need the old text, which
+    the replaced rows no longer have), so even a small append costs a pass
+    over the whole catalog. The catalog version is bumped once, and
+    recommendations are flagged for a full rebuild. Readers see the old
+    catalog until the commit.
+    """
+    conn = database.get_db_connection()
+    conn.isolation_level = None  # explicit BEGIN/COMMIT below
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA cache_size=-262144")  # 256 MiB for this connection
+    total = 0
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        triggers = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'products'"
+        ).fetchall()
+        indexes = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'products' AND sql IS NOT NULL"
+        ).fetchall()
+        for name, _ in triggers:
+            conn.execute(f'DROP TRIGGER "{name}"')
+        for name, _ in indexes:
+            conn.execute(f'DROP INDEX "{name}"')
+
+        started = time.perf_counter()
+        if replace:
+            conn.execute("DELETE FROM products")
+        # Every row loaded below, replacements included, lands above this rowid
+        last_rowid = None if replace else conn.execute("SELECT coalesce(max(rowid), 0) FROM products").fetchone()[0]
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            conn.executemany(INSERT_SQL, batch)
+            total += len(batch)
+        load_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _, sql in indexes:
+            conn.execute(sql)
+        for _, sql in triggers:
+            conn.execute(sql)
+        database.rebuild_product_tags(conn, last_rowid)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone():
+            database.rebuild_search_index(conn)
+        database.bump_catalog_version(conn)
+        conn.execute("UPDATE catalog_meta SET value = 0 WHERE key = 'recommendations_built'")
+        conn.execute("COMMIT")
+        database.invalidate_catalog_versions()
+        index_seconds = time.perf_counter() - started
+    except BaseException:
+        # BEGIN IMMEDIATE itself may have failed ("database is locked"):
+        # a ROLLBACK then would raise and hide that error
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return ImportStats(total, load_seconds, index_seconds)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk import a CSV/JSONL product feed.")
+    parser.add_argument("path")
+    parser.add_argument("--replace", action="store_true", help="delete the existing catalog first")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    database.init_db()
+    stats = bulk_load(read_products(args.path), replace=args.replace, batch_size=args.batch_size)
+    print(f"Imported {stats.rows} products: {stats.summary()}")
@@ -0,0 +1,194 @@
+import re
+import json
+from typing import Dict, List, Optional, Set, Tuple
+
+from cache import LRUCache
+
+# Keyword tables for the mock provider's intent classifier and query
+# builder. Everything is folded into one regex at import time, so a message
+# is scanned once and every hit is looked up in KEYWORDS.
+
+SEARCH_VERBS = ["find", "need", "looking", "want", "show", "search", "recommend", "suggest", "buy", "shop", "where"]
+
+PRODUCT_WORDS = [
+    "dress", "suit", "shoes", "jacket", "shirt", "pant", "pants", "bag", "skirt", "heels", "boots", "sneakers",
+    "sunglasses", "glasses", "eyewear", "tuxedo", "gown",
+]
+
+# First group present wins, in this order (kids before adults)
+DEMOGRAPHICS = [
+    ("boy", ["boy", "boys", "kid", "kids"]),
+    ("girl", ["girl", "girls"]),
+    ("men", ["men", "man", "male", "husband", "father"]),
+    ("women", ["women", "woman", "female", "wife", "mother", "lady"]),
+]
+
+CATEGORIES = {
+    "dress": "Clothing", "gown": "Clothing", "skirt": "Clothing",
+    "shirt": "Clothing", "top": "Clothing", "blouse": "Clothing", "hoodie": "Clothing",
+    "pant": "Clothing", "jeans": "Clothing", "trouser": "Clothing", "chino": "Clothing",
+    "jacket": "Clothing", "coat": "Clothing", "blazer": "Clothing", "suit": "Clothing", "tuxedo": "Clothing",
+    "shoes": "Shoes", "boot": "Shoes", "heel": "Shoes", "sneaker": "Shoes", "loafer": "Shoes", "flat": "Shoes",
+    "bag": "Accessories", "tote": "Accessories", "clutch": "Accessories", "backpack": "Accessories",
+    "jewelry": "Accessories", "earring": "Accessories", "necklace": "Accessories", "bracelet": "Accessories",
+    "scarf": "Accessories", "glass": "Accessories",
+}
+# Inflected forms that should count as the category keyword
+CATEGORY_FORMS = {"pants": "pant", "trousers": "trouser", "chinos": "chino", "glasses": "glass", "sunglasses": "glass", "scarves": "scarf"}
+
+STYLES = [
+    "wedding", "formal", "casual", "summer", "winter", "beach", "party", "office", "work",
+    "floral", "strip", "check", "red", "blue", "green", "black", "white", "gold", "silver", "pink",
+    "beige", "navy", "vintage", "modern", "bohemian", "chic", "streetwear", "elegant",
+]
+STYLE_FORMS = {"striped": "strip", "stripes": "strip", "checked": "check", "checkered": "check"}
+
+CART_WORDS = ["cart", "bag", "basket"]
+
+
+def _build_keywords() -> Dict[str, List[Tuple[str, str]]]:
+    keywords: Dict[str, List[Tuple[str, str]]] = {}
+
+    def add(word: str, kind: str, value: str):
+        keywords.setdefault(word, []).append((kind, value))
+
+    add("checkout", "checkout", "checkout")
+    # Also "check out these dresses": only a checkout with cart context (see parse_message)
+    add("check out", "check_out", "check out")
+    add("add", "add", "add")
+    for word in CART_WORDS:
+        add(word, "cart", word)
+    for word in SEARCH_VERBS:
+        add(word, "search", word)
+    for word in PRODUCT_WORDS:
+        add(word, "product", word)
+    for tag, words in DEMOGRAPHICS:
+        for word in words:
+            add(word, "demographic", tag)
+    for word in CATEGORIES:
+        add(word, "category", word)
+    for form, word in CATEGORY_FORMS.items():
+        add(form, "category", word)
+    for word in STYLES:
+        add(word, "style", word)
+    for form, word in STYLE_FORMS.items():
+        add(form, "style", word)
+
+    # The pattern matches the longest keyword, so a plural keyword ("heels")
+    # also has to carry its singular's meanings ("heel" -> category)
+    for word in list(keywords):
+        if word.endswith("s") and word[:-1] in keywords:
+            for entry in keywords[word[:-1]]:
+                if entry not in keywords[word]:
+                    keywords[word].append(entry)
+    return keywords
+
+
+KEYWORDS = _build_keywords()
+
+# Longest alternatives first so "sunglasses" wins over "glasses". Whole
+# words only ("women" must not match "men"), with an optional plural.
+_PATTERN = re.compile(
+    r"\b(?:(?P<id>gen_\d+)|(?P<kw>" + "|".join(re.escape(k) for k in sorted(KEYWORDS, key=len, reverse=True)) + r")(?:e?s)?)\b"
+)
+_WORDS = re.compile(r"[a-z0-9_']+")
+
+
+class ParsedMessage:
+    """Intent and entities extracted from one user message."""
+
+    __slots__ = ("intent", "product_id", "tags", "query_terms", "words")
+
+    def __init__(self, intent: str, product_id: Optional[str], tags: List[str], query_terms: List[str], words: Set[str]):
+        self.intent = intent
+        self.product_id = product_id
+        self.tags = tags
+        self.query_terms = query_terms
+        self.words = words
+
+
+def parse_message(text: str) -> ParsedMessage:
+    text = text.lower()
+    kinds: Dict[str, List[str]] = {}
+    product_id = None
+    for match in _PATTERN.finditer(text):
+        if match.group("id"):
+            product_id = product_id or match.group("id")
+            continue
+        for kind, value in KEYWORDS[match.group("kw")]:
+            values = kinds.setdefault(kind, [])
+            if value not in values:
+                values.append(value)
+
+    cart_words = kinds.get("cart", [])
+    words = set(_WORDS.findall(text))
+    checkout_phrase = "check_out" in kinds and (cart_words or "now" in words)
+    if "checkout" in kinds or checkout_phrase or ("buy" in kinds.get("search", []) and "cart" in cart_words):
+        intent = "CHECKOUT"
+    elif "add" in kinds and ("cart" in cart_words or "bag" in cart_words):
+        intent = "ADD_TO_CART"
+    elif cart_words:
+        intent = "VIEW_CART"
+    elif "search" in kinds or "product" in kinds:
+        intent = "SEARCH"
+    else:
+        intent = "CHAT"
+
+    demographics = kinds.get("demographic", [])
+    tags = [tag for tag, _ in DEMOGRAPHICS if tag in demographics][:1]
+    # Styles first, then the objects ("summer wedding dress")
+    query_terms = kinds.get("style", []) + kinds.get("category", [])
+    return ParsedMessage(intent, product_id, tags, query_terms, words)
+
+
+class ContextIndex:
+    """Products listed in earlier tool results, keyed by the result's JSON text.
+
+    Each result is parsed once (when the mock answers the tool call) into
+    (product id, keyword set) pairs. The mock echoes that same text as its
+    reply, so whether the client sends back the tool message or only the
+    assistant turn, resolving "add the silver one" is a dict lookup rather
+    than another json.loads.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self._results = LRUCache(max_size=max_size)
+
+    def remember(self, content: str, data) -> List[Tuple[str, frozenset]]:
+        entries = []
+        if isinstance(data, list):
+            for p in data:
+                if not isinstance(p, dict) or "id" not in p:
+                    continue
+                tags = p.get("tags", [])
+                tags = tags if isinstance(tags, list) else json.loads(tags)
+                entries.append((p["id"], frozenset(p.get("name", "").lower().split()) | frozenset(t.lower() for t in tags)))
+        self._results.put(content, entries)
+        return entries
+
+    def recent_products(self, messages: List[Dict]) -> List[Tuple[str, frozenset]]:
+        """Products from the most recent message that listed any."""
+        for m in reversed(messages):
+            if m.get("role") not in ("assistant", "tool"):
+                continue
+            content = str(m.get("content") or "").strip()
+            if not (content.startswith("[") and content.endswith("]")):
+                continue
+            entries = self._results.get(content)
+            if entries is None:
+                # Not seen by this process (another worker answered it): parse it once
+                try:
+                    entries = self.remember(content, json.loads(content))
+                except ValueError:
+                    continue
+            if entries:
+                return entries
+        return []
+
+    def resolve(self, messages: List[Dict], words: Set[str]) -> Optional[str]:
+        best_id, best_overlap = None, 0
+        for product_id, keywords in self.recent_products(messages):
+            overlap = len(words & keywords)
+            if overlap > best_overlap:
+                best_id, best_overlap = product_id, overlap
+        return best_id
@@ -0,0 +1,156 @@
+import os
+import re
+import asyncio
+import json
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional
+
+from cache import LRUCache
+from database import cached_catalog_versions, recent_catalog_version
+
+STOPWORDS = {
+    "a", "an", "the", "i", "im", "i'm", "me", "my", "we", "our", "you", "your", "for", "to", "of", "in",
+    "on", "at", "and", "or", "with", "some", "any", "please", "can", "could", "would", "should", "will",
+    "is", "are", "be", "it", "this", "that", "these", "those", "do", "does", "have", "has", "get", "got",
+    "need", "want", "looking", "look", "show", "find", "give", "let", "see", "like", "love", "just", "really",
+    "something", "anything", "one", "ones", "hi", "hello", "hey", "thanks", "thank",
+}
+
+
+def stem(word: str) -> str:
+    # Light suffix stripping, enough to fold plurals and simple verb forms
+    for suffix, replacement in (("ies", "y"), ("sses", "ss"), ("ches", "ch"), ("shes", "sh"), ("xes", "x")):
+        if word.endswith(suffix) and len(word) > len(suffix) + 2:
+            return word[: -len(suffix)] + replacement
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    if word.endswith("ing") and len(word) > 5:
+        return word[:-3]
+    if word.endswith("ed") and len(word) > 4:
+        return word[:-2]
+    return word
+
+
+def normalize_text(text: str) -> str:
+    """'Summer wedding dresses!' and 'summer wedding dress' -> 'summer wedding dress'.
+
+    Word order is kept: "men, not women" and "women, not men" (or
+    "under 20 over 50" and "under 50 over 20") mean different things.
+    """
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    return " ".join(stem(w) for w in words if w not in STOPWORDS)
+
+
+def _digest(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _message_key(m: Dict[str, Any]) -> Dict[str, Any]:
+    # SDK tool call objects -> plain (id, name, arguments) so the key is stable
+    key = {"role": m["role"], "content": m.get("content")}
+    if m.get("tool_call_id"):
+        key["tool_call_id"] = m["tool_call_id"]
+    calls = []
+    for tc in m.get("tool_calls") or []:
+        if isinstance(tc, dict):
+            calls.append([tc["id"], tc["function"]["name"], tc["function"]["arguments"]])
+        else:
+            calls.append([tc.id, tc.function.name, tc.function.arguments])
+    if calls:
+        key["tool_calls"] = calls
+    return key
+
+
+class ResponseCache:
+    """Two-tier cache in front of chat.completions.create.
+
+    - exact: hash of model, full prompt and tool schema
+    - normalized: for the stateless first turn (system prompt + one user
+      message) only, keyed on the stemmed, stopword-free user text so near
+      duplicates like "Summer wedding dresses!" share an entry
+
+    Both tiers are LRU with a TTL and are cleared when the catalog version
+    changes, since answers quote products. The version is read through
+    database.recent_catalog_version(), so a lookup only queries SQLite once
+    per CATALOG_VERSION_TTL; aget() does that read off the event loop.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 600.0, enabled: bool = True):
+        self.enabled = enabled
+        self.exact = LRUCache(max_size=max_size, ttl=ttl)
+        self.normalized = LRUCache(max_size=max_size, ttl=ttl)
+        self._catalog_version = None
+        self._lock = threading.Lock()
+
+    def _keys(self, request: Dict[str, Any]) -> tuple:
+        messages = request["messages"]
+        context = {"model": request["model"], "tools": request.get("tools"), "max_tokens": request.get("max_tokens")}
+        exact = _digest({**context, "messages": [_message_key(m) for m in messages]})
+
+        normalized = None
+        if len(messages) == 2 and messages[0]["role"] == "system" and messages[1]["role"] == "user":
+            text = normalize_text(str(messages[1].get("content") or ""))
+            if text:
+                normalized = _digest({**context, "system": messages[0]["content"], "user": text})
+        return exact, normalized
+
+    def _check_catalog(self):
+        version = recent_catalog_version()
+        with self._lock:
+            if version != self._catalog_version:
+                self.exact.clear()
+                self.normalized.clear()
+                self._catalog_version = version
+
+    def flight_key(self, request: Dict[str, Any]) -> str:
+        """Requests with this key may share one completion: the key get() would serve them from."""
+        exact, normalized = self._keys(request)
+        return normalized if self.enabled and normalized else exact
+
+    def get(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        self._check_catalog()
+        exact, normalized = self._keys(request)
+
+        message = self.exact.get(exact)
+        if message is None and normalized:
+            message = self.normalized.get(normalized)
+        # Callers add keys to the returned message, so hand out a copy
+        return dict(message) if message is not None else None
+
+    async def aget(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if self.enabled and cached_catalog_versions() is None:
+            # The version has to be re-read from SQLite: not on the event loop
+            await asyncio.to_thread(self._check_catalog)
+        return self.get(request)
+
+    def put(self, request: Dict[str, Any], message: Dict[str, Any]):
+        if not self.enabled:
+            return
+        exact, normalized = self._keys(request)
+        message = dict(message)
+        self.exact.put(exact, message)
+        if normalized:
+            self.normalized.put(normalized, message)
+
+    def stats(self) -> Dict[str, Any]:
+        exact, normalized = self.exact.stats(), self.normalized.stats()
+        # A normalized lookup only happens after an exact miss
+        lookups = exact["hits"] + exact["misses"]
+        hits = exact["hits"] + normalized["hits"]
+        return {
+            "enabled": self.enabled,
+            "exact": exact,
+            "normalized": normalized,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def create_response_cache() -> ResponseCache:
+    return ResponseCache(
+        max_size=int(os.getenv("LLM_CACHE_SIZE", 1000)),
+        ttl=float(os.getenv("LLM_CACHE_TTL", 600)),
+        enabled=os.getenv("LLM_CACHE_ENABLED", "true") == "true",
+    )
@@ -1,19 +1,69 @@
-from fastapi import FastAPI, HTTPException
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Depends, Query, Response
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from fastapi.middleware.cors import CORSMiddleware
-from agent import ShopperAgent
+from contextlib import asynccontextmanager
+from agent import ShopperAgent, run_blocking
+from sessions import Session, cart_etag, create_session_store, new_session_id
+from cart_events import cart_events
 import os
+import json
+import asyncio
 from dotenv import load_dotenv
 from database import init_db
+from recommendations import get_recommendation_index
+from search_index import get_search_index
+from vector_index import get_vector_index
+from telemetry import STARTUP_SECONDS, TimingMiddleware, render_metrics, span
+from gateway import Overloaded
 
 load_dotenv()
-init_db()
 
-app = FastAPI(title="AI Personal Shopper API")
+# "background": serve right away and warm up in a worker thread,
+# "blocking": finish warmup before accepting traffic, "off": build on first use
+STARTUP_PRELOAD = os.getenv("STARTUP_PRELOAD", "background")
+
+def warm_up():
+    """Provider SDK + clients, recommendation lists and the search engine's index."""
+    started = time.perf_counter()
+    try:
+        agent.warm_up_client()
+        # Builds recommendation lists on a fresh database, otherwise applies queued changes
+        get_recommendation_index().ensure_fresh()
+        if agent.catalog.search_engine == "hybrid":
+            get_vector_index().ensure_fresh()
+        elif agent.catalog.search_engine == "index":
+            get_search_index().ensure_fresh()
+    except Exception as e:
+        # Everything warmed here is also built lazily on first use
+        print(f"Warmup failed, continuing lazily: {e}")
+        return
+    STARTUP_SECONDS.set(time.perf_counter() - started, phase="warmup")
+    print(f"Warmup finished in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    STARTUP_SECONDS.set(started - IMPORT_STARTED, phase="import")
+    # Schema and migrations have to be in place before the first request
+    init_db()
+    STARTUP_SECONDS.set(time.perf_counter() - started, phase="init_db")
+    print(f"Startup: import {(started - IMPORT_STARTED) * 1000:.0f}ms, "
+          f"init_db {(time.perf_counter() - started) * 1000:.0f}ms, preload={STARTUP_PRELOAD}")
+
+    if STARTUP_PRELOAD == "blocking":
+        await run_blocking(warm_up)
+    elif STARTUP_PRELOAD == "background":
+        app.state.warmup = asyncio.ensure_future(run_blocking(warm_up))
+    yield
+
+app = FastAPI(title="AI Personal Shopper API", lifespan=lifespan)
 
 # Debug Exception Handler
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.requests import Request
 import traceback
 
@@ -24,6 +74,12 @@ async def debug_exception_handler(request: Request, exc: Exception):
         content={"message": "Internal Server Error", "detail": str(exc), "traceback": traceback.format_exc()},
     )
 
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    # Load shedding: fail fast and tell the client when to come back
+    headers = {"Retry-After": str(max(1, round(exc.retry_after or 1)))}
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)}, headers=headers)
+
 # Allow CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -31,11 +87,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Session-ID", "Server-Timing", "Retry-After"],
 )
+# Per-request spans -> Server-Timing header, /metrics, slow-request profiles
+app.add_middleware(TimingMiddleware)
 
-# Global Agent Instance (for simple statefulness in this demo)
-# In a real production app, we'd use a database/Redis for session management
+# Shared Agent Instance: LLM clients and catalog are built once per process.
+# Per-shopper state lives in the session store (SESSION_BACKEND=memory|sqlite).
 agent = ShopperAgent()
+session_store = create_session_store()
+
+SESSION_HEADER = "X-Session-ID"
+CART_EVENTS_KEEPALIVE = float(os.getenv("CART_EVENTS_KEEPALIVE", 15))
+SESSION_COOKIE = "session_id"
+
+def get_session(request: Request, response: Response) -> Session:
+    # Header (SPA) or cookie only: an id taken from the URL and set as the
+    # cookie would let a link plant a session id (session fixation)
+    session_id = request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE) or new_session_id()
+    response.headers[SESSION_HEADER] = session_id
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+    return session_store.load(session_id)
+
+def get_stream_session(request: Request) -> Session:
+    # EventSource can't set headers, so /cart/events also takes ?session_id=.
+    # Read-only, and never written back as a cookie.
+    session_id = (
+        request.headers.get(SESSION_HEADER)
+        or request.cookies.get(SESSION_COOKIE)
+        or request.query_params.get("session_id")
+        or new_session_id()
+    )
+    return session_store.load(session_id)
 
 class ChatRequest(BaseModel):
     message: str
@@ -45,19 +128,59 @@ class ChatResponse(BaseModel):
     role: str
     content: Optional[str] = None
     tool_calls: Optional[List[Any]] = None
+    products: Optional[List[Dict[str, Any]]] = None  # full product cards for the UI
 
 @app.get("/")
 def read_root():
     return {"status": "Shopper Agent API is running"}
 
+@app.get("/metrics")
+def metrics():
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {"llm": agent.response_cache.stats(), "catalog": agent.catalog.cache.stats()}
+
+@app.get("/products/search")
+def search_products_page(
+    q: str = "",
+    category: str = "",
+    tags: List[str] = Query([]),
+    color: str = "",
+    demographic: str = "",
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    in_stock: bool = False,
+    sort: str = "relevance",
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    facets: Optional[bool] = None,
+):
+    """Paginated, faceted catalog search; pass `next_cursor` back as `cursor` for the next page.
+
+    Facets are included on the first page unless `facets` says otherwise.
+    """
+    try:
+        return agent.catalog.search_page(
+            query=q, category=category, tags=tags, color=color, demographic=demographic,
+            min_price=min_price, max_price=max_price, in_stock=in_stock,
+            sort=sort, limit=limit, cursor=cursor, facets=facets,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, session: Session = Depends(get_session)):
+    # Shed before doing any work when every provider's queue is full
+    agent.gateway.check_admission()
+
     # Construct message history
     messages = request.history
     messages.append({"role": "user", "content": request.message})
     
-    # Get agent response
-    response = agent.chat(messages)
+    # Get agent response (async client, the event loop stays free while we wait)
+    response = await agent.achat(messages)
     
     # Check if tool calls exist
     if response.get("tool_calls"):
@@ -71,70 +194,200 @@ async def chat_endpoint(request: ChatRequest):
         tool_calls = response["tool_calls"]
         messages.append(response) # Add assistant's tool_call message
         
-        for tool_call in tool_calls:
-            # Execute tool
-            tool_result = agent.execute_tool(tool_call)
-            
-            # Append tool result to history
+        # Execute tools (independent ones concurrently), results in call order
+        tool_results = await agent.aexecute_tools(tool_calls, session)
+        await run_blocking(session_store.save, session)
+
+        products = []
+        for tool_call, tool_result in zip(tool_calls, tool_results):
+            # Append tool result to history (compact form, the LLM doesn't need images)
             messages.append({
                 "role": "tool",
-                "tool_call_id": tool_call.id,
-                "content": tool_result
+                "tool_call_id": tool_call["id"],
+                "content": tool_result.content
             })
+            products.extend(tool_result.products or [])
             
-        # Get final response after tool outputs
-        final_response = agent.chat(messages)
+        # Get final response after tool outputs. The tools already ran (cart
+        # changes, orders), so shedding now would invite a replay: degrade instead
+        try:
+            final_response = await agent.achat(messages)
+        except Overloaded:
+            final_response = {"role": "assistant", "content": DEGRADED_REPLY}
+        final_response["products"] = products or None
         return final_response
 
     return response
 
+# Final answer when the LLM is shed after tools have run: their results stand
+DEGRADED_REPLY = "Done. We're very busy right now, so here's the result without the full write-up."
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, session: Session = Depends(get_session)):
+    """Same loop as /chat, streamed as Server-Sent Events.
+
+    Events: `token` (content delta), `tool_call` (tool started),
+    `tool_result` (tool finished), `products` (full product cards from
+    search or the cart, sent as soon as the tool returns) and a final `done`
+    with the full answer, or `error` if the LLM providers shed the request.
+    """
+    # Still possible to answer 503 here; once the stream starts, shedding is an `error` event
+    agent.gateway.check_admission()
+    messages = request.history
+    messages.append({"role": "user", "content": request.message})
+
+    async def events():
+        try:
+            async for event in chat_events():
+                yield event
+        except Overloaded as e:
+            yield sse_event("error", {"status": e.status_code, "detail": str(e), "retry_after": e.retry_after})
+
+    async def chat_events():
+        # Forward tokens as they arrive; the assembled assistant message comes last
+        response = None
+        async for event in agent.astream(messages):
+            if event["type"] == "token":
+                yield sse_event("token", {"content": event["content"]})
+            else:
+                response = event["message"]
+
+        if response.get("tool_calls"):
+            messages.append(response)
+
+            tool_calls = response["tool_calls"]
+            for tool_call in tool_calls:
+                yield sse_event("tool_call", {"id": tool_call["id"], "name": tool_call["function"]["name"], "arguments": tool_call["function"]["arguments"]})
+
+            # Report each tool as soon as it finishes...
+            tool_results = [None] * len(tool_calls)
+            async for i, tool_result in agent.aiter_tool_results(tool_calls, session):
+                tool_results[i] = tool_result
+                tool_call = tool_calls[i]
+                name = tool_call["function"]["name"]
+                yield sse_event("tool_result", {"id": tool_call["id"], "name": name})
+
+                if tool_result.products is not None:
+                    yield sse_event("products", {"id": tool_call["id"], "products": tool_result.products})
+
+            await run_blocking(session_store.save, session)
+
+            # ...but keep the history in call order
+            for tool_call, tool_result in zip(tool_calls, tool_results):
+                messages.append({
+                    "role": "tool",
+                    "tool_call_id": tool_call["id"],
+                    "content": tool_result.content
+                })
+
+            try:
+                async for event in agent.astream(messages):
+                    if event["type"] == "token":
+                        yield sse_event("token", {"content": event["content"]})
+                    else:
+                        response = event["message"]
+            except Overloaded:
+                # Past the tools: same as /chat, answer without the LLM
+                response = {"role": "assistant", "content": DEGRADED_REPLY}
+                yield sse_event("token", {"content": DEGRADED_REPLY})
+
+        yield sse_event("done", {"role": "assistant", "content": response.get("content")})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Returned Response objects don't inherit the dependency's headers
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", SESSION_HEADER: session.id},
+    )
+
+def cart_payload(session: Session) -> Dict[str, Any]:
+    # Count and subtotal are maintained by the Cart; only the product cards
+    # (images etc.) are looked up, in one query
+    state = session.to_dict()  # one consistent copy: tools may be changing the cart
+    cart = state["cart"]
+    products = {p["id"]: p for p in agent.catalog.get_products_by_ids([line["id"] for line in cart["items"]])}
+    items = [{**products.get(line["id"], {}), **line} for line in cart["items"]]
+    return {"items": items, "count": cart["count"], "subtotal": cart["subtotal"], "revision": state["revision"], "cart_id": state["cart_id"]}
+
 @app.get("/cart")
-def get_cart():
-    return agent.cart
+def get_cart(request: Request, session: Session = Depends(get_session)):
+    # Conditional GET: unchanged carts cost a 304 and no serialization
+    headers = {"ETag": session.etag, "Cache-Control": "no-cache", SESSION_HEADER: session.id}
+    if request.headers.get("If-None-Match") == session.etag:
+        return Response(status_code=304, headers=headers)
+    payload = cart_payload(session)
+    with span("serialize"):
+        return JSONResponse(payload, headers=headers)
+
+@app.get("/cart/events")
+async def cart_events_endpoint(request: Request, session: Session = Depends(get_stream_session)):
+    """Server-Sent Events: a `snapshot` of the cart, then a `delta` per change.
+
+    Deltas carry the new revision; a client that sees a gap should refetch
+    /cart. Other workers' changes (SQLite session store) are picked up by
+    re-reading the session on each keep-alive tick.
+    """
+    queue = cart_events.subscribe(session.id)
+
+    async def events():
+        # (cart_id, revision) the client last saw, as in the /cart ETag: a
+        # recreated cart can be back at a revision the old one already had
+        etag = session.etag
+        try:
+            yield sse_event("snapshot", await run_blocking(cart_payload, session))
+            while not await request.is_disconnected():
+                try:
+                    delta = await asyncio.wait_for(queue.get(), timeout=CART_EVENTS_KEEPALIVE)
+                    etag = cart_etag(delta["cart_id"], delta["revision"])
+                    yield sse_event("delta", delta)
+                except asyncio.TimeoutError:
+                    current = await run_blocking(session_store.load, session.id)
+                    if current.etag != etag:
+                        etag = current.etag
+                        yield sse_event("snapshot", await run_blocking(cart_payload, current))
+                    else:
+                        yield ": keep-alive\n\n"
+        finally:
+            cart_events.unsubscribe(session.id, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", SESSION_HEADER: session.id},
+    )
 
 @app.post("/cart/items")
-def add_to_cart(item: Dict[str, Any]):
+def add_to_cart(item: Dict[str, Any], session: Session = Depends(get_session)):
     # Expects {"product_id": "gen_123"}
     product_id = item.get("product_id")
     if not product_id:
         raise HTTPException(status_code=400, detail="product_id is required")
-    
-    # Use agent's tool logic to add to cart
-    # We can reuse the tool function directly or just call execute_tool logic
-    # But since agent state is global, we can just access it.
-    
-    # Ideally we'd use the agent's internal method, but it is private/tool-based.
-    # Let's direct call the tool method on the agent wrapper if possible or duplicate logic.
-    # Looking at agent.py, it uses self.cart
-    
-    # Find product by ID first
-    from catalog import ProductCatalog
-    catalog = ProductCatalog()
-    product = catalog.get_product_by_id(product_id)
-    
+
+    # Find product by ID first, using the shared catalog
+    product = agent.catalog.get_product_by_id(product_id)
+
     if product:
-        agent.cart.append(product)
-        return {"status": "success", "cart_count": len(agent.cart), "message": f"Added {product['name']} to cart"}
+        session.add_item(product)
+        session_store.save(session)
+        return {"status": "success", "cart_count": session.cart.count, "subtotal": session.cart.subtotal, "revision": session.revision, "message": f"Added {product['name']} to cart"}
     else:
         raise HTTPException(status_code=404, detail="Product not found")
 
 @app.delete("/cart/items/{item_id}")
-def remove_from_cart(item_id: str):
-    # Search for item index
-    idx = -1
-    for i, p in enumerate(agent.cart):
-        if p["id"] == item_id:
-            idx = i
-            break
-            
-    if idx != -1:
-        removed = agent.cart.pop(idx)
-        return {"status": "success", "cart_count": len(agent.cart), "message": f"Removed {removed['name']} from cart"}
+def remove_from_cart(item_id: str, session: Session = Depends(get_session)):
+    removed = session.remove_item(item_id)
+    if removed:
+        session_store.save(session)
+        return {"status": "success", "cart_count": session.cart.count, "subtotal": session.cart.subtotal, "revision": session.revision, "message": f"Removed {removed.name} from cart"}
     else:
         raise HTTPException(status_code=404, detail="Item not found in cart")
 
 @app.post("/reset")
-def reset_agent():
-    global agent
-    agent = ShopperAgent()
+def reset_agent(session: Session = Depends(get_session)):
+    # Only this shopper's state; the shared agent stays up
+    session.clear_cart()  # notify open /cart/events streams
+    session_store.delete(session.id)
     return {"status": "Agent reset"}
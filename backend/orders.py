@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+from typing import Any, Dict, List, Optional
+
+from cart import LineItem
+from database import db_connection, get_pool, invalidate_catalog_versions
+from telemetry import Counter, register, timed
+
+# BEGIN IMMEDIATE waits this long for the write lock before SQLite reports
+# "database is locked"; place_order then backs off and tries again
+BUSY_TIMEOUT_MS = int(os.getenv("CHECKOUT_BUSY_TIMEOUT_MS", 250))
+MAX_RETRIES = int(os.getenv("CHECKOUT_MAX_RETRIES", 6))
+RETRY_BASE_DELAY = float(os.getenv("CHECKOUT_RETRY_BASE_DELAY", 0.01))
+
+CHECKOUTS = register(Counter("shopper_checkouts_total", "Checkouts by result (placed, duplicate, out_of_stock, busy)."))
+CHECKOUT_RETRIES = register(Counter("shopper_checkout_busy_retries_total", "Checkout transactions retried after SQLITE_BUSY."))
+
+
+class OutOfStock(Exception):
+    """Some lines can't be filled; nothing was reserved."""
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.items = items  # [{"id", "name", "requested", "available"}]
+        names = ", ".join(f"{i['name']} (only {i['available']} left)" for i in items)
+        super().__init__(f"Not enough stock for: {names}.")
+
+
+def _is_busy(e: sqlite3.OperationalError) -> bool:
+    message = str(e).lower()
+    return "locked" in message or "busy" in message
+
+
+def _existing_order(conn, session_id: str, cart_key: str) -> Dict[str, Any]:
+    order = conn.execute("SELECT id, total FROM orders WHERE session_id = ? AND cart_key = ?", (session_id, cart_key)).fetchone()
+    items = conn.execute("SELECT product_id, name, price, qty FROM order_items WHERE order_id = ?", (order["id"],)).fetchall()
+    return {
+        "order_id": order["id"],
+        "total": order["total"],
+        "items": [{"id": i["product_id"], "name": i["name"], "price": i["price"], "qty": i["qty"]} for i in items],
+    }
+
+
+@timed("db_query")
+def _place_order(session_id: str, lines: List[LineItem], cart_key: Optional[str] = None) -> Dict[str, Any]:
+    with db_connection() as conn:
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        try:
+            # Take the write lock up front: the stock check and the decrement
+            # below can't interleave with another checkout
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if cart_key is not None and conn.execute(
+                    "SELECT 1 FROM orders WHERE session_id = ? AND cart_key = ?", (session_id, cart_key)
+                ).fetchone():
+                    # This cart was already checked out (another worker, a double submit)
+                    order = _existing_order(conn, session_id, cart_key)
+                    conn.rollback()
+                    return {**order, "duplicate": True}
+
+                ids = json.dumps([line.id for line in lines])
+                current = {
+                    row["id"]: row for row in conn.execute(
+                        "SELECT id, name, price, stock FROM products WHERE id IN (SELECT value FROM json_each(?))", (ids,)
+                    )
+                }
+                short = [
+                    {"id": line.id, "name": line.name, "requested": line.qty,
+                     "available": (current[line.id]["stock"] or 0) if line.id in current else 0}
+                    for line in lines
+                    if line.id not in current or (current[line.id]["stock"] or 0) < line.qty
+                ]
+                if short:
+                    raise OutOfStock(short)
+
+                # Conditional decrement: guards the invariant even if a writer
+                # ever skips BEGIN IMMEDIATE
+                reserved = conn.executemany(
+                    "UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?",
+                    [(line.qty, line.id, line.qty) for line in lines],
+                ).rowcount
+                if reserved != len(lines):
+                    raise OutOfStock([{"id": line.id, "name": line.name, "requested": line.qty, "available": 0} for line in lines])
+
+                # Charged at the catalog price inside the transaction, not the cart's snapshot
+                order_id = f"ORD-{uuid.uuid4().hex[:10].upper()}"
+                items = [(order_id, line.id, current[line.id]["name"], current[line.id]["price"], line.qty) for line in lines]
+                total = sum(round(price * 100) * qty for _, _, _, price, qty in items) / 100
+                conn.execute(
+                    "INSERT INTO orders (id, session_id, cart_key, total, item_count, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (order_id, session_id, cart_key, total, sum(line.qty for line in lines), time.time()),
+                )
+                conn.executemany("INSERT INTO order_items (order_id, product_id, name, price, qty) VALUES (?, ?, ?, ?, ?)", items)
+                conn.commit()
+                # Stock moved: this process's catalog cache should see it now
+                invalidate_catalog_versions()
+            except BaseException:
+                conn.rollback()
+                raise
+        finally:
+            # Back to the pool's own wait for everyone else using this connection
+            conn.execute(f"PRAGMA busy_timeout = {int(get_pool().timeout * 1000)}")
+
+    return {
+        "order_id": order_id,
+        "total": total,
+        "items": [{"id": pid, "name": name, "price": price, "qty": qty} for _, pid, name, price, qty in items],
+    }
+
+
+def place_order(session_id: str, lines: List[LineItem], cart_key: Optional[str] = None) -> Dict[str, Any]:
+    """Reserve stock for every line and record the order, all or nothing.
+
+    With a `cart_key` the order is idempotent: a second checkout of the
+    same key returns the first order and reserves nothing.
+    Raises OutOfStock (nothing reserved) when a line can't be filled.
+    SQLITE_BUSY is retried with jittered exponential backoff; the last
+    failure is re-raised.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            order = _place_order(session_id, lines, cart_key)
+        except OutOfStock:
+            CHECKOUTS.inc(result="out_of_stock")
+            raise
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e) or attempt == MAX_RETRIES:
+                if _is_busy(e):
+                    CHECKOUTS.inc(result="busy")
+                raise
+            CHECKOUT_RETRIES.inc()
+            time.sleep(RETRY_BASE_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5))
+            continue
+        CHECKOUTS.inc(result="duplicate" if order.get("duplicate") else "placed")
+        return order
@@ -0,0 +1,272 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import database
+
+TOP_N = int(os.getenv("RECOMMENDATIONS_TOP_N", 10))
+# Rows scored per matrix product are capped so a block's score matrix
+# stays around this many float32s, however large the category
+BLOCK_ELEMENTS = 4_000_000
+# Above this many queued products a full rebuild is cheaper than patching lists
+MAX_INCREMENTAL = int(os.getenv("RECOMMENDATIONS_MAX_INCREMENTAL", 500))
+
+# Score = weighted sum of tag/name overlap, price closeness and same demographic
+TAG_WEIGHT = 0.6
+PRICE_WEIGHT = 0.25
+DEMOGRAPHIC_WEIGHT = 0.15
+
+DEMOGRAPHICS = ("women", "men", "girl", "boy")
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def product_features(name: str, tags: List[str]) -> List[str]:
+    tags = [t.lower() for t in tags]
+    words = [w for w in _WORD.findall(name.lower()) if len(w) > 2]
+    return sorted(set(tags) | set(words))
+
+
+def demographic(tags: List[str]) -> int:
+    # The generator lists the product's own demographic first; clothing may
+    # carry a second, looser one after it
+    for tag in tags:
+        tag = tag.lower()
+        if tag in DEMOGRAPHICS:
+            return DEMOGRAPHICS.index(tag)
+    return -1
+
+
+class CategoryMatrix:
+    """Feature matrix for the products of one category.
+
+    Features (tags + name words) are collected as a CSR sparse matrix,
+    IDF weighted and L2 normalised, then densified: a category has a few
+    hundred distinct features at most, so row blocks multiply as plain
+    float32 BLAS calls.
+    """
+
+    def __init__(self, rows):
+        self.ids: List[str] = []
+        self.position: Dict[str, int] = {}
+        vocab: Dict[str, int] = {}
+        indptr, indices, prices, demographics = [0], [], [], []
+        for row in rows:
+            tags = json.loads(row["tags"] or "[]")
+            self.position[row["id"]] = len(self.ids)
+            self.ids.append(row["id"])
+            indices.extend(vocab.setdefault(f, len(vocab)) for f in product_features(row["name"], tags))
+            indptr.append(len(indices))
+            prices.append(max(row["price"], 0.01))
+            demographics.append(demographic(tags))
+
+        n, n_features = len(self.ids), len(vocab)
+        indices = np.asarray(indices, dtype=np.int32)
+        entry_rows = np.repeat(np.arange(n), np.diff(np.asarray(indptr)))
+
+        df = np.bincount(indices, minlength=n_features)
+        data = (np.log((1 + n) / (1 + df)) + 1.0)[indices]
+        norms = np.sqrt(np.bincount(entry_rows, weights=data * data, minlength=n))
+        data /= norms[entry_rows]
+
+        self.features = np.zeros((n, n_features), dtype=np.float32)
+        self.features[entry_rows, indices] = data
+        self.log_price = np.log(np.asarray(prices, dtype=np.float32))
+        self.demographic = np.asarray(demographics, dtype=np.int8)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def scores(self, selected: np.ndarray) -> np.ndarray:
+        """Similarity of each selected row to every product in the category (self = -inf)."""
+        scores = TAG_WEIGHT * (self.features[selected] @ self.features.T)
+        scores += PRICE_WEIGHT * np.exp(-np.abs(self.log_price[selected, None] - self.log_price[None, :]))
+        demo = self.demographic[selected, None]
+        scores += DEMOGRAPHIC_WEIGHT * ((demo == self.demographic[None, :]) & (demo >= 0))
+        scores[np.arange(len(selected)), selected] = -np.inf
+        return scores
+
+    def top_n(self, selected: np.ndarray, n: int):
+        """Yield (product_id, [(recommended_id, score), ...]) for the selected rows."""
+        k = min(n, len(self.ids) - 1)
+        block_size = max(1, BLOCK_ELEMENTS // max(1, len(self.ids)))
+        for start in range(0, len(selected), block_size):
+            block = selected[start:start + block_size]
+            if k <= 0:
+                for i in block:
+                    yield self.ids[i], []
+                continue
+            scores = self.scores(block)
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1)
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            for i, cols, vals in zip(block, best, best_scores):
+                yield self.ids[i], [(self.ids[c], float(v)) for c, v in zip(cols, vals)]
+
+
+def _load_categories(conn, categories: Optional[List[str]] = None) -> Dict[str, CategoryMatrix]:
+    sql = "SELECT id, name, category, price, tags FROM products"
+    params = ()
+    if categories is not None:
+        sql += " WHERE category IN (SELECT value FROM json_each(?))"
+        params = (json.dumps(categories),)
+    grouped: Dict[str, list] = {}
+    for row in conn.execute(sql + " ORDER BY rowid", params):
+        grouped.setdefault(row["category"], []).append(row)
+    return {category: CategoryMatrix(rows) for category, rows in grouped.items()}
+
+
+def _write_lists(conn, lists):
+    conn.executemany(
+        "INSERT INTO product_recommendations (product_id, recommended_id, score) VALUES (?, ?, ?)",
+        ((pid, rid, score) for pid, recs in lists for rid, score in recs)
+    )
+
+
+class RecommendationIndex:
+    """Top-N similar products per product, precomputed into `product_recommendations`.
+
+    Candidates are the other products of the same category. A full build
+    runs once per database (or after a bulk load); after that, triggers
+    queue changed products in `recommendations_queue` and refresh() only
+    recomputes their lists and patches the lists they now belong in.
+    Serving a recommendation is a primary-key range read.
+    """
+
+    def __init__(self, top_n: int = TOP_N):
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._catalog_version = None
+
+    def ensure_fresh(self):
+        version = database.catalog_version()
+        if version == self._catalog_version:
+            return
+        with self._lock:
+            if version == self._catalog_version:
+                return
+            self.refresh()
+            self._catalog_version = version
+
+    def refresh(self):
+        with database.db_connection() as conn:
+            try:
+                built = conn.execute(
+                    "SELECT value FROM catalog_meta WHERE key = 'recommendations_built'"
+                ).fetchone()
+                queued = [r[0] for r in conn.execute("SELECT product_id FROM recommendations_queue")]
+            except sqlite3.OperationalError:
+                # init_db() hasn't run on this file
+                return
+            if not built or not built[0] or len(queued) > MAX_INCREMENTAL:
+                self._rebuild(conn)
+            elif queued:
+                self._update(conn, queued)
+
+    def rebuild(self):
+        with self._lock, database.db_connection() as conn:
+            self._rebuild(conn)
+
+    def _rebuild(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM product_recommendations")
+        total = 0
+        for matrix in _load_categories(conn).values():
+            _write_lists(conn, matrix.top_n(np.arange(len(matrix)), self.top_n))
+            total += len(matrix)
+        conn.execute("DELETE FROM recommendations_queue")
+        conn.execute("UPDATE catalog_meta SET value = 1 WHERE key = 'recommendations_built'")
+        conn.commit()
+        print(f"Recommendations built: {total} products, top {self.top_n}.")
+
+    def _update(self, conn, queued: List[str]):
+        conn.execute("BEGIN IMMEDIATE")
+        # Another worker may have drained the queue while we waited for the lock
+        queued = [r[0] for r in conn.execute("SELECT product_id FROM recommendations_queue")]
+        if not queued:
+            conn.commit()
+            return
+        # Lists that mention a changed product are recomputed too: it may have
+        # moved category, been deleted, or scored differently
+        owners = [r[0] for r in conn.execute(
+            "SELECT DISTINCT product_id FROM product_recommendations "
+            "WHERE recommended_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(queued),)
+        )]
+        recompute = json.dumps(sorted(set(queued) | set(owners)))
+        conn.execute(
+            "DELETE FROM product_recommendations WHERE product_id IN (SELECT value FROM json_each(?))",
+            (recompute,)
+        )
+        categories = [r[0] for r in conn.execute(
+            "SELECT DISTINCT category FROM products WHERE id IN (SELECT value FROM json_each(?))",
+            (recompute,)
+        )]
+
+        recompute_ids = set(json.loads(recompute))
+        for matrix in _load_categories(conn, categories).values():
+            selected = np.array(sorted(matrix.position[i] for i in recompute_ids if i in matrix.position), dtype=np.intp)
+            _write_lists(conn, matrix.top_n(selected, self.top_n))
+            self._patch_neighbours(conn, matrix, [i for i in queued if i in matrix.position], recompute_ids)
+
+        conn.execute(
+            "DELETE FROM recommendations_queue WHERE product_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(queued),)
+        )
+        conn.commit()
+
+    def _patch_neighbours(self, conn, matrix: CategoryMatrix, changed: List[str], skip: set):
+        """Insert changed products into the untouched lists they now beat."""
+        if not changed:
+            return
+        floor = np.full(len(matrix), -np.inf)
+        open_slots = np.ones(len(matrix), dtype=bool)
+        for owner, min_score, count in conn.execute(
+            "SELECT product_id, MIN(score), COUNT(*) FROM product_recommendations "
+            "WHERE product_id IN (SELECT value FROM json_each(?)) GROUP BY product_id",
+            (json.dumps(matrix.ids),)
+        ):
+            floor[matrix.position[owner]] = min_score
+            open_slots[matrix.position[owner]] = count < self.top_n
+        eligible = np.array([i not in skip for i in matrix.ids], dtype=bool)
+
+        # Scores are symmetric, so a changed product's row is also its column
+        scores = matrix.scores(np.array([matrix.position[i] for i in changed], dtype=np.intp))
+        touched = set()
+        for product_id, row in zip(changed, scores):
+            owners = np.nonzero(eligible & (open_slots | (row > floor)))[0]
+            conn.executemany(
+                "INSERT OR REPLACE INTO product_recommendations (product_id, recommended_id, score) VALUES (?, ?, ?)",
+                ((matrix.ids[j], product_id, float(row[j])) for j in owners)
+            )
+            touched.update(matrix.ids[j] for j in owners)
+        conn.executemany(
+            "DELETE FROM product_recommendations WHERE product_id = ? AND recommended_id NOT IN ("
+            "SELECT recommended_id FROM product_recommendations WHERE product_id = ? ORDER BY score DESC LIMIT ?)",
+            ((owner, owner, self.top_n) for owner in touched)
+        )
+
+
+_index: Optional[RecommendationIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_recommendation_index() -> RecommendationIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = RecommendationIndex()
+        return _index
+
+
+if __name__ == "__main__":
+    # Offline build: python recommendations.py
+    database.init_db()
+    get_recommendation_index().rebuild()
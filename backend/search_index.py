@@ -0,0 +1,170 @@
+import os
+import json
+import heapq
+import threading
+from typing import Dict, List, Optional, Set
+
+import database
+from cache import LRUCache
+
+# Substring lookups scan the vocabulary, so the answers are remembered; the
+# keys are raw query tokens, hence the bound
+MATCH_CACHE_SIZE = int(os.getenv("SEARCH_INDEX_CACHE_SIZE", 4096))
+GRAM = 3  # substring lookups go through a trigram -> terms index
+
+
+class InvertedIndex:
+    """In-memory token -> posting list index over the products table.
+
+    Mirrors the semantics of the LIKE based search in ProductCatalog so both
+    engines return the same rows:
+    - query tokens match as substrings of indexed terms (name, description, tags)
+    - the category filter matches as a substring of the category
+    - the tag filter matches whole tags, case-insensitively
+
+    Postings hold row ordinals (position in rowid order), so the first N
+    ordinals of a result set are the same rows SQLite would have returned
+    first for an unordered scan. A token's candidate terms are the ones
+    sharing all its trigrams; only those are checked for the substring.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._catalog_version = None
+        self._term_cache = LRUCache(max_size=MATCH_CACHE_SIZE)
+        self._category_cache = LRUCache(max_size=MATCH_CACHE_SIZE)
+        self._reset()
+
+    def _reset(self):
+        self.ids: List[str] = []  # ordinal -> product id
+        self.terms: Dict[str, Set[int]] = {}
+        self.grams: Dict[str, Set[str]] = {}  # trigram -> terms containing it
+        self.categories: Dict[str, Set[int]] = {}
+        self.tags: Dict[str, Set[int]] = {}
+        self._term_cache.clear()
+        self._category_cache.clear()
+
+    def ensure_fresh(self):
+        """Rebuild the index if the products table changed since the last build."""
+        version = database.recent_catalog_version()
+        if version == self._catalog_version:
+            return
+        with self._lock:
+            if version != self._catalog_version:
+                self.build()
+                self._catalog_version = version
+
+    def build(self):
+        with self._lock:
+            self._reset()
+            with database.db_connection() as conn:
+                rows = conn.execute(
+                    "SELECT id, name, description, category, tags FROM products ORDER BY rowid"
+                )
+                for ordinal, row in enumerate(rows):
+                    self.ids.append(row["id"])
+                    self._add(row, ordinal)
+            print(f"Search index built: {len(self.ids)} products, {len(self.terms)} terms.")
+
+    def _add(self, row, ordinal: int):
+        tags = [t.lower() for t in json.loads(row["tags"] or "[]")]
+        words = f"{row['name']} {row['description'] or ''}".lower().split()
+        for term in set(words) | set(tags):
+            postings = self.terms.get(term)
+            if postings is None:
+                postings = self.terms[term] = set()
+                for i in range(len(term) - GRAM + 1):
+                    self.grams.setdefault(term[i:i + GRAM], set()).add(term)
+            postings.add(ordinal)
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(ordinal)
+        self.categories.setdefault(row["category"].lower(), set()).add(ordinal)
+
+    def _match_term(self, token: str) -> Set[int]:
+        postings = self._term_cache.get(token)
+        if postings is None:
+            postings = set()
+            for term in self._candidate_terms(token):
+                if token in term:
+                    postings |= self.terms[term]
+            self._term_cache.put(token, postings)
+        return postings
+
+    def _candidate_terms(self, token: str):
+        if len(token) < GRAM:
+            # Too short for a trigram: scan the vocabulary. There are few such
+            # tokens, so the match cache keeps them.
+            return self.terms
+        grams = sorted(
+            (self.grams.get(token[i:i + GRAM], set()) for i in range(len(token) - GRAM + 1)), key=len
+        )
+        candidates = set(grams[0])
+        for terms in grams[1:]:
+            if not candidates:
+                break
+            candidates &= terms
+        return candidates
+
+    def _match_category(self, category: str) -> Set[int]:
+        category = category.lower()
+        postings = self._category_cache.get(category)
+        if postings is None:
+            postings = set()
+            for name, ordinals in self.categories.items():
+                if category in name:
+                    postings |= ordinals
+            self._category_cache.put(category, postings)
+        return postings
+
+    def _match_tags(self, tags: List[str]) -> Set[int]:
+        postings = set()
+        for tag in tags:
+            postings |= self.tags.get(tag.lower(), set())
+        return postings
+
+    def search(self, query: str = "", category: str = "", tags: List[str] = [], limit: int = 10) -> List[str]:
+        """Return up to `limit` product ids, AND-matching first with an OR fallback."""
+        self.ensure_fresh()
+        with self._lock:
+            tokens = query.lower().split() if query else []
+
+            filters = [self._match_term(t) for t in tokens]
+            if category:
+                filters.append(self._match_category(category))
+            if tags:
+                filters.append(self._match_tags(tags))
+
+            if filters:
+                # Intersect smallest posting list first
+                filters.sort(key=len)
+                matches = set(filters[0])
+                for postings in filters[1:]:
+                    if not matches:
+                        break
+                    matches &= postings
+            else:
+                matches = range(len(self.ids))
+
+            # Fallback: ANY token or the category, ignoring the tag filter
+            # (same behaviour as the broad SQL query)
+            if not matches and query and (tokens or category):
+                matches = set()
+                if category:
+                    matches |= self._match_category(category)
+                for token in tokens:
+                    matches |= self._match_term(token)
+
+            return [self.ids[o] for o in heapq.nsmallest(limit, matches)]
+
+
+_index: Optional[InvertedIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_search_index() -> InvertedIndex:
+    """Process-wide index shared by every ProductCatalog instance."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = InvertedIndex()
+        return _index
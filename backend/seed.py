@@ -1,7 +1,9 @@
-import sqlite3
+import argparse
 import json
-import random
-from database import get_db_connection, init_db
+import numpy as np
+from database import init_db
+from importer import PRODUCT_COLUMNS, bulk_load, read_products
+from recommendations import get_recommendation_index
 
 # Base data for generation
 # Base data for generation
@@ -47,95 +49,126 @@ IMAGES = {
     "Accessory": "https://images.unsplash.com/photo-1511499767150-a48a237f0083?q=80&w=1000&auto=format&fit=crop"
 }
 
-def generate_products(count=300):
-    products = []
-    
-    # Demographics
-    DEMOGRAPHICS = ["Women", "Men", "Girl", "Boy"]
-    
-    for i in range(count):
-        cat = random.choice(list(CATEGORIES.keys()))
-        sub_type, item_names = random.choice(CATEGORIES[cat])
-        base_name = random.choice(item_names)
-        color = random.choice(COLORS)
-        adj = random.choice(ADJECTIVES)
-        
-        # Gender assignment logic
-        # Specific items usually map to specific genders, but purely random for generic items
-        # Heuristics:
-        if any(x in base_name for x in ["Dress", "Skirt", "Blouse", "Heels", "Clutch"]):
-            target_demo = random.choice(["Women", "Girl"])
-        elif any(x in base_name for x in ["Suit", "Tuxedo", "Oxford"]):
-            target_demo = random.choice(["Men", "Boy"])
-        else:
-            target_demo = random.choice(DEMOGRAPHICS)
-
-        # Refine name based on demo (e.g. "Little Girl's Dress" or "Men's Suit")
-        if target_demo in ["Girl", "Boy"]:
-            prefix = f"{target_demo}'s"
-        else:
-            prefix = f"{target_demo}'s" if random.random() > 0.7 else "" # Optional prefix for adults
-            
-        full_name = f"{adj} {color} {base_name}"
-        if prefix:
-             full_name = f"{prefix} {full_name}"
-
-        price = round(random.uniform(25.0, 450.0), 2)
-        if target_demo in ["Girl", "Boy"]:
-            price = round(price * 0.6, 2) # Kids clothes cheaper
-        
-        # Tags creation
-        tags = [cat.lower(), sub_type.lower(), color.lower(), adj.lower(), target_demo.lower(), "fashion"]
-        
-        if cat == "Clothing":
-            tags.append("fashion")
-            tags.append("clothes")
-            tags.append("women" if random.random() > 0.4 else "men") # Mix of men/women
-        if "Wedding" in base_name or "Formal" in tags or "Suit" in base_name or "Evening" in base_name:
-            tags.append("formal")
-            tags.append("wedding")
-        elif "Casual" in base_name or "Hoodie" in base_name or "Sneakers" in base_name:
-            tags.append("casual")
-            tags.append("streetwear")
-
-        # Fallback image logic
-        img_key = sub_type if sub_type in IMAGES else cat
-        if img_key not in IMAGES: img_key = "Clothing"
-        image = IMAGES.get(img_key)
-
-        product = {
-            "id": f"gen_{i+1}",
-            "name": full_name,
-            "category": cat,
-            "price": price,
-            "description": f"A stylish {base_name.lower()} for {target_demo}s. Perfect for {tags[-1]} occasions.",
-            "tags": json.dumps(tags),
-            "stock": random.randint(1, 50),
-            "image": image
-        }
-        products.append(product)
-        
-    return products
-
-def seed():
+# Flattened (category, sub type, base name) choices with everything derived
+# from them precomputed, so generating a row is a few array lookups
+def _build_bases():
+    bases = []
+    for cat, sub_types in CATEGORIES.items():
+        for sub_type, item_names in sub_types:
+            for base_name in item_names:
+                # Gender assignment logic
+                # Specific items usually map to specific genders, but purely random for generic items
+                if any(x in base_name for x in ["Dress", "Skirt", "Blouse", "Heels", "Clutch"]):
+                    demographics = ["Women", "Girl"]
+                elif any(x in base_name for x in ["Suit", "Tuxedo", "Oxford"]):
+                    demographics = ["Men", "Boy"]
+                else:
+                    demographics = ["Women", "Men", "Girl", "Boy"]
+
+                if "Wedding" in base_name or "Suit" in base_name or "Evening" in base_name:
+                    extra_tags = ["formal", "wedding"]
+                elif "Casual" in base_name or "Hoodie" in base_name or "Sneakers" in base_name:
+                    extra_tags = ["casual", "streetwear"]
+                else:
+                    extra_tags = []
+
+                # Fallback image logic
+                img_key = sub_type if sub_type in IMAGES else cat
+                if img_key not in IMAGES: img_key = "Clothing"
+
+                bases.append({
+                    "cat": cat,
+                    "sub_type": sub_type,
+                    "base_name": base_name,
+                    "demographics": demographics,
+                    "extra_tags": extra_tags,
+                    "image": IMAGES[img_key],
+                    # Uniform category, then sub type, then item
+                    "weight": 1 / len(CATEGORIES) / len(sub_types) / len(item_names),
+                })
+    return bases
+
+BASES = _build_bases()
+GENERATOR_CHUNK = 10000
+
+def generate_products(count=300, seed=None):
+    return list(iter_products(count, seed=seed))
+
+def iter_products(count=300, seed=None, start=0):
+    """Same rows as iter_product_rows(), as dicts."""
+    for row in iter_product_rows(count, seed=seed, start=start):
+        yield dict(zip(PRODUCT_COLUMNS, row))
+
+def iter_product_rows(count=300, seed=None, start=0):
+    """Yield `count` synthetic product tuples (ids gen_{start+1}...) in PRODUCT_COLUMNS order.
+
+    Random choices are drawn with NumPy a chunk at a time; same seed, same catalog.
+    """
+    rng = np.random.default_rng(seed)
+    weights = np.array([b["weight"] for b in BASES])
+    weights /= weights.sum()
+    n_demographics = np.array([len(b["demographics"]) for b in BASES])
+
+    for chunk_start in range(0, count, GENERATOR_CHUNK):
+        n = min(GENERATOR_CHUNK, count - chunk_start)
+        base_idx = rng.choice(len(BASES), size=n, p=weights)
+        color_idx = rng.integers(0, len(COLORS), size=n)
+        adj_idx = rng.integers(0, len(ADJECTIVES), size=n)
+        demo_idx = (rng.random(n) * n_demographics[base_idx]).astype(int)
+        adult_prefix = rng.random(n) > 0.7  # Optional prefix for adults
+        prices = np.round(rng.uniform(25.0, 450.0, size=n), 2)
+        mixed_women = rng.random(n) > 0.4  # Clothing: mix of men/women
+        stock = rng.integers(1, 51, size=n)
+
+        for j in range(n):
+            base = BASES[base_idx[j]]
+            cat, sub_type, base_name = base["cat"], base["sub_type"], base["base_name"]
+            color, adj = COLORS[color_idx[j]], ADJECTIVES[adj_idx[j]]
+            target_demo = base["demographics"][demo_idx[j]]
+            kid = target_demo in ("Girl", "Boy")
+
+            # Refine name based on demo (e.g. "Little Girl's Dress" or "Men's Suit")
+            full_name = f"{adj} {color} {base_name}"
+            if kid or adult_prefix[j]:
+                full_name = f"{target_demo}'s {full_name}"
+
+            price = float(prices[j])
+            if kid:
+                price = round(price * 0.6, 2) # Kids clothes cheaper
+
+            # Tags creation
+            tags = [cat.lower(), sub_type.lower(), color.lower(), adj.lower(), target_demo.lower(), "fashion"]
+            if cat == "Clothing":
+                tags += ["fashion", "clothes", "women" if mixed_women[j] else "men"]
+            tags += base["extra_tags"]
+
+            yield (
+                f"gen_{start + chunk_start + j + 1}",
+                full_name,
+                cat,
+                price,
+                f"A stylish {base_name.lower()} for {target_demo}s. Perfect for {tags[-1]} occasions.",
+                json.dumps(tags),
+                int(stock[j]),
+                base["image"],
+            )
+
+def seed(count=250, seed_value=None, path=None):
+    """Replace the catalog with `count` generated products, or the products in a CSV/JSONL feed."""
     print("Seeding database...")
     init_db()
-    conn = get_db_connection()
-    
-    # Clear existing
-    conn.execute("DELETE FROM products")
-    
-    products = generate_products(250) # Generating 250 items to be safe
-    
-    for p in products:
-        conn.execute('''
-            INSERT INTO products (id, name, category, price, description, tags, stock, image)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (p["id"], p["name"], p["category"], p["price"], p["description"], p["tags"], p["stock"], p["image"]))
-        
-    conn.commit()
-    print(f"Seeded {len(products)} products.")
-    conn.close()
+
+    rows = read_products(path) if path else iter_product_rows(count, seed=seed_value)
+    stats = bulk_load(rows, replace=True)
+    print(f"Seeded {stats.rows} products: {stats.summary()}")
+
+    # Offline stage: precompute recommendations for the new catalog
+    get_recommendation_index().rebuild()
 
 if __name__ == "__main__":
-    seed()
+    parser = argparse.ArgumentParser(description="Seed the product catalog.")
+    parser.add_argument("--count", type=int, default=250, help="number of generated products")
+    parser.add_argument("--seed", type=int, default=None, help="generator seed, for a reproducible catalog")
+    parser.add_argument("--file", help="import a .csv or .jsonl (optionally .gz) product feed instead")
+    args = parser.parse_args()
+    seed(count=args.count, seed_value=args.seed, path=args.file)
@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from database import db_connection
+from cart import Cart, LineItem
+from cart_events import cart_events
+
+
+def cart_etag(cart_id: str, revision: int) -> str:
+    return f'"{cart_id}-{revision}"'
+
+
+class Session:
+    """Per-shopper state. The LLM client and catalog live on the shared ShopperAgent.
+
+    Every cart mutation bumps `revision` and publishes a delta to
+    /cart/events subscribers. `cart_id` changes whenever the session is
+    recreated, so (cart_id, revision) is a safe ETag.
+
+    Mutations are also journaled as ops until the next save, so a store
+    that finds the saved copy changed underneath (another request, another
+    worker) can replay them onto it instead of overwriting it.
+    """
+
+    def __init__(self, session_id: str, cart: Optional[Cart] = None, revision: int = 0, cart_id: Optional[str] = None):
+        self.id = session_id
+        self.cart = cart if cart is not None else Cart()
+        self.revision = revision
+        self.cart_id = cart_id or uuid.uuid4().hex[:12]
+        self._lock = threading.RLock()
+        # (cart_id, revision) of the stored copy this session was loaded from, None if never stored
+        self._base: Optional[Tuple[Optional[str], int]] = None
+        self._pending: List[Tuple] = []
+
+    @property
+    def etag(self) -> str:
+        return cart_etag(self.cart_id, self.revision)
+
+    # Mutations and to_dict() hold the session lock: chat tools run on the
+    # threadpool and TOOL_EXECUTOR while other requests use the same session
+
+    def add_item(self, product: Dict) -> LineItem:
+        with self._lock:
+            line = self.cart.add(product)
+            # The full product rides along so the UI can render the card
+            self._changed({"op": "add", "line": line.to_dict(), "product": product}, ("add", product))
+            return line
+
+    def remove_item(self, product_id: str) -> Optional[LineItem]:
+        with self._lock:
+            line = self.cart.remove(product_id)
+            if line:
+                self._changed({"op": "remove", "line": line.to_dict()}, ("remove", product_id))
+            return line
+
+    def clear_cart(self):
+        with self._lock:
+            self.cart.clear()
+            self._changed({"op": "clear"}, ("clear",))
+
+    def claim_cart(self) -> Tuple[List[LineItem], str]:
+        """Empty the cart for checkout; returns its lines and the cart's order key.
+
+        Only one concurrent caller gets the lines, the others find the cart
+        empty. The key (cart_id-revision) makes the order idempotent across
+        workers that loaded the same cart.
+        """
+        with self._lock:
+            lines = [LineItem(line.id, line.name, line.price, line.qty) for line in self.cart.lines()]
+            key = f"{self.cart_id}-{self.revision}"
+            if lines:
+                self.cart.clear()
+                # Replayed as "take these lines", not "clear": anything added elsewhere meanwhile stays
+                self._changed({"op": "clear"}, ("take", lines))
+            return lines, key
+
+    def restore_cart(self, lines: List[LineItem]):
+        """Put claimed lines back after a checkout that didn't go through."""
+        with self._lock:
+            _replay(self.cart, ("restore", lines))
+            self._changed({"op": "restore", "items": [line.to_dict() for line in lines]}, ("restore", lines))
+
+    def rebase(self, stored: Optional[Dict]):
+        """Bring the session up to date with the stored copy (`to_dict()` form, None if absent).
+
+        Unsaved ops are replayed onto the stored cart; subscribers get a
+        "sync" delta telling them to refetch. No-op if the stored copy is
+        the one this session was loaded from.
+        """
+        with self._lock:
+            if _stored_key(stored) == self._base:
+                return
+            current = Session.from_dict(self.id, stored) if stored is not None else None
+            cart = current.cart if current else Cart()
+            for op in self._pending:
+                _replay(cart, op)
+            self.cart = cart
+            if current:
+                self.cart_id = current.cart_id
+            if self._pending or current is None:
+                self.revision = max(self.revision, current.revision if current else 0) + 1
+                self._publish({"op": "sync"})
+            else:
+                self.revision = current.revision
+            self._base = _stored_key(stored)
+
+    def saved(self):
+        """The store has written this session's current state."""
+        with self._lock:
+            self._base = (self.cart_id, self.revision)
+            self._pending = []
+
+    def _changed(self, delta: Dict, op: Tuple):
+        self._pending.append(op)
+        self.revision += 1
+        self._publish(delta)
+
+    def _publish(self, delta: Dict):
+        cart_events.publish(self.id, {
+            **delta,
+            "revision": self.revision,
+            "cart_id": self.cart_id,
+            "count": self.cart.count,
+            "subtotal": self.cart.subtotal,
+        })
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {"cart": self.cart.to_dict(), "revision": self.revision, "cart_id": self.cart_id}
+
+    @classmethod
+    def from_dict(cls, session_id: str, data: Dict) -> "Session":
+        session = cls(
+            session_id,
+            cart=Cart.from_dict(data.get("cart", [])),
+            revision=data.get("revision", 0),
+            cart_id=data.get("cart_id"),
+        )
+        session._base = _stored_key(data)
+        return session
+
+
+def _stored_key(data: Optional[Dict]) -> Optional[Tuple[Optional[str], int]]:
+    # From the raw dict: rows saved before cart_id existed get a fresh one on every load
+    return (data.get("cart_id"), data.get("revision", 0)) if data is not None else None
+
+
+def _replay(cart: Cart, op: Tuple):
+    kind = op[0]
+    if kind == "add":
+        cart.add(op[1])
+    elif kind == "remove":
+        cart.remove(op[1])
+    elif kind == "clear":
+        cart.clear()
+    elif kind == "take":
+        for line in op[1]:
+            cart.remove(line.id, line.qty)
+    elif kind == "restore":
+        for line in op[1]:
+            cart.add({"id": line.id, "name": line.name, "price": line.price}, line.qty)
+
+
+class MemorySessionStore:
+    """In-process LRU of live Session objects with idle-time (TTL) eviction."""
+
+    def __init__(self, max_sessions: int = 10000, ttl: float = 3600.0):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()  # id -> (session, last_seen)
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> Session:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None or now - entry[1] > self.ttl:
+                session = Session(session_id)
+            else:
+                session = entry[0]
+            self._sessions[session_id] = (session, now)
+            self._evict(now)
+            return session
+
+    def save(self, session: Session):
+        with self._lock:
+            self._sessions[session.id] = (session, time.monotonic())
+            self._sessions.move_to_end(session.id)
+        session.saved()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict(self, now: float):
+        # Oldest entries sit at the front
+        while self._sessions:
+            session_id, (_, last_seen) = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - last_seen > self.ttl:
+                self._sessions.popitem(last=False)
+            else:
+                break
+
+
+class SQLiteSessionStore:
+    """Sessions serialized into a `sessions` table, shared by every worker using the same database."""
+
+    PURGE_EVERY = 500  # saves between expired-row sweeps
+
+    def __init__(self, ttl: float = 3600.0):
+        self.ttl = ttl
+        self._saves = 0
+        with db_connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL, -- JSON from Session.to_dict()
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            conn.commit()
+
+    def load(self, session_id: str) -> Session:
+        now = time.time()
+        with db_connection() as conn:
+            row = self._row(conn, session_id, now)
+            if row is None:
+                # Store a new session straight away: its cart_id is random, and the
+                # ETag must name the same cart on every request and worker. An
+                # expired row is replaced; a concurrent first load wins the insert.
+                conn.execute(
+                    "INSERT INTO sessions (id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at "
+                    "WHERE sessions.updated_at <= ?",
+                    (session_id, json.dumps(Session(session_id).to_dict()), now, now - self.ttl)
+                )
+                conn.commit()
+                row = self._row(conn, session_id, now)
+        return Session.from_dict(session_id, json.loads(row["data"]))
+
+    def _row(self, conn, session_id: str, now: float):
+        return conn.execute(
+            "SELECT data FROM sessions WHERE id = ? AND updated_at > ?", (session_id, now - self.ttl)
+        ).fetchone()
+
+    def save(self, session: Session):
+        """Write the session; if the stored copy moved on since it was loaded,
+        replay the session's unsaved changes onto it rather than overwrite it."""
+        now = time.time()
+        with session._lock, db_connection() as conn:
+            # Read and write under the write lock, so nothing lands in between
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._row(conn, session.id, now)
+                session.rebase(json.loads(row["data"]) if row else None)
+                conn.execute(
+                    "INSERT INTO sessions (id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    (session.id, json.dumps(session.to_dict()), now)
+                )
+                self._saves += 1
+                if self._saves % self.PURGE_EVERY == 0:
+                    conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            session.saved()
+
+    def delete(self, session_id: str):
+        with db_connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            conn.commit()
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def create_session_store():
+    backend = os.getenv("SESSION_BACKEND", "memory")
+    ttl = float(os.getenv("SESSION_TTL", 3600))
+    if backend == "sqlite":
+        return SQLiteSessionStore(ttl=ttl)
+    return MemorySessionStore(max_sessions=int(os.getenv("SESSION_MAX", 10000)), ttl=ttl)
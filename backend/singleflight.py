@@ -0,0 +1,96 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from telemetry import Counter, register
+
+# role="leader" ran the computation, role="coalesced" waited for a leader's result
+FLIGHTS = register(Counter("shopper_singleflight_calls_total", "Single-flight calls by group and role (leader, coalesced)."))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight computation.
+
+    The first caller (the leader) runs it; callers arriving while it runs
+    wait and get the same result, or the same exception. Nothing is kept
+    once it finishes, that's the caches' job. Results are shared, so
+    callers must not mutate them.
+
+    do() is for threads, ado() for coroutines; they don't coalesce with
+    each other.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            FLIGHTS.inc(group=self.name, role="coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        FLIGHTS.inc(group=self.name, role="leader")
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        # A future belongs to the loop that made it
+        key = (id(loop), key)
+        while True:
+            with self._lock:
+                future = self._futures.get(key)
+                if future is None:
+                    future = self._futures[key] = loop.create_future()
+                    break
+            FLIGHTS.inc(group=self.name, role="coalesced")
+            try:
+                # shield: a waiter being cancelled mustn't cancel the leader's result
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader itself was cancelled (client went away): go again
+
+        FLIGHTS.inc(group=self.name, role="leader")
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; don't warn when there are none
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._futures[key]
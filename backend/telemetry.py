@@ -0,0 +1,364 @@
+import os
+import re
+import sys
+import time
+import random
+import threading
+import contextvars
+import functools
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+
+# Request instrumentation: timing spans per stage (llm_call, tool:<name>,
+# db_query, serialize), a Server-Timing header, Prometheus-style metrics and
+# an opt-in sampling profiler for slow requests.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = ['{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series: Dict[Tuple, list] = {}  # labels -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    le = 'le="%g"' % bound
+                    lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(key, le)} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+REQUESTS = Counter("shopper_http_requests_total", "HTTP requests by route and status.")
+REQUEST_SECONDS = Histogram("shopper_http_request_duration_seconds", "HTTP request latency (streams: until the body ends).")
+STAGE_SECONDS = Histogram("shopper_stage_duration_seconds", "Time spent per request stage (llm_call, tool:<name>, db_query, serialize).")
+PROFILES_WRITTEN = Counter("shopper_profiles_written_total", "Slow-request profiles written by the sampling profiler.")
+STARTUP_SECONDS = Gauge("shopper_startup_seconds", "Worker startup time by phase (import, init_db, warmup).")
+
+METRICS = [REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, PROFILES_WRITTEN, STARTUP_SECONDS]
+
+
+def register(metric):
+    """Add a metric defined elsewhere to /metrics."""
+    METRICS.append(metric)
+    return metric
+
+
+def render_metrics() -> str:
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines: List[str] = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class Trace:
+    """Span totals for one request. Shared by every thread working on it."""
+
+    __slots__ = ("started", "spans", "threads", "_lock")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, list] = {}  # name -> [seconds, count]
+        self.threads = {threading.get_ident()}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            entry = self.spans.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+            self.threads.add(threading.get_ident())
+
+    def server_timing(self) -> str:
+        # Concurrent tools overlap, so stage totals can add up to more than `total`
+        with self._lock:
+            parts = [
+                f'{re.sub(r"[^A-Za-z0-9_.-]", "_", name)};dur={seconds * 1000:.1f};desc="{name} x{count}"'
+                for name, (seconds, count) in self.spans.items()
+            ]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+_open_spans: contextvars.ContextVar = contextvars.ContextVar("open_spans", default=frozenset())
+
+
+def record(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+@contextmanager
+def span(name: str):
+    """Time a stage. A span nested in one of the same name (hybrid search
+    fetching cards by id) is folded into the outer one, not counted twice."""
+    open_spans = _open_spans.get()
+    if name in open_spans:
+        yield
+        return
+    token = _open_spans.set(open_spans | {name})
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _open_spans.reset(token)
+        record(name, time.perf_counter() - started)
+
+
+def timed(name: str):
+    """Decorator form of span()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples thread stacks while profiled requests are in flight.
+
+    Every `interval` seconds a background thread walks sys._current_frames()
+    and counts the collapsed stack of each thread. When a request finishes
+    slower than `slow_seconds`, the samples from the threads that worked on
+    it (the event loop plus any that recorded a span) are written out in
+    folded-stack format (flamegraph.pl, speedscope), by the sampling thread
+    rather than the request. Only a `sample_rate` fraction of requests is
+    profiled.
+    """
+
+    def __init__(self, slow_seconds: float, sample_rate: float = 1.0, interval: float = 0.005,
+                 out_dir: str = "profiles", skip_paths: Tuple[str, ...] = ()):
+        self.slow_seconds = slow_seconds
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.out_dir = out_dir
+        self.skip_paths = skip_paths
+        self._active: Dict[int, Dict[Tuple[int, str], int]] = {}
+        self._pending: List[Tuple] = []  # slow requests' profiles waiting to be written
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["SamplingProfiler"]:
+        # Opt-in: nothing runs unless PROFILE_SLOW_MS is set
+        slow_ms = os.getenv("PROFILE_SLOW_MS")
+        if not slow_ms:
+            return None
+        return cls(
+            slow_seconds=float(slow_ms) / 1000,
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", 1.0)),
+            interval=float(os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000,
+            out_dir=os.getenv("PROFILE_DIR", "profiles"),
+            # Long-lived streams would always count as slow
+            skip_paths=tuple(p for p in os.getenv("PROFILE_SKIP_PATHS", "/cart/events,/metrics").split(",") if p),
+        )
+
+    def start(self, path: str) -> Optional[Dict[Tuple[int, str], int]]:
+        if path in self.skip_paths or random.random() >= self.sample_rate:
+            return None
+        samples: Dict[Tuple[int, str], int] = {}
+        with self._cond:
+            self._active[id(samples)] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return samples
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            with self._cond:
+                while not self._active and not self._pending:
+                    self._cond.wait()
+                pending, self._pending = self._pending, []
+            for profile in pending:
+                self._write(*profile)
+            if not self._active:
+                continue
+            time.sleep(self.interval)
+
+            stacks = {}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                names = []
+                while frame is not None:
+                    names.append(_frame_name(frame))
+                    frame = frame.f_back
+                stacks[thread_id] = ";".join(reversed(names))
+
+            with self._cond:
+                for samples in self._active.values():
+                    for key in stacks.items():
+                        samples[key] = samples.get(key, 0) + 1
+
+    def finish(self, samples: Dict[Tuple[int, str], int], trace: Trace, elapsed: float, label: str):
+        """Stop sampling for a request. A slow one's profile is queued for the
+        sampling thread to write: this runs on the event loop."""
+        if elapsed < self.slow_seconds:
+            with self._cond:
+                self._active.pop(id(samples), None)
+            return
+        with trace._lock:
+            threads = set(trace.threads)
+        profile = (samples, threads, trace.server_timing(), elapsed, label)
+        with self._cond:
+            self._active.pop(id(samples), None)
+            self._pending.append(profile)
+            self._cond.notify()
+
+    def _write(self, samples: Dict[Tuple[int, str], int], threads: Set[int], timing: str,
+               elapsed: float, label: str) -> Optional[str]:
+        folded: Dict[str, int] = {}
+        for (thread_id, stack), count in samples.items():
+            if thread_id in threads and stack:
+                folded[stack] = folded.get(stack, 0) + count
+
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")
+        path = os.path.join(self.out_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{elapsed * 1000:.0f}ms.folded")
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            with open(path, "w") as f:
+                # Comment lines are skipped by flamegraph.pl and speedscope
+                f.write(f"# {label} {elapsed * 1000:.1f}ms; {timing}\n")
+                for stack, count in sorted(folded.items(), key=lambda item: -item[1]):
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            # Keep the sampling thread alive
+            print(f"Could not write profile {path}: {e}")
+            return None
+        PROFILES_WRITTEN.inc()
+        print(f"Slow request profile: {label} took {elapsed * 1000:.0f}ms -> {path}")
+        return path
+
+
+class TimingMiddleware:
+    """ASGI middleware: opens a Trace per request, adds Server-Timing to the
+    response headers and feeds the request metrics and profiler.
+
+    Server-Timing carries the spans finished when the headers go out, which
+    for streamed responses is before the body (and its spans) is produced.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.profiler = SamplingProfiler.from_env()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        token = _trace.set(trace)
+        samples = self.profiler.start(scope["path"]) if self.profiler else None
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", [])) + [(b"server-timing", trace.server_timing().encode("latin-1"))]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _trace.reset(token)
+            elapsed = time.perf_counter() - trace.started
+            # Route templates, not raw paths, so ids don't explode the label set
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUESTS.inc(method=scope["method"], route=route, status=str(status))
+            REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route)
+            if samples is not None:
+                self.profiler.finish(samples, trace, elapsed, f"{scope['method']} {route}")
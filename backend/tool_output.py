@@ -0,0 +1,39 @@
+import os
+import json
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+# Tool results are read by the LLM, not rendered, so they carry only what the
+# model needs to pick and reference products: no image URL, short keys and a
+# truncated description. The UI gets the full product dicts separately.
+DESCRIPTION_CHARS = int(os.getenv("TOOL_DESCRIPTION_CHARS", 80))
+
+
+class ToolResult:
+    """What a tool produced: `content` goes into the LLM history, `products` to the UI."""
+
+    def __init__(self, content: str, products: Optional[List[Dict]] = None):
+        self.content = content
+        self.products = products
+
+
+@lru_cache(maxsize=int(os.getenv("TOOL_OUTPUT_CACHE_SIZE", 100000)))
+def _compact_fragment(product_id: str, name: str, price: float, category: str, description: str, tags: tuple) -> str:
+    # Keyed on every projected field, so an edited product simply misses the cache
+    if len(description) > DESCRIPTION_CHARS:
+        description = description[:DESCRIPTION_CHARS].rstrip() + "..."
+    return json.dumps(
+        {"id": product_id, "name": name, "price": price, "cat": category, "tags": list(dict.fromkeys(tags)), "desc": description},
+        separators=(",", ":"),
+    )
+
+
+def compact_product(p: Dict) -> str:
+    return _compact_fragment(
+        p["id"], p["name"], p["price"], p["category"], p.get("description") or "", tuple(p.get("tags") or ())
+    )
+
+
+def compact_products_json(products: List[Dict]) -> str:
+    # Fragments are cached per product; a result list is just a join
+    return "[" + ",".join(compact_product(p) for p in products) + "]"
@@ -0,0 +1,283 @@
+import os
+import re
+import json
+import zlib
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import database
+from llm_cache import STOPWORDS, stem
+
+VECTOR_DIM = int(os.getenv("VECTOR_DIM", 2048))
+# When set, the sparse postings are written to this .npy file and memory-mapped back
+VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", "")
+
+# Field weights when embedding a product
+NAME_WEIGHT = 2.0
+TAG_WEIGHT = 2.0
+CATEGORY_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 1.0
+NGRAM_WEIGHT = 0.3  # character trigrams catch partial words and typos
+EXPANSION_WEIGHT = 0.5
+
+# Local "semantic" layer: occasion/weather words mapped to the catalog's
+# vocabulary, so "chilly outdoor wedding" reaches wraps and wool coats
+CONCEPTS = {
+    ("cold", "chilly", "cool", "freezing", "snow", "winter"): ["winter", "wool", "cashmere", "wrap", "scarf", "coat", "puffer", "knitted", "boots"],
+    ("hot", "summer", "beach", "sunny", "vacation", "holiday", "tropical"): ["summer", "linen", "straw", "sunglasses", "espadrilles", "floral"],
+    ("wedding", "formal", "gala", "cocktail", "evening", "party", "black-tie"): ["formal", "wedding", "evening", "cocktail", "suit", "tuxedo", "silk", "heels", "clutch"],
+    ("outdoor", "outdoors", "garden", "hiking"): ["jacket", "coat", "boots", "scarf", "wrap"],
+    ("shawl", "shawls", "stole", "pashmina"): ["wrap", "cashmere", "scarf", "scarves"],
+    ("office", "work", "business", "interview", "meeting"): ["blazer", "trousers", "tailored", "oxford", "loafers", "classic"],
+    ("casual", "weekend", "everyday", "relaxed", "comfy"): ["casual", "streetwear", "hoodie", "sneakers", "jeans", "t-shirt"],
+    ("rain", "rainy", "wet"): ["trench", "coat", "boots", "jacket"],
+}
+EXPANSIONS: Dict[str, List[str]] = {word: related for words, related in CONCEPTS.items() for word in words}
+
+_WORD = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)?")
+
+
+@lru_cache(maxsize=65536)
+def _bucket(feature: str) -> Tuple[int, float]:
+    # crc32 rather than hash(): stable across processes, so a saved index
+    # stays valid. The top bit picks a sign so collisions partly cancel out.
+    h = zlib.crc32(feature.encode())
+    return h % VECTOR_DIM, (1.0 if h & 0x80000000 else -1.0)
+
+
+def _features(text: str, weight: float, out: Dict[int, float]):
+    for word in _WORD.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        word = stem(word)
+        _add(out, "w:" + word, weight)
+        padded = f"<{word}>"
+        for i in range(len(padded) - 2):
+            _add(out, "c:" + padded[i:i + 3], weight * NGRAM_WEIGHT)
+
+
+def _add(out: Dict[int, float], feature: str, weight: float):
+    index, sign = _bucket(feature)
+    out[index] = out.get(index, 0.0) + sign * weight
+
+
+def product_vector_features(row) -> Dict[int, float]:
+    out: Dict[int, float] = {}
+    _features(row["name"], NAME_WEIGHT, out)
+    _features(" ".join(json.loads(row["tags"] or "[]")), TAG_WEIGHT, out)
+    _features(row["category"], CATEGORY_WEIGHT, out)
+    _features(row["description"] or "", DESCRIPTION_WEIGHT, out)
+    return out
+
+
+def query_features(query: str) -> Dict[int, float]:
+    out: Dict[int, float] = {}
+    _features(query, 1.0, out)
+    related = {r for word in _WORD.findall(query.lower()) for r in EXPANSIONS.get(word, [])}
+    if related:
+        _features(" ".join(sorted(related)), EXPANSION_WEIGHT, out)
+    return out
+
+
+POSTING = np.dtype([("row", np.int32), ("weight", np.float32)])
+BUILD_CHUNK = 10_000
+
+
+class _Snapshot:
+    """One fully built index. Never modified after it's published, so
+    searches can score against it without holding the index lock."""
+
+    def __init__(self, ids: List[str], indptr: np.ndarray, postings: np.ndarray, idf: np.ndarray,
+                 categories: List[str], tags: List[List[str]]):
+        self.ids = ids
+        # Column-compressed sparse matrix: the rows using hashed feature d, and
+        # their weights, are postings[indptr[d]:indptr[d + 1]]
+        self.indptr = indptr
+        self.rows = postings["row"]
+        self.weights = postings["weight"]
+        self.postings = postings
+        self.idf = idf
+        self.category_names = sorted({c.lower() for c in categories})
+        codes = {name: i for i, name in enumerate(self.category_names)}
+        self.categories = np.array([codes[c.lower()] for c in categories], dtype=np.int32)
+        rows_by_tag: Dict[str, List[int]] = {}
+        for i, row_tags in enumerate(tags):
+            for tag in row_tags:
+                rows_by_tag.setdefault(tag.lower(), []).append(i)
+        self.tags = {tag: np.array(rows, dtype=np.int32) for tag, rows in rows_by_tag.items()}
+
+    def scores(self, features: Dict[int, float]) -> np.ndarray:
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for d, weight in features.items():
+            start, end = self.indptr[d], self.indptr[d + 1]
+            if weight and end > start:
+                # A row appears at most once per feature, so += doesn't drop repeats
+                scores[self.rows[start:end]] += weight * self.idf[d] * self.weights[start:end]
+        return scores
+
+    def mask(self, category: str, tags: List[str]) -> Optional[np.ndarray]:
+        mask = None
+        if category:
+            matching = [i for i, name in enumerate(self.category_names) if category.lower() in name]
+            mask = np.isin(self.categories, matching)
+        if tags:
+            tagged = np.zeros(len(self.ids), dtype=bool)
+            for tag in tags:
+                rows = self.tags.get(tag.lower())
+                if rows is not None:
+                    tagged[rows] = True
+            mask = tagged if mask is None else mask & tagged
+        return mask
+
+
+EMPTY = _Snapshot([], np.zeros(VECTOR_DIM + 1, dtype=np.int64), np.zeros(0, dtype=POSTING),
+                  np.ones(VECTOR_DIM, dtype=np.float32), [], [])
+
+
+class VectorIndex:
+    """Hashed TF-IDF vectors (words + character trigrams) for every product.
+
+    Vectors are L2 normalised and stored sparse, by feature: a product only
+    has a hundred or so of the VECTOR_DIM features, and a query only touches
+    the postings of its own features, so memory and query cost follow the
+    number of non-zeros rather than rows x VECTOR_DIM. Category and tag
+    filters are applied as boolean masks before an argpartition for the top k.
+
+    Rebuilt when the catalog version changes. A build produces a new
+    snapshot that is swapped in under the lock; searches score outside it.
+    With VECTOR_INDEX_PATH set the postings are saved next to a small JSON
+    sidecar and memory-mapped, so workers share pages and restarts skip the
+    rebuild.
+    """
+
+    def __init__(self, path: str = VECTOR_INDEX_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._catalog_version = None
+        self._snapshot = EMPTY
+
+    @property
+    def ids(self) -> List[str]:
+        return self._snapshot.ids
+
+    def ensure_fresh(self):
+        version = database.catalog_version()
+        if version == self._catalog_version:
+            return
+        with self._lock:
+            if version != self._catalog_version:
+                self._snapshot = self._load(version) or self.build(version)
+                self._catalog_version = version
+
+    def build(self, version: int) -> _Snapshot:
+        with database.db_connection() as conn:
+            rows = conn.execute(
+                "SELECT id, name, description, category, tags FROM products ORDER BY rowid"
+            ).fetchall()
+
+        # Coordinate lists, converted chunk by chunk so Python floats don't pile up
+        n = len(rows)
+        row_parts, col_parts, value_parts = [], [], []
+        for chunk in range(0, n, BUILD_CHUNK):
+            counts, cols, values = [], [], []
+            for row in rows[chunk:chunk + BUILD_CHUNK]:
+                features = {d: v for d, v in product_vector_features(row).items() if v}
+                counts.append(len(features))
+                cols.extend(features)
+                values.extend(features.values())
+            row_parts.append(np.repeat(np.arange(chunk, chunk + len(counts), dtype=np.int32), counts))
+            col_parts.append(np.array(cols, dtype=np.int32))
+            value_parts.append(np.array(values, dtype=np.float32))
+        row_of = np.concatenate(row_parts) if row_parts else np.zeros(0, dtype=np.int32)
+        cols = np.concatenate(col_parts) if col_parts else np.zeros(0, dtype=np.int32)
+        values = np.concatenate(value_parts) if value_parts else np.zeros(0, dtype=np.float32)
+
+        df = np.bincount(cols, minlength=VECTOR_DIM)
+        idf = (np.log((1 + n) / (1 + df)) + 1.0).astype(np.float32)
+        values *= idf[cols]
+        norms = np.sqrt(np.bincount(row_of, weights=values.astype(np.float64) ** 2, minlength=n))
+        values /= np.where(norms > 0, norms, 1.0).astype(np.float32)[row_of]
+
+        order = np.argsort(cols, kind="stable")
+        postings = np.empty(len(order), dtype=POSTING)
+        postings["row"] = row_of[order]
+        postings["weight"] = values[order]
+        indptr = np.zeros(VECTOR_DIM + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        categories = [row["category"] for row in rows]
+        tags = [json.loads(row["tags"] or "[]") for row in rows]
+        snapshot = _Snapshot([row["id"] for row in rows], indptr, postings, idf, categories, tags)
+        if self.path:
+            self._save(version, snapshot, categories, tags)
+        print(f"Vector index built: {n} products, {VECTOR_DIM} dims, {len(postings)} non-zeros.")
+        return snapshot
+
+    def _save(self, version: int, snapshot: _Snapshot, categories: List[str], tags: List[List[str]]):
+        # Write aside and rename, so workers mapping the old file keep a consistent view
+        with open(self.path + ".tmp", "wb") as f:
+            np.save(f, snapshot.postings)
+        os.replace(self.path + ".tmp", self.path)
+        with open(self.path + ".json.tmp", "w") as f:
+            json.dump({
+                "version": version,
+                "dim": VECTOR_DIM,
+                "format": "sparse",
+                "ids": snapshot.ids,
+                "indptr": snapshot.indptr.tolist(),
+                "categories": categories,
+                "tags": tags,
+                "idf": snapshot.idf.tolist(),
+            }, f)
+        os.replace(self.path + ".json.tmp", self.path + ".json")
+
+    def _load(self, version: int) -> Optional[_Snapshot]:
+        if not self.path or not os.path.exists(self.path + ".json"):
+            return None
+        try:
+            with open(self.path + ".json") as f:
+                meta = json.load(f)
+            if meta["version"] != version or meta["dim"] != VECTOR_DIM or meta.get("format") != "sparse":
+                return None
+            postings = np.load(self.path, mmap_mode="r")
+            indptr = np.asarray(meta["indptr"], dtype=np.int64)
+            if postings.dtype != POSTING or indptr[-1] != len(postings):
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        return _Snapshot(meta["ids"], indptr, postings, np.asarray(meta["idf"], dtype=np.float32),
+                         meta["categories"], meta["tags"])
+
+    def search(self, query: str, category: str = "", tags: List[str] = [], limit: int = 10) -> List[str]:
+        """Product ids by cosine similarity to the query, best first (positive scores only)."""
+        self.ensure_fresh()
+        with self._lock:
+            snapshot = self._snapshot
+        features = query_features(query)
+        if not features or not snapshot.ids:
+            return []
+
+        scores = snapshot.scores(features)
+        mask = snapshot.mask(category, tags)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [snapshot.ids[i] for i in top if scores[i] > 0]
+
+
+_index: Optional[VectorIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_vector_index() -> VectorIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = VectorIndex()
+        return _index
@@ -1,15 +1,17 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { ChatInterface } from './components/ChatInterface';
 import { ProductCard } from './components/ProductCard';
-import type { Product, Message } from './types';
+import type { Product, Message, CartItem, CartState } from './types';
 import { ShoppingBag, Sparkles, X, Trash2 } from 'lucide-react';
+import { sessionHeaders, SESSION_ID } from './api';
 
 // Simple API util (inline for now or import from api.ts if exists)
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
 function App() {
   const [cartCount, setCartCount] = useState(0);
-  const [cartItems, setCartItems] = useState<Product[]>([]);
+  const [cartItems, setCartItems] = useState<CartItem[]>([]);
+  const [cartSubtotal, setCartSubtotal] = useState(0);
   const [isCartOpen, setIsCartOpen] = useState(false);
 
   const [activeTab, setActiveTab] = useState<'chat' | 'collections' | 'saved'>('chat');
@@ -19,27 +21,76 @@ function App() {
     { role: 'system', content: 'Welcome! I am your personal shopper. How can I help you today?' }
   ]);
 
+  const cartEtag = useRef<string | null>(null);
+  const cartRevision = useRef(0);
+
+  const applyCart = (cart: CartState) => {
+    setCartItems(cart.items);
+    setCartCount(cart.count);
+    setCartSubtotal(cart.subtotal);
+  };
+
+  // Conditional GET: the backend answers 304 when the cart hasn't changed
   const fetchCart = async () => {
     try {
-      const res = await fetch(`${API_URL}/cart`);
+      const headers: Record<string, string> = { ...sessionHeaders };
+      if (cartEtag.current) headers['If-None-Match'] = cartEtag.current;
+
+      const res = await fetch(`${API_URL}/cart`, { headers });
+      if (res.status === 304) return;
+
       const data = await res.json();
-      if (Array.isArray(data)) {
-        setCartItems(data);
-        setCartCount(data.length);
+      if (Array.isArray(data.items)) {
+        cartEtag.current = res.headers.get('ETag');
+        applyCart(data);
       }
     } catch (e) {
       console.error("Failed to fetch cart", e);
     }
   };
 
+  // Cart changes (UI buttons or the agent's tools) are pushed over /cart/events
   useEffect(() => {
-    fetchCart();
-  }, []);
+    const events = new EventSource(`${API_URL}/cart/events?session_id=${SESSION_ID}`);
 
-  // Poll for cart updates every few seconds to keep sync if chat updates it
-  useEffect(() => {
-    const interval = setInterval(fetchCart, 30000); // Polling is simple for this demo
-    return () => clearInterval(interval);
+    events.addEventListener('snapshot', (e) => {
+      const snapshot = JSON.parse((e as MessageEvent).data);
+      cartRevision.current = snapshot.revision;
+      applyCart(snapshot);
+    });
+
+    events.addEventListener('delta', (e) => {
+      const delta = JSON.parse((e as MessageEvent).data);
+      if (delta.revision !== cartRevision.current + 1) {
+        // Missed an update: resync from the server
+        cartRevision.current = delta.revision;
+        fetchCart();
+        return;
+      }
+      cartRevision.current = delta.revision;
+      // Count and subtotal come from the server; only the lines are patched here
+      setCartCount(delta.count);
+      setCartSubtotal(delta.subtotal);
+      if (delta.op === 'restore' || delta.op === 'sync') {
+        // A checkout that didn't go through put its lines back, or the saved
+        // cart was merged with another request's changes: refetch the cards
+        fetchCart();
+        return;
+      }
+      setCartItems(prev => {
+        if (delta.op === 'clear') return [];
+        const line = delta.line;
+        const rest = prev.filter(p => p.id !== line.id);
+        if (line.qty === 0) return rest;
+        if (rest.length === prev.length) return [...prev, { ...delta.product, ...line }];
+        return prev.map(p => p.id === line.id ? { ...p, ...line } : p);
+      });
+    });
+
+    // EventSource reconnects by itself; fall back to one conditional fetch meanwhile
+    events.onerror = () => fetchCart();
+
+    return () => events.close();
   }, []);
 
   const handleAddToCart = async (product: Product) => {
@@ -50,11 +101,10 @@ function App() {
     try {
       await fetch(`${API_URL}/cart/items`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...sessionHeaders },
         body: JSON.stringify({ product_id: product.id })
       });
-      // Fetch cart again to be sure of sync
-      fetchCart();
+      // The cart stream delivers the confirmed state
     } catch (e) {
       console.error("Failed to add to cart backend", e);
       // Revert optimistic update if needed, but for now let's keep it simple
@@ -85,12 +135,13 @@ function App() {
     // For now, visual feedback:
     setCartCount(0);
     setCartItems([]);
+    setCartSubtotal(0);
     setShowCheckoutToast(true);
     setIsCartOpen(false);
 
     // Ideally call backend to clear
     try {
-      await fetch(`${API_URL}/reset`, { method: 'POST' });
+      await fetch(`${API_URL}/reset`, { method: 'POST', headers: sessionHeaders });
       setMessages([{ role: 'system', content: 'Welcome! I am your personal shopper. How can I help you today?' }]); // Reset chat too as agent is reset
     } catch (e) { }
 
@@ -250,19 +301,21 @@ function App() {
                   <button onClick={() => setIsCartOpen(false)} className="mt-4 text-purple-600 font-medium hover:underline">Start Shopping</button>
                 </div>
               ) : (
-                cartItems.map((item, idx) => (
-                  <div key={`${item.id}-${idx}`} className="flex gap-4 p-4 bg-white border border-gray-100 rounded-xl shadow-sm hover:shadow-md transition-shadow group">
+                cartItems.map(item => (
+                  <div key={item.id} className="flex gap-4 p-4 bg-white border border-gray-100 rounded-xl shadow-sm hover:shadow-md transition-shadow group">
                     <img src={item.image || "https://images.unsplash.com/photo-1595777457583-95e059d581b8?q=80&w=200"} className="w-20 h-20 object-cover rounded-lg bg-gray-100" />
                     <div className="flex-1 min-w-0">
                       <h4 className="font-bold text-gray-900 truncate">{item.name}</h4>
                       <p className="text-sm text-gray-500 capitalize">{item.category}</p>
                       <div className="flex items-center justify-between mt-2">
-                        <span className="font-medium text-gray-900">${item.price}</span>
+                        <span className="font-medium text-gray-900">
+                          ${item.price}
+                          {item.qty > 1 && <span className="text-sm text-gray-500 font-normal"> × {item.qty}</span>}
+                        </span>
                         <button
                           onClick={async () => {
                             try {
-                              await fetch(`${API_URL}/cart/items/${item.id}`, { method: 'DELETE' });
-                              fetchCart();
+                              await fetch(`${API_URL}/cart/items/${item.id}`, { method: 'DELETE', headers: sessionHeaders });
                             } catch (e) { console.error(e) }
                           }}
                           className="p-2 text-gray-400 hover:text-red-500 transition-colors opacity-0 group-hover:opacity-100"
@@ -280,7 +333,7 @@ function App() {
             <div className="p-6 border-t border-gray-100 bg-gray-50/50 space-y-4">
               <div className="flex justify-between items-center text-gray-600">
                 <span>Subtotal</span>
-                <span className="font-medium text-gray-900">${cartItems.reduce((acc, curr) => acc + curr.price, 0).toFixed(2)}</span>
+                <span className="font-medium text-gray-900">${cartSubtotal.toFixed(2)}</span>
               </div>
               <button
                 onClick={handleCheckout}
@@ -1,7 +1,37 @@
-import type { Message } from './types';
+import type { Message, Product } from './types';
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
+// Each browser gets its own shopper session (cart) on the backend
+const getSessionId = () => {
+    let id = localStorage.getItem('lumiere_session_id');
+    if (!id) {
+        id = crypto.randomUUID();
+        localStorage.setItem('lumiere_session_id', id);
+    }
+    return id;
+};
+
+// The backend shed the request (429/503): nothing was done, retry after `retryAfter` seconds
+export class BusyError extends Error {
+    retryAfter: number | null;
+
+    constructor(detail: string, retryAfter: number | null) {
+        super(detail);
+        this.name = 'BusyError';
+        this.retryAfter = retryAfter;
+    }
+}
+
+const busyError = async (response: Response) => {
+    const body = await response.json().catch(() => ({}));
+    const retryAfter = Number(response.headers.get('Retry-After'));
+    return new BusyError(body.detail || 'The store is busy right now.', retryAfter || null);
+};
+
+export const SESSION_ID = getSessionId();
+export const sessionHeaders = { 'X-Session-ID': SESSION_ID };
+
 export const sendChat = async (message: string, history: Message[]) => {
     // Filter history to only send role and content
     const minimalHistory = history.map(h => ({ role: h.role, content: h.content }));
@@ -10,10 +40,14 @@ export const sendChat = async (message: string, history: Message[]) => {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
+            ...sessionHeaders,
         },
         body: JSON.stringify({ message, history: minimalHistory }),
     });
 
+    if (response.status === 429 || response.status === 503) {
+        throw await busyError(response);
+    }
     if (!response.ok) {
         throw new Error('Network response was not ok');
     }
@@ -22,6 +56,68 @@ export const sendChat = async (message: string, history: Message[]) => {
 };
 
 export const getCart = async () => {
-    const response = await fetch(`${API_URL}/cart`);
+    const response = await fetch(`${API_URL}/cart`, { headers: sessionHeaders });
     return response.json();
 };
+
+export interface StreamHandlers {
+    onToken?: (content: string) => void;
+    onToolCall?: (name: string) => void;
+    onProducts?: (products: Product[]) => void;
+}
+
+// Streams /chat/stream (Server-Sent Events over a POST body) and resolves with the final answer
+export const streamChat = async (message: string, history: Message[], handlers: StreamHandlers = {}) => {
+    const minimalHistory = history.map(h => ({ role: h.role, content: h.content }));
+
+    const response = await fetch(`${API_URL}/chat/stream`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            ...sessionHeaders,
+        },
+        body: JSON.stringify({ message, history: minimalHistory }),
+    });
+
+    if (response.status === 429 || response.status === 503) {
+        throw await busyError(response);
+    }
+    if (!response.ok || !response.body) {
+        throw new Error('Network response was not ok');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let final: { role: string; content: string | null } | null = null;
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const raw = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            const event = raw.match(/^event: (.*)$/m)?.[1];
+            const data = raw.match(/^data: (.*)$/m)?.[1];
+            if (!event || !data) continue;
+            const payload = JSON.parse(data);
+
+            if (event === 'token') handlers.onToken?.(payload.content);
+            else if (event === 'tool_call') handlers.onToolCall?.(payload.name);
+            else if (event === 'products') handlers.onProducts?.(payload.products);
+            else if (event === 'done') final = payload;
+            else if (event === 'error') {
+                // Shed after the stream opened (still before any tool ran)
+                await reader.cancel();
+                throw new BusyError(payload.detail, payload.retry_after ?? null);
+            }
+        }
+    }
+
+    return final;
+};
@@ -3,7 +3,7 @@ import type { Message, Product } from '../types';
 import { MessageBubble } from './MessageBubble';
 // import { Send, ShoppingBag } from 'lucide-react';
 import { Send } from 'lucide-react';
-import { sendChat } from '../api';
+import { BusyError, streamChat } from '../api';
 
 interface ChatInterfaceProps {
     messages: Message[];
@@ -39,27 +39,46 @@ export const ChatInterface: React.FC<ChatInterfaceProps> = ({ messages, setMessa
             // Exclude system message from API call as backend adds it
             const history = messages.filter(m => m.role !== 'system');
 
-            // Call API
-            const response = await sendChat(input, history);
-            console.log('Chat Response:', response);
-
-            // Backend returns { role, content, tool_calls }
-            // If the content is empty but tool_calls exist, we might want to show something?
-            // But my backend loop handles tools and returns FINAL response.
-
-            const agentMsg: Message = {
-                role: 'assistant',
-                content: response.content || "I'm looking into that..." // Fallback if content is empty (e.g. pure tool call)
+            // Stream the reply into a placeholder bubble as tokens arrive
+            let streamedText = '';
+            let products: Product[] | undefined;
+            const placeholderIndex = messages.length + 1; // after the user message added above
+
+            const updateAgentMsg = (content: string) => {
+                setMessages(prev => {
+                    const next = [...prev];
+                    next[placeholderIndex] = { role: 'assistant', content, products };
+                    return next;
+                });
             };
 
-            setMessages(prev => [...prev, agentMsg]);
+            const response = await streamChat(input, history, {
+                onToken: (token) => {
+                    streamedText += token;
+                    updateAgentMsg(streamedText);
+                },
+                onToolCall: () => {
+                    // Tokens before a tool call are usually empty; the answer comes after the tool runs
+                    streamedText = '';
+                },
+                onProducts: (found) => {
+                    products = found;
+                    updateAgentMsg(streamedText);
+                },
+            });
+
+            // Backend sends the full final answer last
+            updateAgentMsg(response?.content || streamedText || "I'm looking into that..."); // Fallback if content is empty (e.g. pure tool call)
 
             // Trigger cart update (wait a bit to ensure backend tool exec is done - though await sendChat usually implies it)
             setTimeout(() => onChatUpdate(), 100);
 
         } catch (error) {
             console.error(error);
-            setMessages(prev => [...prev, { role: 'assistant', content: "I'm sorry, I'm having trouble connecting to the store right now." }]);
+            const content = error instanceof BusyError
+                ? `The store is very busy right now. Please try again${error.retryAfter ? ` in ${Math.ceil(error.retryAfter)} seconds` : ' shortly'}.`
+                : "I'm sorry, I'm having trouble connecting to the store right now.";
+            setMessages(prev => [...prev, { role: 'assistant', content }]);
         } finally {
             setIsLoading(false);
         }
@@ -17,6 +17,10 @@ export const MessageBubble: React.FC<MessageBubbleProps> = ({ message, onAddToCa
     // Attempt to parse JSON products if they appear in content (from tool output)
     // Or if the content is raw JSON array
     const parsedProducts = useMemo(() => {
+        // Products streamed on their own channel take priority over parsing content
+        if (message.products && message.products.length > 0) {
+            return message.products;
+        }
         try {
             // Check if content is a JSON array of products (from search_products tool)
             if (message.role === 'assistant' || message.role === 'tool') {
@@ -31,7 +35,7 @@ export const MessageBubble: React.FC<MessageBubbleProps> = ({ message, onAddToCa
             return null;
         }
         return null;
-    }, [message.content, message.role]);
+    }, [message.content, message.role, message.products]);
 
     return (
         <div className={clsx("flex gap-4 mb-6", isUser ? "flex-row-reverse" : "flex-row")}>
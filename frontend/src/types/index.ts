@@ -8,6 +8,17 @@ export interface Product {
     image: string;
 }
 
+export interface CartItem extends Product {
+    qty: number;
+}
+
+export interface CartState {
+    items: CartItem[];
+    count: number;
+    subtotal: number;
+    revision?: number;
+}
+
 export interface Message {
     role: 'user' | 'assistant' | 'system' | 'tool';
     content: string;